@@ -22,7 +22,19 @@ def create_app():
         from . import settings_handler
         
         ytdlp_handler.setup_directories()
-        ytdlp_handler.download_yt_dlp()
         settings_handler.load_settings()
 
     return app, socketio
+
+def start_background_tasks():
+    """キューの復元とダウンロードの再開などの常駐処理を開始する
+
+    ジャーナル・アーカイブ・索引へ書き込むため、サーバーとして動くプロセスで1回だけ呼ぶこと
+    （デバッグ時のリローダーの監視用プロセスでは呼ばない）
+    """
+    from . import sockets
+    sockets.restore_queue()
+    sockets.start_concurrency_controller()
+    sockets.start_library_scan()
+    # yt-dlp.exe の取得はサーバーの起動を待たせないようバックグラウンドで行う
+    sockets.start_bootstrap()
@@ -0,0 +1,160 @@
+import os
+import json
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# yt-dlp の --download-archive と同じ「抽出器名 動画ID」形式のファイル
+ARCHIVE_FILE = os.path.join(BASE_DIR, 'download_archive.txt')
+# ダウンロードした動画の「抽出器名 動画ID」を yt-dlp に書き出させるファイルの置き場所
+SPOOL_DIR = os.path.join(BASE_DIR, 'cache', 'archive')
+# 重複判定で無視する、共有リンクなどに付く追跡用のクエリパラメータ
+TRACKING_PARAMS = {'fbclid', 'gclid', 'si', 'feature'}
+# 正規化したURLのキーの接頭辞。yt-dlp の抽出器名と重ならないため、アーカイブファイルに並べて書いても無視される
+URL_KEY_PREFIX = 'url '
+
+# ダウンロード済みのキー
+_archived = set()
+# キューにある（待機中・実行中の）アイテムのキー -> item_id
+_queued = {}
+_lock = threading.Lock()
+
+def load():
+    """アーカイブファイルを読み込む"""
+    with _lock:
+        _archived.clear()
+        _archived.update(_read_keys(ARCHIVE_FILE))
+    return len(_archived)
+
+def import_file(path):
+    """既存のyt-dlpのアーカイブファイルを取り込み、追加した件数を返す"""
+    keys = _read_keys(path)
+    with _lock:
+        new_keys = [key for key in dict.fromkeys(keys) if key not in _archived]
+        _archived.update(new_keys)
+        _append(new_keys)
+    return len(new_keys)
+
+def _read_keys(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _append(keys):
+    """キーをアーカイブファイルに追記する（_lock 保持中に呼ぶ）"""
+    if not keys:
+        return
+    try:
+        with open(ARCHIVE_FILE, 'a', encoding='utf-8') as f:
+            f.writelines(f"{key}\n" for key in keys)
+    except Exception as e:
+        print(f"Error writing download archive: {e}")
+
+def archive_key(url):
+    """キュー追加時の重複判定用のキー（正規化したURL）を作る
+
+    抽出器を総当たりすると追加のたびに時間がかかるため、「抽出器名 動画ID」のキーは抽出後に rekey で加える
+    """
+    return f"{URL_KEY_PREFIX}{canonical_url(url)}"
+
+def is_url_key(key):
+    return bool(key) and key.startswith(URL_KEY_PREFIX)
+
+def canonical_url(url):
+    """スキーム（http/https）・www./m.・フラグメント・追跡用パラメータ・クエリの順序の違いを無視するようにURLを正規化する"""
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return url.strip()
+    scheme = parts.scheme.lower()
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name not in TRACKING_PARAMS and not name.startswith('utm_'))
+    return urlunsplit(('https' if scheme in ('http', 'https') else scheme, host,
+                       parts.path.rstrip('/') or '/', urlencode(query), ''))
+
+def entry_key(ie_key, video_id):
+    """フラット抽出したプレイリストのエントリからキーを作る"""
+    return f"{ie_key.lower()} {video_id}"
+
+def key_file(item_id):
+    """ダウンロードした動画の「抽出器名 動画ID」を yt-dlp に書き出させるファイル"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{item_id}.key")
+
+def take_key(item_id):
+    """書き出されたキーを読み出して、書き出し先のファイルを削除する（1つの動画に決まらなければ None）"""
+    spool_path = os.path.join(SPOOL_DIR, f"{item_id}.key")
+    try:
+        with open(spool_path, 'r', encoding='utf-8') as f:
+            lines = {line.strip() for line in f if line.strip()}
+        os.remove(spool_path)
+    except OSError:
+        return None
+    # プレイリストのURLをそのままダウンロードした場合は複数の動画のキーが書かれる
+    if len(lines) != 1:
+        return None
+    ie_key, _, video_id = lines.pop().partition(' ')
+    return entry_key(ie_key, video_id) if ie_key and video_id and 'NA' not in (ie_key, video_id) else None
+
+def read_info_key(path):
+    """先読みした情報JSONからキーを作る（動画の情報でなければ None）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if info.get('_type', 'video') != 'video' or not info.get('extractor_key') or not info.get('id'):
+        return None
+    return entry_key(info['extractor_key'], info['id'])
+
+def rekey(old_key, new_key, item_id):
+    """キューにあるアイテムのキーを抽出後に分かったキーに置き換える
+
+    同じURLをもう一度追加したときにも重複と分かるよう、正規化したURLのキーは外さずに残す
+    （完了時には両方のキーをアーカイブに追加する）。
+    新しいキーがダウンロード済みか別のアイテムでキューにあれば 'archived' / 'queued' を返す
+    """
+    with _lock:
+        if old_key and not is_url_key(old_key) and _queued.get(old_key) == item_id:
+            del _queued[old_key]
+        if new_key in _archived:
+            return 'archived'
+        if _queued.get(new_key, item_id) != item_id:
+            return 'queued'
+        _queued[new_key] = item_id
+    return None
+
+def find_duplicate(key):
+    """キーがダウンロード済みかキューにあれば 'archived' / 'queued' を返す"""
+    with _lock:
+        if key in _archived:
+            return 'archived'
+        if key in _queued:
+            return 'queued'
+    return None
+
+def mark_queued(key, item_id):
+    """キーをキューにあるものとして登録する"""
+    with _lock:
+        _queued[key] = item_id
+
+def unmark_queued(key, item_id):
+    """キューから外れたアイテムのキーを登録解除する"""
+    with _lock:
+        if _queued.get(key) == item_id:
+            del _queued[key]
+
+def add(key, item_id=None):
+    """ダウンロードが完了したキーをアーカイブに追加する"""
+    with _lock:
+        if item_id and _queued.get(key) == item_id:
+            del _queued[key]
+        if key not in _archived:
+            _archived.add(key)
+            _append([key])
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import subprocess
+import collections
+from . import ytdlp_handler, metrics
+
+# 進捗テンプレートやエラーは1行が長くなることがあるため、StreamReader の行長の上限を広げる
+STREAM_LIMIT = 1024 * 1024
+
+_loop = None
+_lock = threading.Lock()
+
+class CancelHandle:
+    """active_processes に登録するキャンセル用ハンドル（他のスレッドからも terminate できる）"""
+
+    def __init__(self, loop, process):
+        self._loop = loop
+        self._process = process
+
+    def terminate(self):
+        self._loop.call_soon_threadsafe(self._terminate)
+
+    def _terminate(self):
+        if self._process.returncode is None:
+            try:
+                self._process.terminate()
+            except ProcessLookupError:
+                pass
+
+def _get_loop():
+    """すべてのダウンロードを受け持つイベントループを（初回のみ）専用スレッドで起動する"""
+    global _loop
+    with _lock:
+        if _loop is None:
+            # Windowsの既定の ProactorEventLoop はサブプロセスに対応している
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-engine', daemon=True).start()
+        return _loop
+
+def submit(coroutine):
+    """コルーチンをイベントループ上で実行する（どのスレッドからでも呼べる）"""
+    return asyncio.run_coroutine_threadsafe(coroutine, _get_loop())
+
+async def run(command, on_line, register_handle):
+    """yt-dlpをイベントループ上のサブプロセスとして実行し、(終了コード, stderrの末尾行) を返す"""
+    with metrics.timed('subprocess_spawn_seconds', engine='asyncio'):
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.PIPE, limit=STREAM_LIMIT,
+                                                       creationflags=subprocess.CREATE_NO_WINDOW)
+    loop = asyncio.get_running_loop()
+    # 登録はキューのロックを取るため、スレッドプールで行う
+    await loop.run_in_executor(None, register_handle, CancelHandle(loop, process))
+    stderr_tail = collections.deque(maxlen=ytdlp_handler.STDERR_TAIL_LINES)
+
+    async def drain(stream, tail=None):
+        async for raw_line in stream:
+            line = raw_line.decode('utf-8', errors='ignore')
+            if tail is not None and line.strip():
+                tail.append(line.strip())
+            on_line(line)
+
+    # stdout と stderr を同時に読み出し、どちらかのパイプが詰まって子プロセスが止まるのを防ぐ
+    await asyncio.gather(drain(process.stdout), drain(process.stderr, stderr_tail))
+    return await process.wait(), list(stderr_tail)
@@ -0,0 +1,119 @@
+import logging
+from . import socketio, settings_handler, metrics
+
+# スループットを計測する間隔（秒）と、判断に使う計測回数
+SAMPLE_INTERVAL = 1
+DECISION_SAMPLES = 5
+# 同時数を増やしたときに「効果あり」とみなす増加率
+GAIN_THRESHOLD = 0.05
+# スループットがこの割合以上落ちたら同時数を半分にする
+DROP_THRESHOLD = 0.3
+# 減らした後、次に増やすまで様子を見る判断回数
+HOLD_DECISIONS = 3
+
+logger = logging.getLogger(__name__)
+
+_state = {'limit': None, 'baseline': None, 'last_action': None, 'hold': 0}
+_last_decision = {}
+_throughput_provider = None
+_on_change = None
+_started = False
+
+def is_enabled():
+    """自動調整モードが有効かどうか"""
+    return bool(settings_handler.get_setting('general', {}).get('autoConcurrency', False))
+
+def get_bounds():
+    """設定された同時ダウンロード数の下限・上限を返す"""
+    general = settings_handler.get_setting('general', {})
+    min_limit = max(int(general.get('minConcurrentDownloads', 1)), 1)
+    max_limit = max(int(general.get('maxConcurrentDownloads', 10)), min_limit)
+    return min_limit, max_limit
+
+def current_limit(default):
+    """現在の同時ダウンロード数を返す（自動調整が無効なら default）"""
+    if not is_enabled():
+        return default
+    min_limit, max_limit = get_bounds()
+    if _state['limit'] is None:
+        _state['limit'] = default
+    return min(max(_state['limit'], min_limit), max_limit)
+
+def decide(state, throughput, running, waiting, min_limit, max_limit):
+    """AIMD方式で次の同時数を決める。state は変更せず、新しい状態と理由を返す"""
+    limit = min(max(state['limit'], min_limit), max_limit)
+    baseline = state['baseline']
+    new_state = dict(state, limit=limit, baseline=throughput, hold=max(state['hold'] - 1, 0))
+
+    if running < limit:
+        # スロットが埋まっていない間は回線の限界を測れないので何もしない
+        new_state.update(baseline=None, last_action='hold')
+        return new_state, 'idle'
+    if baseline is not None and throughput < baseline * (1 - DROP_THRESHOLD):
+        new_state.update(limit=max(min_limit, limit // 2), last_action='decrease', hold=HOLD_DECISIONS)
+        return new_state, 'throughput_drop'
+    if state['last_action'] == 'increase' and baseline is not None and throughput < baseline * (1 + GAIN_THRESHOLD):
+        new_state.update(limit=max(min_limit, limit - 1), last_action='decrease', hold=HOLD_DECISIONS)
+        return new_state, 'no_gain'
+    if waiting > 0 and limit < max_limit and new_state['hold'] == 0:
+        new_state.update(limit=limit + 1, last_action='increase')
+        return new_state, 'probe'
+    new_state['last_action'] = 'hold'
+    return new_state, 'steady'
+
+def report_throttled():
+    """サーバーから帯域制限を受けたことを通知し、同時数を半分にする"""
+    if not is_enabled() or _state['limit'] is None:
+        return
+    min_limit, _ = get_bounds()
+    _state.update(limit=max(min_limit, _state['limit'] // 2), baseline=None, last_action='decrease', hold=HOLD_DECISIONS)
+    _publish({'limit': _state['limit'], 'throughput': None, 'reason': 'throttled'})
+
+def get_last_decision():
+    """直近の判断内容を返す"""
+    return dict(_last_decision)
+
+def start(throughput_provider, on_change):
+    """計測ループを開始する。throughput_provider は (合計バイト/秒, 実行中数, 待機数) を返す関数"""
+    global _throughput_provider, _on_change, _started
+    _throughput_provider, _on_change = throughput_provider, on_change
+    if not _started:
+        _started = True
+        socketio.start_background_task(target=_run)
+
+def _on_settings_changed(changed):
+    # 基準の同時数や自動調整の有無が変わったら、それまでの計測結果は使わずに調整をやり直す
+    if changed & {'general.autoConcurrency', 'general.concurrentDownloads'}:
+        _state.update(limit=None, baseline=None, last_action=None, hold=0)
+
+settings_handler.on_change(_on_settings_changed)
+
+def _publish(decision):
+    _last_decision.clear()
+    _last_decision.update(decision)
+    logger.info("Concurrency %s: limit=%s throughput=%s", decision['reason'], decision['limit'], decision['throughput'])
+    metrics.inc('socket_emits_total', event='concurrency_update')
+    socketio.emit('concurrency_update', decision)
+
+def _run():
+    """一定間隔でスループットを計測し、同時ダウンロード数を調整する"""
+    samples = []
+    while True:
+        socketio.sleep(SAMPLE_INTERVAL)
+        if not is_enabled():
+            samples.clear()
+            continue
+        throughput, running, waiting = _throughput_provider()
+        samples.append(throughput)
+        if len(samples) < DECISION_SAMPLES:
+            continue
+
+        average = sum(samples) / len(samples)
+        samples.clear()
+        min_limit, max_limit = get_bounds()
+        previous_limit = current_limit(int(settings_handler.get_setting('general', {}).get('concurrentDownloads', 1)))
+        new_state, reason = decide(dict(_state, limit=previous_limit), average, running, waiting, min_limit, max_limit)
+        _state.update(new_state)
+        if new_state['limit'] != previous_limit:
+            _publish({'limit': new_state['limit'], 'throughput': average, 'reason': reason})
+            _on_change()
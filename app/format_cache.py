@@ -0,0 +1,80 @@
+import time
+import threading
+import collections
+from urllib.parse import urlsplit, urlunsplit
+
+MAX_ENTRIES = 128
+TTL_SECONDS = 600
+
+# key -> (有効期限, 値)。末尾ほど最近使われたエントリ
+_entries = collections.OrderedDict()
+# key -> 実行中の取得処理。同じキーへの同時リクエストはこの結果を待って共有する
+_in_flight = {}
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'shared': 0, 'evictions': 0}
+
+def normalize_url(url):
+    """キャッシュキー用にURLを正規化する（スキーム/ホストの小文字化、フラグメント除去）"""
+    parts = urlsplit(url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+def make_key(url, cookie_browser=None):
+    """URLとCookieブラウザからキャッシュキーを作る"""
+    return (normalize_url(url), cookie_browser or 'none')
+
+def get_or_load(key, loader, cacheable=lambda value: True):
+    """キャッシュから値を返す。無ければ loader を1回だけ実行し、同時リクエストと結果を共有する"""
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return entry[1]
+        if entry:
+            del _entries[key]
+
+        call = _in_flight.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = {'event': threading.Event(), 'value': None, 'error': None}
+            _in_flight[key] = call
+            _stats['misses'] += 1
+        else:
+            _stats['shared'] += 1
+
+    if not is_leader:
+        call['event'].wait()
+        if call['error']:
+            raise call['error']
+        return call['value']
+
+    try:
+        call['value'] = loader()
+        return call['value']
+    except Exception as e:
+        call['error'] = e
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+            if call['error'] is None and cacheable(call['value']):
+                _store(key, call['value'])
+        call['event'].set()
+
+def _store(key, value):
+    """値を保存し、上限を超えた古いエントリを追い出す（_lock 保持中に呼ぶ）"""
+    _entries[key] = (time.monotonic() + TTL_SECONDS, value)
+    _entries.move_to_end(key)
+    while len(_entries) > MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats['evictions'] += 1
+
+def clear():
+    """キャッシュを空にする"""
+    with _lock:
+        _entries.clear()
+
+def get_stats():
+    """ヒット/ミス数などの統計を返す"""
+    with _lock:
+        return dict(_stats, size=len(_entries), in_flight=len(_in_flight))
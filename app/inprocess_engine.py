@@ -0,0 +1,130 @@
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from . import settings_handler
+
+# これらの設定が変わったら、次の投入から新しいワーカー数のプールを使う
+POOL_SIZE_SETTINGS = {'general.concurrentDownloads', 'general.autoConcurrency', 'general.maxConcurrentDownloads'}
+
+_executor = None
+_executor_size = None
+_manager = None
+_lock = threading.Lock()
+
+class CancelHandle:
+    """active_processes に登録するキャンセル用ハンドル（subprocess.Popen の terminate 互換）"""
+
+    def __init__(self, cancel_event):
+        self._cancel_event = cancel_event
+
+    def terminate(self):
+        self._cancel_event.set()
+
+def _pool_size():
+    """同時に実行されうるダウンロード数（自動調整が有効ならその上限）を返す"""
+    general = settings_handler.get_setting('general', {})
+    size = int(general.get('concurrentDownloads', 1))
+    if general.get('autoConcurrency'):
+        size = max(size, int(general.get('maxConcurrentDownloads', 10)))
+    return max(size, 1)
+
+def _get_executor():
+    global _executor, _executor_size, _manager
+    with _lock:
+        if _manager is None:
+            _manager = multiprocessing.Manager()
+        if _executor is None:
+            # 同時ダウンロード数より少ないと、開始済みのダウンロードがプールの空きを待ち続ける
+            _executor_size = _pool_size()
+            _executor = ProcessPoolExecutor(max_workers=_executor_size)
+        return _executor, _manager
+
+def _on_settings_changed(changed):
+    global _executor
+    if not changed & POOL_SIZE_SETTINGS:
+        return
+    with _lock:
+        if _executor is not None and _executor_size != _pool_size():
+            # 実行中のダウンロードはそのまま終わらせ、古いプールのワーカーはその後に終了する
+            _executor.shutdown(wait=False)
+            _executor = None
+
+settings_handler.on_change(_on_settings_changed)
+
+def run(args, on_progress, register_handle):
+    """yt-dlpの引数でダウンロードをプロセスプール上で実行し、(終了コード, エラー出力の末尾行) を返す"""
+    executor, manager = _get_executor()
+    events = manager.Queue()
+    cancel_event = manager.Event()
+    register_handle(CancelHandle(cancel_event))
+
+    future = executor.submit(_download_worker, args, events, cancel_event)
+    future.add_done_callback(lambda f: events.put(None))
+
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        on_progress(event)
+
+    try:
+        result = future.result()
+    except Exception as e:
+        return 1, [str(e)]
+    return result['returncode'], [result['error']] if result.get('error') else []
+
+class _ErrorLogger:
+    """yt-dlpのログのうち最後のエラーだけを保持するロガー"""
+
+    def __init__(self):
+        self.last_error = ''
+
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+    def error(self, msg):
+        self.last_error = msg
+
+def _download_worker(args, events, cancel_event):
+    """プールのワーカープロセスで yt_dlp.YoutubeDL を使ってダウンロードする"""
+    import yt_dlp
+    from yt_dlp.utils import DownloadCancelled
+
+    def progress_hook(d):
+        if cancel_event.is_set():
+            raise DownloadCancelled()
+        if d.get('status') == 'downloading':
+            events.put({
+                'downloaded_bytes': d.get('downloaded_bytes'),
+                'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate'),
+                'speed': d.get('speed'),
+                'eta': d.get('eta'),
+                'fragment_index': d.get('fragment_index'),
+                'fragment_count': d.get('fragment_count'),
+            })
+
+    def postprocessor_hook(d):
+        if cancel_event.is_set():
+            raise DownloadCancelled()
+
+    logger = _ErrorLogger()
+    parsed = yt_dlp.parse_options(args)
+    ydl_opts = dict(parsed.ydl_opts, logger=logger, noprogress=True,
+                    progress_hooks=[progress_hook], postprocessor_hooks=[postprocessor_hook])
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            if parsed.options.load_info_filename is not None:
+                returncode = ydl.download_with_info_file(parsed.options.load_info_filename)
+            else:
+                returncode = ydl.download(parsed.urls)
+    except DownloadCancelled:
+        return {'returncode': 1, 'error': 'cancelled'}
+    except Exception as e:
+        return {'returncode': 1, 'error': logger.last_error or str(e)}
+    return {'returncode': returncode, 'error': logger.last_error}
@@ -0,0 +1,261 @@
+import os
+import abc
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# ジョブの受け渡しに使うバックエンドの既定値（環境変数 GUI_YTDLP_JOB_BACKEND で変更できる）
+DEFAULT_BACKEND = 'sqlite:' + os.path.join(BASE_DIR, 'jobs.db')
+# ワーカーはこの秒数ごとにリースを延長する。延長されずに期限が切れたジョブは待機に戻す
+LEASE_SECONDS = 30
+# ジョブAPIで受け付けるリースの秒数の上限
+MAX_LEASE_SECONDS = 600
+# ワーカーの異常終了でリースが切れた回数がこれを超えたら、ジョブを失敗として終える
+MAX_LEASE_EXPIRIES = 3
+# GetDriveTypeW の戻り値のうち、ネットワークドライブを表す値
+DRIVE_REMOTE = 4
+# ジョブAPIの認証に使うトークンを設定する環境変数と、ワーカーがトークンを送るヘッダー
+WORKER_TOKEN_ENV = 'GUI_YTDLP_WORKER_TOKEN'
+WORKER_TOKEN_HEADER = 'X-Worker-Token'
+# ジョブAPIへのリクエストのタイムアウト（秒）
+HTTP_TIMEOUT = 10
+
+class WorkerJobBackend(abc.ABC):
+    """ワーカーがジョブを受け取って結果を返すためのバックエンドのインターフェース"""
+
+    @abc.abstractmethod
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        """待機中のジョブを1件リースして (ジョブID, ペイロード) を返す（無ければ None）"""
+
+    @abc.abstractmethod
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        """リースを延長する。リースを失った・キャンセルされた場合は False"""
+
+    @abc.abstractmethod
+    def report_progress(self, job_id, worker_id, data):
+        """進捗イベントを送る"""
+
+    @abc.abstractmethod
+    def finish(self, job_id, worker_id, returncode, stderr_tail, result=None):
+        """ジョブの結果を送る（リースを失っていた場合は無視される）
+
+        result はUIノードのアーカイブ・ライブラリに反映する内容（{'archive_key', 'files'}）
+        """
+
+class JobBackend(WorkerJobBackend):
+    """UIノードとワーカーの間でジョブを受け渡すバックエンドのインターフェース（UIノードはこちらを使う）
+
+    ジョブの状態は queued -> leased -> finished と進み、ワーカーの進捗と結果はイベントとして
+    UIノードに届く。イベントは (連番, ジョブID, 種類, データ) で、種類は progress / requeued / finished
+    """
+
+    @abc.abstractmethod
+    def submit(self, job_id, payload):
+        """ジョブを待機状態で登録する"""
+
+    @abc.abstractmethod
+    def cancel(self, job_id):
+        """ジョブをキャンセルする。実行中ならワーカーが次のハートビートで中止する"""
+
+    @abc.abstractmethod
+    def cancel_all(self):
+        """終わっていないすべてのジョブをキャンセルする（UIノードの起動時に呼ぶ）"""
+
+    @abc.abstractmethod
+    def requeue_expired(self, max_expiries=MAX_LEASE_EXPIRIES):
+        """リースの期限が切れたジョブを待機に戻す（回数を超えたものは失敗にする）"""
+
+    @abc.abstractmethod
+    def events_since(self, seq, limit=1000):
+        """指定した連番より後のイベントを返す"""
+
+    @abc.abstractmethod
+    def prune(self, seq):
+        """受け取り済みのイベントと、終了済みのジョブを削除する"""
+
+class SqliteJobBackend(JobBackend):
+    """SQLiteファイルを使うバックエンド。UIノードと同じマシン上の複数のワーカーから使える
+
+    WALモードのロックは共有メモリを使うため、ネットワークドライブ上のファイルは複数のマシンから安全に使えない。
+    別のマシンのワーカーは HttpJobBackend でUIノード経由でこのバックエンドを使う
+    """
+
+    def __init__(self, path):
+        if _is_network_path(path):
+            raise ValueError(f"SQLite job backend must be on a local disk: {path}")
+        self.path = path
+        self._local = threading.local()
+        # executescript は自前でコミットするため、トランザクションの外で実行する
+        self._connection().executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL,
+                worker TEXT, lease_until REAL, expiries INTEGER NOT NULL DEFAULT 0,
+                cancelled INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, kind TEXT NOT NULL, data TEXT
+            );
+        """)
+
+    def _connection(self):
+        # sqlite3 の接続はスレッド間で共有できないため、スレッドごとに持つ
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @staticmethod
+    def _event(db, job_id, kind, data=None):
+        db.execute('INSERT INTO events (job_id, kind, data) VALUES (?, ?, ?)',
+                   (job_id, kind, json.dumps(data) if data is not None else None))
+
+    def submit(self, job_id, payload):
+        with self._transaction() as db:
+            db.execute("INSERT INTO jobs (id, payload, status, created_at) VALUES (?, ?, 'queued', ?)",
+                       (job_id, json.dumps(payload), time.time()))
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        with self._transaction() as db:
+            row = db.execute("SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+            if not row:
+                return None
+            db.execute("UPDATE jobs SET status = 'leased', worker = ?, lease_until = ? WHERE id = ?",
+                       (worker_id, time.time() + lease_seconds, row[0]))
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased' "
+                                "AND cancelled = 0", (time.time() + lease_seconds, job_id, worker_id))
+        return cursor.rowcount == 1
+
+    def report_progress(self, job_id, worker_id, data):
+        with self._transaction() as db:
+            self._event(db, job_id, 'progress', data)
+
+    def finish(self, job_id, worker_id, returncode, stderr_tail, result=None):
+        data = {'returncode': returncode, 'stderr_tail': stderr_tail}
+        if result:
+            data['result'] = result
+        with self._transaction() as db:
+            cursor = db.execute("UPDATE jobs SET status = 'finished' WHERE id = ? AND worker = ? AND status = 'leased'",
+                                (job_id, worker_id))
+            if cursor.rowcount == 1:
+                self._event(db, job_id, 'finished', data)
+
+    def cancel(self, job_id):
+        with self._transaction() as db:
+            self._cancel(db, job_id)
+
+    def _cancel(self, db, job_id):
+        cursor = db.execute("UPDATE jobs SET status = 'finished' WHERE id = ? AND status = 'queued'", (job_id,))
+        if cursor.rowcount == 1:
+            self._event(db, job_id, 'finished', {'returncode': 1, 'stderr_tail': ['cancelled']})
+        else:
+            db.execute("UPDATE jobs SET cancelled = 1 WHERE id = ? AND status = 'leased'", (job_id,))
+
+    def cancel_all(self):
+        with self._transaction() as db:
+            for (job_id,) in db.execute("SELECT id FROM jobs WHERE status != 'finished'").fetchall():
+                self._cancel(db, job_id)
+
+    def requeue_expired(self, max_expiries=MAX_LEASE_EXPIRIES):
+        with self._transaction() as db:
+            expired = db.execute("SELECT id, expiries, cancelled FROM jobs WHERE status = 'leased' AND lease_until < ?",
+                                 (time.time(),)).fetchall()
+            for job_id, expiries, cancelled in expired:
+                if cancelled or expiries + 1 >= max_expiries:
+                    db.execute("UPDATE jobs SET status = 'finished' WHERE id = ?", (job_id,))
+                    reason = 'cancelled' if cancelled else 'Worker lost (lease expired)'
+                    self._event(db, job_id, 'finished', {'returncode': 1, 'stderr_tail': [reason]})
+                else:
+                    db.execute("UPDATE jobs SET status = 'queued', worker = NULL, expiries = ? WHERE id = ?",
+                               (expiries + 1, job_id))
+                    self._event(db, job_id, 'requeued')
+        return len(expired)
+
+    def events_since(self, seq, limit=1000):
+        rows = self._connection().execute('SELECT seq, job_id, kind, data FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+                                          (seq, limit)).fetchall()
+        return [(row[0], row[1], row[2], json.loads(row[3]) if row[3] is not None else None) for row in rows]
+
+    def prune(self, seq):
+        with self._transaction() as db:
+            db.execute('DELETE FROM events WHERE seq <= ?', (seq,))
+            db.execute("DELETE FROM jobs WHERE status = 'finished' AND id NOT IN (SELECT job_id FROM events)")
+
+class HttpJobBackend(WorkerJobBackend):
+    """UIノードのジョブAPI（/api/jobs）を使うワーカー用のバックエンド。別のマシンのワーカーはこちらを使う
+
+    UIノードは自分のバックエンド（SQLite）のリースをHTTPで中継する。
+    UIノードとワーカーの両方で環境変数 GUI_YTDLP_WORKER_TOKEN に同じ値を設定すること
+    """
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip('/')
+        self._session = requests.Session()
+        self._session.headers[WORKER_TOKEN_HEADER] = token or os.environ.get(WORKER_TOKEN_ENV, '')
+
+    def _post(self, path, **data):
+        response = self._session.post(f"{self.base_url}/api/jobs/{path}", json=data, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker_id, lease_seconds=LEASE_SECONDS):
+        job = self._post('lease', worker_id=worker_id, lease_seconds=lease_seconds)['job']
+        return (job['id'], job['payload']) if job else None
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        return self._post(f"{job_id}/heartbeat", worker_id=worker_id, lease_seconds=lease_seconds)['leased']
+
+    def report_progress(self, job_id, worker_id, data):
+        self._post(f"{job_id}/progress", worker_id=worker_id, data=data)
+
+    def finish(self, job_id, worker_id, returncode, stderr_tail, result=None):
+        self._post(f"{job_id}/finish", worker_id=worker_id, returncode=returncode, stderr_tail=stderr_tail,
+                   result=result)
+
+def _is_network_path(path):
+    """UNCパス・ネットワークドライブ上のパスかどうか"""
+    path = os.path.abspath(path)
+    if path.startswith(('\\\\', '//')):
+        return True
+    drive = os.path.splitdrive(path)[0]
+    if os.name != 'nt' or not drive:
+        return False
+    import ctypes
+    return ctypes.windll.kernel32.GetDriveTypeW(drive + '\\') == DRIVE_REMOTE
+
+# バックエンドの種類 -> 場所からバックエンドを作る関数。Redis互換のサーバーなどを使う場合はここに登録する
+BACKENDS = {
+    'sqlite': SqliteJobBackend,
+    'http': lambda location: HttpJobBackend('http:' + location),
+    'https': lambda location: HttpJobBackend('https:' + location),
+}
+
+def open_backend(url=None):
+    """'種類:場所' 形式のURLからバックエンドを開く（例: sqlite:C:\\data\\jobs.db、http://192.168.1.10:5000）"""
+    url = url or os.environ.get('GUI_YTDLP_JOB_BACKEND') or DEFAULT_BACKEND
+    kind, _, location = url.partition(':')
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown job backend: {kind}")
+    return BACKENDS[kind](location)
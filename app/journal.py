@@ -0,0 +1,106 @@
+import os
+import json
+import queue
+import atexit
+import threading
+from . import socketio
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+JOURNAL_FILE = os.path.join(BASE_DIR, 'queue_journal.jsonl')
+# この件数を書き込むごとにジャーナルをスナップショット1行に圧縮する
+COMPACT_EVERY = 1000
+
+_pending = queue.Queue()
+_write_lock = threading.Lock()
+_snapshot_provider = None
+_writer_started = False
+
+def record(change):
+    """キューの変更をジャーナルへの書き込み待ちに積む（書き込み自体は別スレッド）"""
+    _pending.put(change)
+
+def load():
+    """ジャーナルを再生し、(キューの内容, 記録済みの最大のバージョン) を返す
+
+    再起動後もバージョンはこの続きから振る。番号が巻き戻ると、圧縮に失敗して古いスナップショットが
+    残った場合に、その後の変更がスナップショットより古いものとして読み飛ばされてしまう
+    """
+    queue_items = {}
+    snapshot_version = -1
+    last_version = 0
+    if not os.path.exists(JOURNAL_FILE):
+        return queue_items, last_version
+    try:
+        with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # クラッシュ時の書きかけの行は読み飛ばす
+                    continue
+                op = entry.get('op')
+                last_version = max(last_version, entry.get('version', 0))
+                if op == 'snapshot':
+                    queue_items, snapshot_version = entry['queue'], entry['version']
+                elif entry.get('version', 0) <= snapshot_version:
+                    # スナップショットに含まれている変更
+                    continue
+                elif op in ('added', 'updated'):
+                    queue_items[entry['id']] = entry['item']
+                elif op == 'removed':
+                    queue_items.pop(entry['id'], None)
+    except Exception as e:
+        print(f"Error loading queue journal: {e}")
+    return queue_items, last_version
+
+def start(snapshot_provider):
+    """書き込みスレッドを開始する。snapshot_provider は (バージョン, キューのコピー) を返す関数"""
+    global _snapshot_provider, _writer_started
+    _snapshot_provider = snapshot_provider
+    compact()
+    if not _writer_started:
+        _writer_started = True
+        socketio.start_background_task(target=_run_writer)
+        atexit.register(flush)
+
+def compact():
+    """現在のキューをスナップショット1行として書き出し、ジャーナルを置き換える"""
+    version, queue_items = _snapshot_provider()
+    tmp_path = JOURNAL_FILE + '.tmp'
+    with _write_lock:
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'op': 'snapshot', 'version': version, 'queue': queue_items}, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, JOURNAL_FILE)
+        except Exception as e:
+            print(f"Error compacting queue journal: {e}")
+
+def flush(entries=None):
+    """書き込み待ちの変更をすべてファイルへ追記し、書き込んだ件数を返す"""
+    entries = entries or []
+    while True:
+        try:
+            entries.append(_pending.get_nowait())
+        except queue.Empty:
+            break
+    if not entries:
+        return 0
+    with _write_lock:
+        try:
+            with open(JOURNAL_FILE, 'a', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+        except Exception as e:
+            print(f"Error writing queue journal: {e}")
+    return len(entries)
+
+def _run_writer():
+    """変更を待ち受けてまとめて追記し、一定件数ごとに圧縮する"""
+    written = 0
+    while True:
+        # 最初の1件が届くまで待ってから、溜まっている分をまとめて書き込む
+        written += flush([_pending.get()])
+        if written >= COMPACT_EVERY:
+            compact()
+            written = 0
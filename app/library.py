@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+import contextlib
+from . import socketio
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY_DB = os.path.join(BASE_DIR, 'library.db')
+# yt-dlp に保存先のパスを書き出させるファイルの置き場所
+SPOOL_DIR = os.path.join(BASE_DIR, 'cache', 'library')
+
+# 索引に含めるファイルの拡張子
+MEDIA_EXTENSIONS = {
+    'mp4', 'mkv', 'webm', 'mov', 'avi', 'flv', 'm4v', '3gp', 'ts',
+    'm4a', 'mp3', 'opus', 'ogg', 'oga', 'wav', 'flac', 'aac', 'wma',
+}
+# 検索結果の並び順 -> ORDER BY 句
+SORT_ORDERS = {
+    'recent': 'mtime_ns DESC',
+    'title': 'title COLLATE NOCASE',
+    'size': 'size DESC',
+}
+MAX_SEARCH_LIMIT = 500
+
+# 「タイトル [動画ID].f書式ID.拡張子」形式のファイル名（動画ID・書式IDは省略可）
+FILENAME_PATTERN = re.compile(r'^(?P<title>.*?)(?: \[(?P<id>[\w-]{6,})\])?(?:\.f(?P<format>[\w-]+))?$')
+
+_local = threading.local()
+_scan_lock = threading.Lock()
+_scanning = False
+_schema_ready = False
+
+def _connection():
+    # sqlite3 の接続はスレッド間で共有できないため、スレッドごとに持つ
+    global _schema_ready
+    db = getattr(_local, 'db', None)
+    if db is None:
+        db = sqlite3.connect(LIBRARY_DB, timeout=30, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        _local.db = db
+    if not _schema_ready:
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, root TEXT NOT NULL, name TEXT NOT NULL, title TEXT NOT NULL,
+                video_id TEXT, ext TEXT NOT NULL, format TEXT, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+                url TEXT, item_id TEXT, search_text TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS files_root ON files (root);
+            CREATE INDEX IF NOT EXISTS files_mtime ON files (mtime_ns);
+            CREATE TABLE IF NOT EXISTS roots (path TEXT PRIMARY KEY, scanned_at REAL);
+        """)
+        _schema_ready = True
+    return db
+
+@contextlib.contextmanager
+def _transaction():
+    db = _connection()
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        yield db
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+    db.execute('COMMIT')
+
+def _normalize(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def _search_text(*values):
+    return ' '.join(value for value in values if value).lower()
+
+def _parse_name(path):
+    """ファイル名からタイトル・動画ID・書式ID・拡張子を取り出す"""
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    match = FILENAME_PATTERN.match(stem)
+    return name, match['title'] or stem, match['id'], match['format'], ext.lstrip('.').lower()
+
+def _file_row(path, root, size, mtime_ns, title=None, video_id=None, file_format=None, url=None, item_id=None):
+    name, parsed_title, parsed_id, parsed_format, ext = _parse_name(path)
+    title, video_id, file_format = title or parsed_title, video_id or parsed_id, file_format or parsed_format
+    return (path, root, name, title, video_id, ext, file_format, size, mtime_ns,
+            url, item_id, _search_text(title, name, video_id))
+
+def add_root(path):
+    """保存先フォルダを索引の対象に加え、正規化したパスを返す（既に対象なら何もしない）"""
+    root = _normalize(path)
+    with _transaction() as db:
+        db.execute('INSERT OR IGNORE INTO roots (path) VALUES (?)', (root,))
+    return root
+
+def get_roots():
+    return [row[0] for row in _connection().execute('SELECT path FROM roots ORDER BY path')]
+
+def path_file(item_id):
+    """ダウンロードしたファイルのパスを yt-dlp に書き出させるファイル"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{item_id}.path")
+
+def take_paths(item_id):
+    """書き出されたファイルのパスを読み出して、書き出し先のファイルを削除する"""
+    spool_path = os.path.join(SPOOL_DIR, f"{item_id}.path")
+    try:
+        with open(spool_path, 'r', encoding='utf-8') as f:
+            # 先読み情報での失敗からの再実行で同じパスが重複して書かれることがある
+            paths = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        os.remove(spool_path)
+    except OSError:
+        return []
+    return paths
+
+def describe_files(paths):
+    """保存したファイルのパス・サイズ・更新時刻を返す（ワーカーからUIノードへ送る形式）"""
+    files = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append({'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    return files
+
+def index_item(item, paths):
+    """完了したダウンロードのファイルを、再走査せずにその場で索引に加える"""
+    return index_files(item, describe_files(paths))
+
+def index_files(item, files):
+    """describe_files の形式のファイルを索引に加える（ワーカーが別のマシンで保存したファイルにも使う）"""
+    options = item.get('options', {})
+    save_path = options.get('savePath')
+    # 重複判定のキーが「抽出器名 動画ID」形式なら、動画IDとして使う
+    key = item.get('archive_key') or ''
+    video_id = key.split(' ', 1)[1] if key and not key.startswith('url ') else None
+    file_format = options.get('audioFormat') if options.get('audioOnly') else options.get('selectedFormat')
+    rows = []
+    for file in files:
+        path = _normalize(file['path'])
+        root = add_root(save_path) if save_path and path.startswith(_normalize(save_path) + os.sep) \
+            else add_root(os.path.dirname(path))
+        rows.append(_file_row(path, root, file['size'], file['mtime_ns'], item.get('title'), video_id, file_format,
+                              item.get('url'), item['id']))
+    if not rows:
+        return 0
+    with _transaction() as db:
+        db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    return len(rows)
+
+def scan(root):
+    """保存先フォルダを走査し、更新時刻・サイズが変わったファイルだけを索引に反映する
+
+    戻り値は (追加・更新した件数, 削除した件数)
+    """
+    root = add_root(root)
+    known = {path: (mtime_ns, size) for path, mtime_ns, size in
+             _connection().execute('SELECT path, mtime_ns, size FROM files WHERE root = ?', (root,))}
+    seen, changed = set(), []
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False) or \
+                            os.path.splitext(entry.name)[1].lstrip('.').lower() not in MEDIA_EXTENSIONS:
+                        continue
+                    # Windowsでは os.scandir が取得済みの情報を返すため、ファイルごとのシステムコールは発生しない
+                    stat = entry.stat(follow_symlinks=False)
+                    path = os.path.normcase(entry.path)
+                    seen.add(path)
+                    if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                        changed.append(_file_row(path, root, stat.st_size, stat.st_mtime_ns))
+        except OSError as e:
+            print(f"Error scanning {directory}: {e}")
+    removed = [(path,) for path in known.keys() - seen]
+
+    with _transaction() as db:
+        # ダウンロード時に記録したタイトルなどは残し、サイズと更新時刻だけを更新する
+        db.executemany("""
+            INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns
+        """, changed)
+        db.executemany('DELETE FROM files WHERE path = ?', removed)
+        db.execute('UPDATE roots SET scanned_at = ? WHERE path = ?', (time.time(), root))
+    return len(changed), len(removed)
+
+def scan_all(roots=()):
+    """指定したフォルダを対象に加えたうえで、すべての対象フォルダを走査する"""
+    global _scanning
+    with _scan_lock:
+        if _scanning:
+            return False
+        _scanning = True
+    try:
+        for root in roots:
+            if root and os.path.isdir(root):
+                add_root(root)
+        for root in get_roots():
+            if os.path.isdir(root):
+                scan(root)
+    except Exception as e:
+        print(f"Error scanning library: {e}")
+    finally:
+        with _scan_lock:
+            _scanning = False
+    return True
+
+def start_scan(roots=()):
+    """バックグラウンドで走査を開始する"""
+    socketio.start_background_task(target=scan_all, roots=list(roots))
+
+def is_scanning():
+    return _scanning
+
+def search(query='', ext=None, root=None, sort='recent', limit=100, offset=0):
+    """タイトル・ファイル名・動画IDで索引を検索し、(総件数, ファイル一覧) を返す"""
+    conditions, params = [], []
+    for word in query.lower().split():
+        conditions.append("search_text LIKE ? ESCAPE '\\'")
+        params.append('%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+    if ext:
+        conditions.append('ext = ?')
+        params.append(ext.lower())
+    if root:
+        conditions.append('root = ?')
+        params.append(_normalize(root))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    limit = min(max(int(limit), 1), MAX_SEARCH_LIMIT)
+
+    db = _connection()
+    total = db.execute(f'SELECT COUNT(*) FROM files {where}', params).fetchone()[0]
+    rows = db.execute(f"""
+        SELECT path, name, title, video_id, ext, format, size, mtime_ns, url FROM files {where}
+        ORDER BY {SORT_ORDERS.get(sort, SORT_ORDERS['recent'])} LIMIT ? OFFSET ?
+    """, [*params, limit, max(int(offset), 0)]).fetchall()
+    files = [{'path': path, 'name': name, 'title': title, 'id': video_id, 'ext': ext, 'format': file_format,
+              'size': size, 'mtime': mtime_ns / 1e9, 'url': url}
+             for path, name, title, video_id, ext, file_format, size, mtime_ns, url in rows]
+    return total, files
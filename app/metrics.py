@@ -0,0 +1,186 @@
+import os
+import time
+import bisect
+import threading
+import contextlib
+import collections
+
+# 環境変数 GUI_YTDLP_METRICS=1 で有効にする。無効時は各関数が最初の判定だけで戻る
+ENABLED = os.environ.get('GUI_YTDLP_METRICS', '').lower() in ('1', 'true', 'yes')
+PREFIX = 'gui_ytdlp_'
+# 所要時間（秒）のヒストグラムのバケット
+TIME_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1800)
+# バイト数のヒストグラムのバケット
+BYTES_BUCKETS = tuple(1024 * 1024 * size for size in (1, 10, 50, 100, 500, 1024, 4096))
+# 直近のアイテムの所要時間の内訳を保持する件数
+ITEM_TIMINGS_LIMIT = 500
+
+# 名前 -> (種類, 説明, ヒストグラムのバケット)
+DEFINITIONS = {
+    'scheduler_passes_total': ('counter', 'start_next_download scheduling passes', None),
+    'scheduler_started_total': ('counter', 'Items started by the scheduler', None),
+    'downloads_finished_total': ('counter', 'Finished downloads by result', None),
+    'download_duration_seconds': ('histogram', 'Wall time of a download run including retries of the command', TIME_BUCKETS),
+    'download_bytes': ('histogram', 'Bytes transferred per finished download', BYTES_BUCKETS),
+    'download_bytes_total': ('counter', 'Total bytes transferred by finished downloads', None),
+    'subprocess_spawn_seconds': ('histogram', 'Time to spawn a yt-dlp or ffmpeg process', TIME_BUCKETS),
+    'format_extraction_seconds': ('histogram', 'yt-dlp extraction latency of get_available_formats (cache misses)', TIME_BUCKETS),
+    'info_prefetch_seconds': ('histogram', 'Latency of prefetching info JSON for upcoming items', TIME_BUCKETS),
+    'socket_emits_total': ('counter', 'Socket events emitted by event name', None),
+    'progress_items_total': ('counter', 'Per-item progress updates flushed to progress_batch events', None),
+    'lock_wait_seconds': ('histogram', 'Time spent waiting to acquire a lock', TIME_BUCKETS),
+    'lock_hold_seconds': ('histogram', 'Time a lock was held', TIME_BUCKETS),
+    'item_phase_seconds': ('histogram', 'Time items spent in each phase', TIME_BUCKETS),
+}
+
+_lock = threading.Lock()
+# (名前, ラベルのタプル) -> 値
+_counters = collections.defaultdict(float)
+# (名前, ラベルのタプル) -> [各バケットの件数..., 合計, 件数]
+_histograms = {}
+# 名前 -> (説明, 値を返す関数)
+_gauges = {}
+# item_id -> [(フェーズ, 開始時刻), ...]
+_item_phases = {}
+_item_timings = collections.deque(maxlen=ITEM_TIMINGS_LIMIT)
+_NULL_CONTEXT = contextlib.nullcontext()
+
+def inc(name, value=1, **labels):
+    """カウンターを増やす"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[(name, tuple(sorted(labels.items())))] += value
+
+def observe(name, value, **labels):
+    """ヒストグラムに値を記録する"""
+    if not ENABLED:
+        return
+    buckets = DEFINITIONS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # バケット数 + 上限なしのバケット + 合計 + 件数
+            histogram = _histograms[key] = [0] * (len(buckets) + 3)
+        histogram[bisect.bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+def timed(name, **labels):
+    """with ブロックの所要時間をヒストグラムに記録するコンテキストマネージャーを返す"""
+    if not ENABLED:
+        return _NULL_CONTEXT
+    return _Timer(name, labels)
+
+class _Timer:
+    def __init__(self, name, labels):
+        self._name, self._labels = name, labels
+
+    def __enter__(self):
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self._name, time.perf_counter() - self._started_at, **self._labels)
+
+def register_gauge(name, help_text, value_fn):
+    """出力時に value_fn() の値を返すゲージを登録する"""
+    _gauges[name] = (help_text, value_fn)
+
+def instrument_lock(lock, name):
+    """待ち時間と保持時間を計測するロックを返す（無効時は lock をそのまま返す）"""
+    return _InstrumentedLock(lock, name) if ENABLED else lock
+
+class _InstrumentedLock:
+    """with 文で使うロックの待ち時間・保持時間を記録するラッパー"""
+
+    def __init__(self, lock, name):
+        self._lock = lock
+        self._name = name
+        self._acquired_at = 0
+
+    def __enter__(self):
+        requested_at = time.perf_counter()
+        self._lock.acquire()
+        # ロックを保持している間は他のスレッドから書き換えられない
+        self._acquired_at = time.perf_counter()
+        observe('lock_wait_seconds', self._acquired_at - requested_at, lock=self._name)
+        return self
+
+    def __exit__(self, *exc_info):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        observe('lock_hold_seconds', held, lock=self._name)
+
+def mark(item_id, phase):
+    """アイテムが新しいフェーズ（queued / extracting / transferring / postprocessing）に入ったことを記録する"""
+    if not ENABLED:
+        return
+    with _lock:
+        phases = _item_phases.setdefault(item_id, [])
+        if not phases or phases[-1][0] != phase:
+            phases.append((phase, time.monotonic()))
+
+def finish_item(item_id, result):
+    """アイテムのフェーズごとの所要時間を集計する（完了・エラー・削除時に呼ぶ）"""
+    if not ENABLED:
+        return
+    now = time.monotonic()
+    with _lock:
+        phases = _item_phases.pop(item_id, None)
+    if not phases:
+        return
+    breakdown = collections.defaultdict(float)
+    for (phase, started_at), (_, ended_at) in zip(phases, phases[1:] + [('done', now)]):
+        breakdown[phase] += ended_at - started_at
+    for phase, seconds in breakdown.items():
+        observe('item_phase_seconds', seconds, phase=phase)
+    with _lock:
+        _item_timings.append({'id': item_id, 'result': result, 'total': now - phases[0][1],
+                              'phases': dict(breakdown)})
+
+def get_item_timings():
+    """直近のアイテムの所要時間の内訳を新しい順に返す"""
+    with _lock:
+        return list(reversed(_item_timings))
+
+def render():
+    """Prometheusのテキスト形式で全メトリクスを出力する"""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+
+    lines = []
+    for name, (kind, help_text, buckets) in DEFINITIONS.items():
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        if kind == 'counter':
+            for (metric, labels), value in counters.items():
+                if metric == name:
+                    lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+            continue
+        for (metric, labels), values in histograms.items():
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),), values[:-2]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values[-1]}")
+    for name, (help_text, value_fn) in _gauges.items():
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} gauge")
+        lines.append(f"{PREFIX}{name} {_format_value(value_fn())}")
+    return '\n'.join(lines) + '\n'
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
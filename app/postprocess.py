@@ -0,0 +1,169 @@
+import os
+import re
+import shlex
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from . import ytdlp_handler, settings_handler, metrics
+
+SPOOL_DIR = os.path.join(ytdlp_handler.BASE_DIR, 'cache', 'postprocess')
+
+# 音声抽出時の形式ごとのffmpegエンコード引数（yt-dlpの既定値に合わせる）
+AUDIO_CODEC_ARGS = {
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '5'],
+    'm4a': ['-c:a', 'aac', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '128k'],
+    'wav': ['-c:a', 'pcm_s16le'],
+}
+# これらのカスタム引数がある場合は、後処理をyt-dlpにそのまま任せる
+# （書式の指定・並び替えは、計画に合わせて付ける -f と食い違うため）
+YT_DLP_POSTPROCESS_ARGS = {
+    '-x', '--extract-audio', '--audio-format', '--merge-output-format', '--remux-video', '--recode-video',
+    '-k', '--keep-video', '-o', '--output', '--postprocessor-args', '--ppa', '--exec',
+    '-f', '--format', '-S', '--format-sort',
+}
+# yt-dlpと同じく、コンテナが揃っていればそのまま、そうでなければmkvに結合する
+MERGE_CONTAINERS = {('mp4', 'm4a'): 'mp4', ('mp4', 'mp4'): 'mp4', ('webm', 'webm'): 'webm'}
+
+_executor = None
+_lock = threading.Lock()
+
+class CancelHandle:
+    """後処理の開始前に active_processes に登録するキャンセル用ハンドル（subprocess.Popen の terminate 互換）"""
+
+    def __init__(self, pp_plan):
+        self._plan = pp_plan
+
+    def terminate(self):
+        self._plan['cancelled'] = True
+
+def find_ffmpeg():
+    """tools フォルダまたはPATH上のffmpegを探す"""
+    bundled = os.path.join(ytdlp_handler.TOOLS_DIR, 'ffmpeg.exe')
+    return bundled if os.path.exists(bundled) else shutil.which('ffmpeg')
+
+def plan(item):
+    """後処理を別ワーカーに分ける場合の計画を返す（yt-dlp内で処理すべき場合は None）"""
+    options = item.get('options', {})
+    if not settings_handler.get_setting('general', {}).get('separatePostprocessing', True) or not find_ffmpeg():
+        return None
+    custom_args = shlex.split(options.get('customArgs', ''))
+    if any(_is_postprocess_arg(arg) for arg in custom_args):
+        return None
+
+    files_path = os.path.join(SPOOL_DIR, f"{item['id']}.files")
+    selected_format = options.get('selectedFormat')
+    if selected_format and selected_format != 'custom':
+        # 「映像ID+音声ID」の単純な指定だけを、結合せずに個別のファイルとしてダウンロードさせる
+        parts = selected_format.split('+')
+        if len(parts) != 2 or re.search(r'[/,\[\]()]', selected_format):
+            return None
+        return _prepare({'kind': 'merge', 'format': ','.join(parts), 'files_path': files_path})
+    if options.get('audioOnly') and options.get('audioFormat', 'best') in AUDIO_CODEC_ARGS:
+        return _prepare({'kind': 'extract', 'format': 'bestaudio/best', 'audio_format': options['audioFormat'],
+                         'files_path': files_path})
+    return None
+
+def _is_postprocess_arg(arg):
+    """--name=値 や -f値 のように値を続けて書いた形も含めて判定する"""
+    if arg.startswith('--'):
+        return arg.split('=')[0] in YT_DLP_POSTPROCESS_ARGS
+    return arg[:2] in YT_DLP_POSTPROCESS_ARGS
+
+def _prepare(pp_plan):
+    """ダウンロード済みファイル一覧の出力先を用意する"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    _remove_file(pp_plan['files_path'])
+    return pp_plan
+
+def submit(pp_plan, register_process, on_done):
+    """後処理をワーカープールで実行する。終了時に on_done(終了コード, stderrの末尾行) を呼ぶ"""
+    def task():
+        try:
+            if pp_plan.get('cancelled'):
+                # プールの空きを待っている間に削除された
+                returncode, stderr_tail = 1, []
+            else:
+                returncode, stderr_tail = _run(pp_plan, register_process)
+        except Exception as e:
+            returncode, stderr_tail = 1, [str(e)]
+        finally:
+            _remove_file(pp_plan['files_path'])
+        on_done(returncode, stderr_tail)
+    _get_executor().submit(task)
+
+def _on_settings_changed(changed):
+    global _executor
+    if 'general.postprocessWorkers' in changed:
+        # 実行中の後処理はそのまま終わらせ、次の投入から新しいワーカー数のプールを使う
+        with _lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+settings_handler.on_change(_on_settings_changed)
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            default_workers = max((os.cpu_count() or 2) // 2, 1)
+            workers = settings_handler.get_setting('general', {}).get('postprocessWorkers', default_workers)
+            _executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix='postprocess')
+        return _executor
+
+def _run(pp_plan, register_process):
+    """ffmpegで結合・音声抽出を行う"""
+    with open(pp_plan['files_path'], 'r', encoding='utf-8') as f:
+        # 先読み情報での失敗からの再実行で同じパスが重複して書かれることがある
+        files = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+    ffmpeg = find_ffmpeg()
+    if pp_plan['kind'] == 'merge':
+        if len(files) != 2:
+            return 1, [f"Expected 2 downloaded streams, got {len(files)}"]
+        video_path, audio_path = files
+        base = re.sub(r'\.f[^.\\/]+$', '', os.path.splitext(video_path)[0])
+        container = MERGE_CONTAINERS.get((_ext(video_path), _ext(audio_path)), 'mkv')
+        output_path = f"{base}.{container}"
+        command = [ffmpeg, '-y', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+                   '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', output_path]
+    else:
+        source_path = files[-1]
+        audio_format = pp_plan['audio_format']
+        if _ext(source_path) == audio_format:
+            pp_plan['output_path'] = source_path
+            return 0, []
+        files = [source_path]
+        output_path = f"{os.path.splitext(source_path)[0]}.{audio_format}"
+        command = [ffmpeg, '-y', '-loglevel', 'error', '-i', source_path, '-vn',
+                   *AUDIO_CODEC_ARGS[audio_format], output_path]
+
+    with metrics.timed('subprocess_spawn_seconds', engine='ffmpeg'):
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, encoding='utf-8', errors='ignore',
+                                   creationflags=subprocess.CREATE_NO_WINDOW)
+    register_process(process)
+    if pp_plan.get('cancelled'):
+        # 起動してから登録するまでの間に削除された場合は、登録したプロセスを止める者がいない
+        process.terminate()
+    _, stderr = process.communicate()
+    stderr_tail = stderr.strip().split('\n')[-ytdlp_handler.STDERR_TAIL_LINES:] if stderr.strip() else []
+    if process.returncode == 0:
+        # 完了時にライブラリの索引へ加えるため、出力したファイルを計画に記録しておく
+        pp_plan['output_path'] = output_path
+        for path in files:
+            _remove_file(path)
+    else:
+        _remove_file(output_path)
+    return process.returncode, stderr_tail
+
+def _ext(path):
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from . import ytdlp_handler, metrics
+
+SPOOL_DIR = os.path.join(ytdlp_handler.BASE_DIR, 'cache', 'info')
+MAX_WORKERS = 2
+# 次に開始される待機アイテムのうち、先読みする件数
+LOOKAHEAD = 4
+# 情報JSON内の署名付きURLは時間が経つと失効するため、古いものは使わない
+INFO_TTL_SECONDS = 1800
+
+_executor = None
+# item_id -> {'future': Future, 'path': 完了時の情報JSONパス, 'finished_at': 完了時刻}
+_jobs = {}
+_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='prefetch')
+    return _executor
+
+def _spool_path(item_id):
+    return os.path.join(SPOOL_DIR, f'{item_id}.info.json')
+
+def schedule(items):
+    """待機中アイテムの情報JSONをバックグラウンドで先読みする"""
+    with _lock:
+        for item in items:
+            if item['id'] in _jobs:
+                continue
+            job = {'path': None, 'finished_at': None}
+            _jobs[item['id']] = job
+            job['future'] = _get_executor().submit(_extract, item['id'], item['url'], item.get('options', {}))
+
+def _extract(item_id, url, options):
+    """yt-dlpで情報JSONを取得してスプールディレクトリに保存する"""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    path = _spool_path(item_id)
+    tmp_path = path + '.part'
+    try:
+        command = ytdlp_handler.build_info_command(url, options)
+        if command is None:
+            # カスタム引数によっては先読みせず、ダウンロード時にURLから抽出させる
+            return
+        with open(tmp_path, 'w', encoding='utf-8') as f, metrics.timed('info_prefetch_seconds'):
+            result = subprocess.run(command, stdout=f, stderr=subprocess.DEVNULL, timeout=120,
+                                    creationflags=subprocess.CREATE_NO_WINDOW)
+        if result.returncode != 0 or os.path.getsize(tmp_path) == 0:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Error pre-extracting {url}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+
+    with _lock:
+        job = _jobs.get(item_id)
+        if job:
+            job.update({'path': path, 'finished_at': time.monotonic()})
+            return
+    # 取得中にアイテムが削除された場合はファイルを残さない
+    _remove_file(path)
+
+def take(item_id):
+    """先読み済みの情報JSONのパスを返す。未完了・失敗・期限切れの場合は None"""
+    with _lock:
+        job = _jobs.get(item_id)
+    if not job or not job['path']:
+        return None
+    if time.monotonic() - job['finished_at'] > INFO_TTL_SECONDS or not os.path.exists(job['path']):
+        discard(item_id)
+        return None
+    return job['path']
+
+def discard(item_id):
+    """先読みを取り消し、保存済みの情報JSONを削除する"""
+    with _lock:
+        job = _jobs.pop(item_id, None)
+    if not job:
+        return
+    job['future'].cancel()
+    if job['path']:
+        _remove_file(job['path'])
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,49 @@
+import threading
+from . import socketio, settings_handler, metrics, queue_events
+
+DEFAULT_INTERVAL_MS = 250
+
+# item_id -> 最後に送信してから届いた最新の進捗
+_pending = {}
+_lock = threading.Lock()
+_ticker_started = False
+
+def _interval():
+    """送信間隔（秒）を設定から取得する"""
+    interval_ms = settings_handler.get_setting('general', {}).get('progressIntervalMs', DEFAULT_INTERVAL_MS)
+    return max(int(interval_ms), 50) / 1000
+
+def push(item_id, progress_data):
+    """アイテムの最新進捗を記録する（次の送信タイミングでまとめて送られる）"""
+    global _ticker_started
+    with _lock:
+        _pending[item_id] = dict(progress_data, id=item_id)
+        if not _ticker_started:
+            _ticker_started = True
+            socketio.start_background_task(target=_run_ticker)
+
+def discard(item_id):
+    """未送信の進捗を破棄する（完了・キャンセル時に古い進捗で上書きされないように）"""
+    with _lock:
+        _pending.pop(item_id, None)
+
+def flush():
+    """溜まっている進捗を、クライアントごとに1つの progress_batch イベントとして送信する"""
+    with _lock:
+        if not _pending:
+            return
+        items = list(_pending.values())
+        _pending.clear()
+    metrics.inc('progress_items_total', len(items))
+    # 各クライアントには、見ているページにあるアイテムの進捗だけを送る
+    for sid, page_ids in queue_events.visible_ids().items():
+        page_items = [item for item in items if item['id'] in page_ids]
+        if page_items:
+            metrics.inc('socket_emits_total', event='progress_batch')
+            socketio.emit('progress_batch', {'items': page_items}, to=sid)
+
+def _run_ticker():
+    """一定間隔で進捗を送信し続ける"""
+    while True:
+        socketio.sleep(_interval())
+        flush()
@@ -0,0 +1,222 @@
+import uuid
+import bisect
+import itertools
+import threading
+import collections
+from . import socketio, journal, metrics
+
+# クライアントが1回に受け取るアイテム数（ページの大きさ）の既定値と上限
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+# 一覧の絞り込み -> 対象の状態（None はすべて）
+STATUS_FILTERS = {
+    'all': None,
+    'active': {'waiting', 'downloading', 'processing', 'expanding'},
+    'completed': {'completed'},
+    'failed': {'error', 'cancelled'},
+}
+# 再接続したクライアントに差分で追いつかせるために保持する変更履歴の件数
+HISTORY_LIMIT = 1000
+
+# サーバー起動ごとに変わるID。再起動を跨いだバージョン番号の取り違えを防ぐ
+epoch = str(uuid.uuid4())
+queue_version = 0
+_history = collections.deque(maxlen=HISTORY_LIMIT)
+
+# 絞り込み -> キューへの追加順に並べた [(追加順の番号, item_id)]。record のたびに更新し、送信時には作り直さない
+_filtered = {name: [] for name in STATUS_FILTERS}
+# item_id -> (追加順の番号, 一覧に反映済みの状態)
+_tracked = {}
+_order = itertools.count()
+
+# sid -> クライアントが見ているページ
+# version は反映済みの変更、sent はクライアントへ送ったバージョン、ids はページ内の item_id の並び
+_views = {}
+_views_lock = threading.Lock()
+_queue = None
+_queue_lock = None
+
+def bind(download_queue, queue_lock):
+    """ページの計算に使うキューとロックを登録する（起動時に呼ぶ）"""
+    global _queue, _queue_lock
+    _queue, _queue_lock = download_queue, queue_lock
+
+# record・track・restore_version・changes_since は sockets.queue_lock を保持した状態で呼び出すこと
+
+def restore_version(version):
+    """ジャーナルに記録済みのバージョンの続きから番号を振るようにする（起動時に呼ぶ）"""
+    global queue_version
+    queue_version = max(queue_version, version)
+
+def record(op, item=None, item_id=None):
+    """キューの変更（added / updated / removed）を記録して返す"""
+    global queue_version
+    queue_version += 1
+    change = {'op': op, 'version': queue_version, 'id': item['id'] if item else item_id}
+    if item is not None and op != 'removed':
+        change['item'] = dict(item)
+    _move(change['id'], change['item']['status'] if 'item' in change else None)
+    _history.append(change)
+    journal.record(change)
+    return change
+
+def track(item):
+    """ジャーナルから復元したアイテムを一覧に加える（変更としては記録しない）"""
+    _move(item['id'], item['status'])
+
+def _move(item_id, status):
+    """アイテムの状態（None は削除）に合わせて、絞り込みごとの並びを更新する"""
+    seq, old_status = _tracked.get(item_id, (None, None))
+    if seq is not None and old_status == status:
+        return
+    if seq is None:
+        if status is None:
+            return
+        seq = next(_order)
+    for name, statuses in STATUS_FILTERS.items():
+        was_listed = old_status is not None and (statuses is None or old_status in statuses)
+        is_listed = status is not None and (statuses is None or status in statuses)
+        if was_listed and not is_listed:
+            entries = _filtered[name]
+            del entries[bisect.bisect_left(entries, (seq, item_id))]
+        elif is_listed and not was_listed:
+            bisect.insort(_filtered[name], (seq, item_id))
+    if status is None:
+        del _tracked[item_id]
+    else:
+        _tracked[item_id] = (seq, status)
+
+def changes_since(version, client_epoch=None):
+    """指定バージョンより後の変更一覧を返す。履歴で追いつけない場合は None"""
+    if client_epoch != epoch or not isinstance(version, int) or version > queue_version:
+        return None
+    if version == queue_version:
+        return []
+    if not _history or _history[0]['version'] > version + 1:
+        return None
+    return [change for change in _history if change['version'] > version]
+
+def _page_ids(view):
+    entries = _filtered[view['filter']]
+    return [item_id for _, item_id in entries[view['offset']:view['offset'] + view['limit']]]
+
+def _counts():
+    return {name: len(entries) for name, entries in _filtered.items()}
+
+def _int(value, default, minimum, maximum):
+    """クライアントから受け取った数値を範囲内の整数にする（数値でなければ default）"""
+    try:
+        number = default if value is None or value == '' else int(value)
+    except (TypeError, ValueError, OverflowError):
+        number = default
+    return min(max(number, minimum), maximum)
+
+def _clean_view(view):
+    view = view if isinstance(view, dict) else {}
+    return {
+        'filter': view.get('filter') if view.get('filter') in STATUS_FILTERS else 'all',
+        'offset': _int(view.get('offset'), 0, 0, 2 ** 31),
+        'limit': _int(view.get('limit'), PAGE_SIZE, 1, MAX_PAGE_SIZE),
+    }
+
+def open_view(sid, view=None):
+    """クライアントの表示範囲（絞り込み・開始位置・件数）を設定し、そのページのスナップショットを返す"""
+    view = _clean_view(view)
+    with _queue_lock:
+        with _views_lock:
+            _views[sid] = view
+            return _snapshot(view)
+
+def resume_view(sid, view, client_epoch=None, version=None, ids=None):
+    """接続したクライアントの表示範囲を設定し、送るイベントを (イベント名, データ) で返す（送るものが無ければ None）
+
+    再接続したクライアントが前回受け取ったバージョンとページの並びを伝えてきた場合、
+    履歴で追いつけるならページに関係する差分だけのパッチ、追いつけなければスナップショットを送る
+    """
+    view = _clean_view(view)
+    with _queue_lock:
+        changes = changes_since(version, client_epoch)
+        with _views_lock:
+            _views[sid] = view
+            if changes is None or not isinstance(ids, list) or len(ids) > view['limit']:
+                return 'queue_snapshot', _snapshot(view)
+            # クライアントの手元にあるページを送信済みのものとして、その後の差分を組み立てる
+            ids = [str(item_id) for item_id in ids]
+            view.update({'version': version, 'sent': version, 'ids': ids, 'id_set': set(ids), 'counts': None})
+            if not changes:
+                view['counts'] = _counts()
+                return None
+            return _page_patch(view, changes)
+
+def snapshot(sid):
+    """クライアントが見ているページのスナップショットを返す"""
+    with _views_lock:
+        view = _views.get(sid)
+    return open_view(sid, view)
+
+def close_view(sid):
+    with _views_lock:
+        _views.pop(sid, None)
+
+def visible_ids():
+    """sid -> ページ内の item_id の集合 を返す（進捗の送信先の絞り込みに使う）"""
+    with _views_lock:
+        return {sid: view['id_set'] for sid, view in _views.items()}
+
+def _snapshot(view):
+    ids = _page_ids(view)
+    counts = _counts()
+    view.update({'version': queue_version, 'sent': queue_version, 'ids': ids, 'id_set': set(ids), 'counts': counts})
+    return {
+        'epoch': epoch, 'version': queue_version,
+        'filter': view['filter'], 'offset': view['offset'], 'limit': view['limit'],
+        'total': len(_filtered[view['filter']]), 'counts': counts,
+        'items': [dict(_queue[item_id]) for item_id in ids],
+    }
+
+def _page_patch(view, changes):
+    """1つのクライアント向けに、ページに関係する変更だけのパッチを組み立てる（送るものが無ければ None）"""
+    changes = [change for change in changes if change['version'] > view['version']]
+    if not changes:
+        return None
+    if changes[0]['version'] != view['version'] + 1:
+        # 別スレッドの送信と前後して間の変更を取りこぼしたため、現在のページを送り直す
+        return 'queue_snapshot', _snapshot(view)
+
+    ids = _page_ids(view)
+    id_set = set(ids)
+    # ページから外れたアイテムは ids の並びで伝わるため、ページ内のアイテムの変更だけを送る
+    page_changes = [change for change in changes if 'item' in change and change['id'] in id_set]
+    counts = _counts()
+    ids_changed = ids != view['ids']
+    view['version'] = changes[-1]['version']
+    if not page_changes and not ids_changed and counts == view.get('counts'):
+        # このクライアントの表示に影響しない変更は送らない
+        return None
+
+    patch = {'epoch': epoch, 'base': view['sent'], 'version': view['version'],
+             'total': len(_filtered[view['filter']]), 'counts': counts, 'changes': page_changes}
+    if ids_changed:
+        # ページに入ってきたアイテムは、変更に含まれていなくても内容を送る
+        changed_ids = {change['id'] for change in page_changes}
+        patch['ids'] = ids
+        page_changes.extend({'op': 'updated', 'id': item_id, 'item': dict(_queue[item_id])}
+                            for item_id in ids if item_id not in view['id_set'] and item_id not in changed_ids)
+        view.update({'ids': ids, 'id_set': id_set})
+    view.update({'sent': view['version'], 'counts': counts})
+    return 'queue_patch', patch
+
+def publish(changes):
+    """記録済みの変更を、各クライアントが見ているページに関係する分だけ送信する"""
+    if not changes:
+        return
+    outgoing = []
+    with _queue_lock:
+        with _views_lock:
+            for sid, view in _views.items():
+                message = _page_patch(view, changes)
+                if message:
+                    outgoing.append((sid, message))
+    for sid, (event, payload) in outgoing:
+        metrics.inc('socket_emits_total', event=event)
+        socketio.emit(event, payload, to=sid)
@@ -0,0 +1,77 @@
+import uuid
+import threading
+from . import socketio, jobs
+
+# バックエンドからイベントを読み出す間隔（秒）
+POLL_INTERVAL = 0.5
+
+_backend = None
+# ジョブID -> {'on_progress', 'done', 'result', 'data'}
+_waiters = {}
+_lock = threading.Lock()
+
+class CancelHandle:
+    """active_processes に登録するキャンセル用ハンドル（subprocess.Popen の terminate 互換）"""
+
+    def __init__(self, job_id):
+        self._job_id = job_id
+
+    def terminate(self):
+        _backend.cancel(self._job_id)
+
+def get_backend():
+    """UIノードのバックエンドを開く（ジョブAPIもこのバックエンドを中継する）"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            backend = jobs.open_backend()
+            if not isinstance(backend, jobs.JobBackend):
+                raise ValueError("This job backend can only be used by workers")
+            _backend = backend
+            # 前回の起動時のジョブは、キューの復元で新しいジョブとして出し直される
+            _backend.cancel_all()
+            socketio.start_background_task(target=_poll)
+        return _backend
+
+def run(item, on_progress, register_handle, on_result=None):
+    """アイテムをジョブとして登録し、ワーカーが実行し終えるまで待って (終了コード, エラー出力の末尾行) を返す
+
+    ワーカーが結果（重複判定のキー・保存したファイル）を返した場合は、戻る前に on_result に渡す
+    """
+    backend = get_backend()
+    job_id = f"{item['id']}-{uuid.uuid4().hex[:8]}"
+    waiter = {'on_progress': on_progress, 'done': threading.Event(), 'result': None, 'data': None}
+    with _lock:
+        _waiters[job_id] = waiter
+    backend.submit(job_id, {'item': item})
+    register_handle(CancelHandle(job_id))
+    waiter['done'].wait()
+    if on_result and waiter['data']:
+        on_result(waiter['data'])
+    return waiter['result']
+
+def _poll():
+    """ワーカーからのイベントを読み出して待機中のダウンロードに渡し、期限切れのリースを回収する"""
+    seq = 0
+    while True:
+        socketio.sleep(POLL_INTERVAL)
+        try:
+            _backend.requeue_expired()
+            events = _backend.events_since(seq)
+            for seq, job_id, kind, data in events:
+                with _lock:
+                    waiter = _waiters.get(job_id)
+                if not waiter:
+                    continue
+                if kind == 'progress':
+                    waiter['on_progress'](data)
+                elif kind == 'finished':
+                    with _lock:
+                        _waiters.pop(job_id, None)
+                    waiter['result'] = (data['returncode'], data['stderr_tail'])
+                    waiter['data'] = data.get('result')
+                    waiter['done'].set()
+            if events:
+                _backend.prune(seq)
+        except Exception as e:
+            print(f"Error polling job backend: {e}")
@@ -0,0 +1,298 @@
+import time
+import heapq
+import itertools
+from urllib.parse import urlsplit
+
+# 待機中アイテムはホストごとのヒープで管理する。エントリは [区分, -優先度, 連番, item_id, ホスト] のリスト
+# 区分 0 は「先頭へ移動」されたアイテム、1 は通常のアイテム
+# host -> {'heap', 'waiting', 'running', 'tokens', 'refilled_at', 'blocked_until', 'listed', 'wake_at', 'parked'}
+# 待機アイテム・実行中のアイテムが無く、ブロックやトークンの状態も初期状態に戻ったホストは削除する
+_hosts = {}
+# item_id -> 有効なヒープエントリ。削除・更新されたエントリはヒープ上に残し、取り出し時に読み飛ばす
+_waiting_entries = {}
+# すべての待機エントリのヒープ（peek で使う）
+_all_heap = []
+# 開始候補のホストの待機先頭エントリのヒープ。ホストの listed と同じエントリだけが有効
+# 取り出したときに開始できなければ、開始できる時刻まで _timers に移すか、実行中の数が減るまで外す（parked）
+_ready_heap = []
+# 開始できるようになる時刻を待つホスト: (時刻, 連番, ホスト)。ホストの wake_at と同じ時刻だけが有効
+_timers = []
+# 空いたホストを削除できる時刻: (時刻, 連番, ホスト)
+_idle_timers = []
+# item_id -> ホスト
+_running = {}
+# 再試行待ちのアイテム: ヒープは (開始可能時刻, 連番, item_id)、辞書は item_id -> (優先度, ホスト, ヒープエントリ)
+_delayed_heap = []
+_delayed_entries = {}
+_seq = itertools.count()
+_top_seq = itertools.count()
+
+# ホストごとの同時実行数と1分あたりの開始数（0 は無制限）
+_per_host_limit = 0
+_per_host_rate = 0
+# トークンバケットに溜められるのは、この秒数分の開始数
+TOKEN_BURST_SECONDS = 10
+
+# 無効エントリがこの数を超え、かつ有効エントリより多くなったらヒープを作り直す
+_COMPACT_THRESHOLD = 1024
+
+# 以下の関数はすべて sockets.queue_lock を保持した状態で呼び出すこと
+
+def host_of(url):
+    """URLからスケジューリング用のホスト名を取り出す"""
+    try:
+        host = (urlsplit(url).hostname or '').lower()
+    except ValueError:
+        return ''
+    return host[4:] if host.startswith('www.') else host
+
+def configure(per_host_limit=0, per_host_rate=0):
+    """ホストごとの同時実行数の上限と、1分あたりの開始数の上限を設定する"""
+    global _per_host_limit, _per_host_rate
+    limits = max(int(per_host_limit), 0), max(float(per_host_rate), 0)
+    if limits == (_per_host_limit, _per_host_rate):
+        return
+    _per_host_limit, _per_host_rate = limits
+    # 開始できるかどうかの判断が変わるため、すべてのホストを候補に戻して判断し直す
+    for host, state in list(_hosts.items()):
+        state.update(listed=None, wake_at=None, parked=False)
+        _refresh(host)
+
+def _host(host):
+    state = _hosts.get(host)
+    if state is None:
+        state = {'heap': [], 'waiting': 0, 'running': 0, 'tokens': None, 'refilled_at': 0, 'blocked_until': 0,
+                 'listed': None, 'wake_at': None, 'parked': False}
+        _hosts[host] = state
+    return state
+
+def _push(item_id, host, tier, priority, seq):
+    """ホストの待機ヒープにエントリを追加する"""
+    state = _host(host)
+    if item_id not in _waiting_entries:
+        state['waiting'] += 1
+    entry = [tier, -priority, seq, item_id, host]
+    _waiting_entries[item_id] = entry
+    heapq.heappush(state['heap'], entry)
+    heapq.heappush(_all_heap, entry)
+    _compact_if_needed(state['heap'], state['waiting'])
+    _compact_if_needed(_all_heap, len(_waiting_entries))
+    _refresh(host)
+
+def _compact_if_needed(heap, valid):
+    """無効エントリが溜まりすぎた場合にヒープを再構築する"""
+    stale = len(heap) - valid
+    if stale > _COMPACT_THRESHOLD and stale > valid:
+        heap[:] = [entry for entry in heap if _waiting_entries.get(entry[3]) is entry]
+        heapq.heapify(heap)
+
+def _remove_waiting(item_id):
+    entry = _waiting_entries.pop(item_id, None)
+    if entry:
+        _hosts[entry[4]]['waiting'] -= 1
+        _refresh(entry[4])
+    return entry
+
+def _head(state):
+    """ホストの待機ヒープ先頭の有効なエントリを返す（無効エントリは捨てる）"""
+    heap = state['heap']
+    while heap and _waiting_entries.get(heap[0][3]) is not heap[0]:
+        heapq.heappop(heap)
+    return heap[0] if heap else None
+
+def _refresh(host, now=None):
+    """ホストの待機先頭が変わったら開始候補に載せ直し、空いたホストは削除する"""
+    state = _hosts.get(host)
+    if state is None:
+        return
+    head = _head(state)
+    if head is None:
+        state.update(listed=None, wake_at=None)
+        _release(host, state, time.monotonic() if now is None else now)
+    elif state['listed'] is not head and state['wake_at'] is None and not state['parked']:
+        state['listed'] = head
+        heapq.heappush(_ready_heap, head)
+        if len(_ready_heap) > _COMPACT_THRESHOLD and len(_ready_heap) > 2 * len(_hosts):
+            _ready_heap[:] = [entry for entry in _ready_heap
+                              if entry[4] in _hosts and _hosts[entry[4]]['listed'] is entry]
+            heapq.heapify(_ready_heap)
+
+def _release(host, state, now):
+    """待機・実行中のアイテムが無いホストを、ブロックとトークンの状態が初期状態に戻り次第削除する"""
+    if state['waiting'] or state['running']:
+        return
+    until = state['blocked_until']
+    if _per_host_rate and state['tokens'] is not None:
+        rate_per_second = _per_host_rate / 60
+        capacity = max(1.0, rate_per_second * TOKEN_BURST_SECONDS)
+        until = max(until, state['refilled_at'] + (capacity - state['tokens']) / rate_per_second)
+    if until <= now:
+        del _hosts[host]
+    else:
+        heapq.heappush(_idle_timers, (until, next(_seq), host))
+
+def enqueue(item_id, priority=0, host=''):
+    """アイテムを待機キューに追加する（優先度が高いほど先に開始）"""
+    _push(item_id, host, 1, priority, next(_seq))
+
+def defer(item_id, delay, priority=0, host=''):
+    """アイテムを delay 秒後に開始可能になる再試行待ちに入れる"""
+    _remove_waiting(item_id)
+    entry = (time.monotonic() + delay, next(_seq), item_id)
+    _delayed_entries[item_id] = (priority, host, entry)
+    heapq.heappush(_delayed_heap, entry)
+
+def block_host(host, delay):
+    """ホストへの新規開始を delay 秒間止める（他のホストのアイテムは開始される）"""
+    state = _host(host)
+    state['blocked_until'] = max(state['blocked_until'], time.monotonic() + delay)
+    _refresh(host)
+
+def discard(item_id):
+    """アイテムを待機キュー・再試行待ち・実行中のすべてから取り除く"""
+    _remove_waiting(item_id)
+    _delayed_entries.pop(item_id, None)
+    finish(item_id)
+
+def set_priority(item_id, priority):
+    """待機中アイテムの優先度を変更する"""
+    entry = _waiting_entries.get(item_id)
+    if not entry:
+        return False
+    _push(item_id, entry[4], entry[0], priority, entry[2])
+    return True
+
+def move_to_top(item_id):
+    """待機中アイテムをキューの先頭へ移動する（後から移動したものほど前）"""
+    entry = _waiting_entries.get(item_id)
+    if not entry:
+        return False
+    _push(item_id, entry[4], 0, -entry[1], -next(_top_seq))
+    return True
+
+def _promote_delayed(now):
+    """開始可能時刻を過ぎた再試行待ちのアイテムを待機キューに戻す"""
+    while _delayed_heap and _delayed_heap[0][0] <= now:
+        entry = heapq.heappop(_delayed_heap)
+        delayed = _delayed_entries.get(entry[2])
+        if delayed and delayed[2] is entry:
+            del _delayed_entries[entry[2]]
+            enqueue(entry[2], delayed[0], delayed[1])
+
+def _refill(state, now):
+    """トークンバケットを経過時間分だけ補充する"""
+    rate_per_second = _per_host_rate / 60
+    capacity = max(1.0, rate_per_second * TOKEN_BURST_SECONDS)
+    if state['tokens'] is None:
+        state['tokens'] = capacity
+    else:
+        state['tokens'] = min(capacity, state['tokens'] + (now - state['refilled_at']) * rate_per_second)
+    state['refilled_at'] = now
+
+def _ready_at(state, now):
+    """ホストが新しいアイテムを開始できる時刻を返す（今すぐなら now、実行中の数が上限なら None）"""
+    if state['blocked_until'] > now:
+        return state['blocked_until']
+    if _per_host_limit and state['running'] >= _per_host_limit:
+        return None
+    if _per_host_rate:
+        _refill(state, now)
+        if state['tokens'] < 1:
+            return now + (1 - state['tokens']) * 60 / _per_host_rate
+    return now
+
+def _expire_timers(now):
+    """開始できる時刻になったホストを候補に戻し、削除できる時刻になったホストを削除する"""
+    while _timers and _timers[0][0] <= now:
+        wake_at, _, host = heapq.heappop(_timers)
+        state = _hosts.get(host)
+        if state is not None and state['wake_at'] == wake_at:
+            state['wake_at'] = None
+            _refresh(host, now)
+    while _idle_timers and _idle_timers[0][0] <= now:
+        _, _, host = heapq.heappop(_idle_timers)
+        _refresh(host, now)
+
+def take(free_slots):
+    """空きスロット数だけ待機アイテムを取り出し、実行中として登録する"""
+    now = time.monotonic()
+    _promote_delayed(now)
+    _expire_timers(now)
+    started = []
+    # 候補のホストの先頭同士のうち、最も優先されるアイテムから順に開始する
+    while len(started) < free_slots and _ready_heap:
+        entry = heapq.heappop(_ready_heap)
+        host = entry[4]
+        state = _hosts.get(host)
+        if state is None or state['listed'] is not entry:
+            continue
+        state['listed'] = None
+        ready_at = _ready_at(state, now)
+        if ready_at is None:
+            # 実行中のアイテムが終わるまで候補から外す（finish で戻す）
+            state['parked'] = True
+            continue
+        if ready_at > now:
+            state['wake_at'] = ready_at
+            heapq.heappush(_timers, (ready_at, next(_seq), host))
+            continue
+        item_id = entry[3]
+        del _waiting_entries[item_id]
+        state['waiting'] -= 1
+        state['running'] += 1
+        if _per_host_rate:
+            state['tokens'] -= 1
+        _running[item_id] = host
+        started.append(item_id)
+        _refresh(host, now)
+    return started
+
+def next_wakeup():
+    """再試行待ち・ホストのブロック・トークン不足が解消する最も早い時刻を返す（無ければ None）"""
+    candidates = []
+    if _delayed_heap:
+        candidates.append(_delayed_heap[0][0])
+    while _timers:
+        wake_at, _, host = _timers[0]
+        state = _hosts.get(host)
+        if state is not None and state['wake_at'] == wake_at:
+            candidates.append(wake_at)
+            break
+        heapq.heappop(_timers)
+    return min(candidates) if candidates else None
+
+def peek(count):
+    """次に開始される待機アイテムのIDを最大 count 件返す（キューの内容は変えない）"""
+    popped = []
+    while len(popped) < count and _all_heap:
+        entry = heapq.heappop(_all_heap)
+        if _waiting_entries.get(entry[3]) is entry:
+            popped.append(entry)
+    for entry in popped:
+        heapq.heappush(_all_heap, entry)
+    return [entry[3] for entry in popped]
+
+def finish(item_id):
+    """実行中のアイテムを実行中から外す"""
+    host = _running.pop(item_id, None)
+    if host is not None:
+        state = _hosts[host]
+        state['running'] -= 1
+        state['parked'] = False
+        _refresh(host)
+
+def running_count():
+    """実行中のアイテム数を返す"""
+    return len(_running)
+
+def running_ids():
+    """実行中のアイテムIDの一覧を返す"""
+    return list(_running)
+
+def waiting_count():
+    """待機中のアイテム数を返す"""
+    return len(_waiting_entries)
+
+def is_waiting(item_id):
+    """アイテムが待機キューにあるかどうか"""
+    return item_id in _waiting_entries
@@ -1,12 +1,74 @@
-
 import os
 import json
+import atexit
+import threading
+from . import socketio
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SETTINGS_FILE = os.path.join(BASE_DIR, 'settings.json')
 DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
 
+# 変更をまとめてファイルに書き込むまでの待ち時間（秒）
+SAVE_DELAY = 0.5
+# クライアントごとに保存する前回のオプション（プロファイル）の上限。古いものから削除する
+MAX_PROFILES = 20
+
+def _int(minimum, maximum):
+    def convert(value):
+        if isinstance(value, bool):
+            raise ValueError(value)
+        return min(max(int(value), minimum), maximum)
+    return convert
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('true', '1', 'yes', 'on'):
+        return True
+    if str(value).lower() in ('false', '0', 'no', 'off', ''):
+        return False
+    raise ValueError(value)
+
+def _choice(*choices):
+    def convert(value):
+        if value not in choices:
+            raise ValueError(value)
+        return value
+    return convert
+
+# セクション -> 項目 -> 値の変換・検証関数（ValueError / TypeError で不正とみなす）
+# ここに無い項目はそのまま保存する。既定値は各モジュールの get の既定値で与える
+SCHEMA = {
+    'general': {
+        'concurrentDownloads': _int(1, 100),
+        'showWelcomeNotice': _bool,
+        'downloadEngine': _choice('subprocess', 'inprocess', 'asyncio', 'worker'),
+        'autoConcurrency': _bool,
+        'minConcurrentDownloads': _int(1, 100),
+        'maxConcurrentDownloads': _int(1, 100),
+        'perHostConcurrency': _int(0, 100),
+        'perHostRequestsPerMinute': _int(0, 10000),
+        'separatePostprocessing': _bool,
+        'postprocessWorkers': _int(1, 64),
+        'progressIntervalMs': _int(50, 60000),
+    },
+    'last_options': {
+        'savePath': str,
+        'selectedFormat': str,
+        'audioOnly': _bool,
+        'expandPlaylist': _bool,
+        'audioFormat': str,
+        'cookieBrowser': str,
+        'customArgs': str,
+    },
+}
+
+# 現在の設定。更新時は丸ごと置き換えるため、読み出し側はロック無しで一貫した内容を参照できる
 app_settings = {}
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+_write_pending = False
+_listeners = []
 
 def load_settings():
     """settings.jsonファイルから設定を読み込む"""
@@ -14,7 +76,10 @@ def load_settings():
     try:
         if os.path.exists(SETTINGS_FILE):
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                app_settings = json.load(f)
+                loaded, errors = validate(json.load(f))
+            if errors:
+                print(f"Ignoring invalid settings: {', '.join(errors)}")
+            app_settings = loaded
         else:
             # デフォルト設定
             app_settings = {
@@ -23,22 +88,129 @@ def load_settings():
             }
             save_settings()
     except Exception as e:
+        # 壊れたファイルは上書きせずに残し、既定の設定で起動する
         print(f"Error loading settings: {e}")
     return app_settings
 
-def save_settings(new_settings=None):
-    """設定をsettings.jsonファイルに保存する"""
+def validate(settings):
+    """設定の値を型変換・検証し、(検証済みの設定, 不正だった項目の一覧) を返す。不正な値は取り除く"""
+    clean, errors = {}, []
+    for section, values in settings.items():
+        if section == 'profiles' and isinstance(values, dict):
+            clean[section] = {profile: validate({'last_options': options})[0].get('last_options', {})
+                              for profile, options in values.items() if isinstance(options, dict)}
+            continue
+        schema = SCHEMA.get(section)
+        if schema is None:
+            clean[section] = values
+            continue
+        if not isinstance(values, dict):
+            errors.append(section)
+            continue
+        clean[section] = {}
+        for key, value in values.items():
+            convert = schema.get(key)
+            try:
+                clean[section][key] = convert(value) if convert else value
+            except (TypeError, ValueError):
+                errors.append(f"{section}.{key}")
+    return clean, errors
+
+def save_settings(new_settings=None, profile=None):
+    """設定を検証してメモリ上に反映し、settings.jsonへの書き込みを予約する。不正だった項目の一覧を返す
+
+    profile を指定すると、前回のオプション（last_options）をそのクライアントのものとしても保存する
+    """
     global app_settings
+    errors = []
     if new_settings:
-        app_settings = new_settings
-    try:
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(app_settings, f, indent=4)
-    except Exception as e:
-        print(f"Error saving settings: {e}")
+        # 他のクライアントのプロファイルはクライアントから受け取らない
+        clean, errors = validate({section: values for section, values in new_settings.items() if section != 'profiles'})
+        with _lock:
+            previous = app_settings
+            updated = dict(previous)
+            for section, values in clean.items():
+                # 不正だった項目は以前の値のまま残す
+                if isinstance(values, dict) and isinstance(previous.get(section), dict):
+                    values = {**previous[section], **values}
+                updated[section] = values
+            if profile and 'last_options' in clean:
+                profile = str(profile)[:64]
+                profiles = {name: options for name, options in previous.get('profiles', {}).items() if name != profile}
+                profiles[profile] = updated['last_options']
+                updated['profiles'] = dict(list(profiles.items())[-MAX_PROFILES:])
+            app_settings = updated
+        _notify(_changed_keys(previous, updated))
+    _schedule_write()
+    return errors
 
 def get_setting(key, default=None):
     """指定されたキーの設定値を取得する"""
     return app_settings.get(key, default)
 
-# ---
\ No newline at end of file
+def get_client_settings(profile=None):
+    """クライアントに送る設定を返す。プロファイルがあれば前回のオプションをそのクライアントのものにする"""
+    settings = app_settings
+    client_settings = {section: values for section, values in settings.items() if section != 'profiles'}
+    options = settings.get('profiles', {}).get(profile) if profile else None
+    if options is not None:
+        client_settings['last_options'] = options
+    return client_settings
+
+def on_change(callback):
+    """設定の変更時に、変わった項目の集合（'general.concurrentDownloads' など）を受け取る関数を登録する"""
+    _listeners.append(callback)
+
+def _changed_keys(previous, updated):
+    changed = set()
+    for section in previous.keys() | updated.keys():
+        old, new = previous.get(section), updated.get(section)
+        if isinstance(old, dict) and isinstance(new, dict):
+            changed.update(f"{section}.{key}" for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+        elif old != new:
+            changed.add(section)
+    return changed
+
+def _notify(changed):
+    if not changed:
+        return
+    for callback in list(_listeners):
+        try:
+            callback(changed)
+        except Exception as e:
+            print(f"Error in settings listener: {e}")
+
+def _schedule_write():
+    """連続した変更をまとめて、少し後に1回だけ書き込む"""
+    global _write_pending
+    with _lock:
+        if _write_pending:
+            return
+        _write_pending = True
+    socketio.start_background_task(target=_write_later)
+
+def _write_later():
+    socketio.sleep(SAVE_DELAY)
+    flush()
+
+def flush():
+    """予約されている書き込みをすぐに行う（終了時にも呼ばれる）"""
+    global _write_pending
+    with _write_lock:
+        with _lock:
+            if not _write_pending:
+                return
+            _write_pending = False
+            settings = app_settings
+        # 一時ファイルに書いてから置き換え、書き込み途中で終了しても元のファイルが壊れないようにする
+        temp_path = SETTINGS_FILE + '.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, SETTINGS_FILE)
+        except Exception as e:
+            print(f"Error saving settings: {e}")
+
+atexit.register(flush)
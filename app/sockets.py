@@ -1,100 +1,601 @@
+import os
+import time
+import asyncio
 import uuid
+import random
+import itertools
 import threading
 import subprocess
+from flask import request
 from flask_socketio import emit
-from . import socketio, ytdlp_handler, settings_handler
+from . import socketio, ytdlp_handler, settings_handler, scheduler, progress, queue_events, prefetch, inprocess_engine, journal, concurrency, postprocess, archive, async_engine, metrics, remote_engine, library
 from .ytdlp_handler import active_processes
 
 download_queue = {}
-queue_lock = threading.Lock()
+queue_lock = metrics.instrument_lock(threading.Lock(), 'queue_lock')
+queue_events.bind(download_queue, queue_lock)
+
+metrics.register_gauge('queue_items', 'Items in the download queue', lambda: len(download_queue))
+metrics.register_gauge('downloads_running', 'Downloads currently running', scheduler.running_count)
+metrics.register_gauge('downloads_waiting', 'Items waiting in the scheduler', scheduler.waiting_count)
+
+# プレイリスト展開時に、この件数ごとに子アイテムをキューへ追加する
+PLAYLIST_PAGE_SIZE = 50
+# クライアントから受け付ける優先度の範囲（範囲外の値は丸める）
+MIN_PRIORITY = -100
+MAX_PRIORITY = 100
+
+# これらの設定が変わったら、次のダウンロードの完了を待たずにスケジューラーへ反映する
+SCHEDULING_SETTINGS = {
+    'general.concurrentDownloads', 'general.autoConcurrency', 'general.minConcurrentDownloads',
+    'general.maxConcurrentDownloads', 'general.perHostConcurrency', 'general.perHostRequestsPerMinute',
+}
+
+# 一時的な失敗・帯域制限による失敗を再試行する回数と待ち時間（秒）
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 300
+
+# 再試行待ちなどのために start_next_download を次に呼び出す予定時刻
+_wakeup_at = None
+
+# yt-dlp.exe の準備が済むまではダウンロードを開始しない
+_ytdlp_ready = threading.Event()
+# 準備中・失敗時にクライアントへ表示するメッセージ（準備完了後は None）
+_bootstrap_status = {'message_key': None}
 
 def run_download_process(item_id):
     """個別のダウンロードプロセスを実行する"""
+    item = _begin_download(item_id)
+    if not item:
+        return
+    # ワーカーモードでは、コマンドの組み立てと後処理はジョブを受け取ったワーカーが行う
+    remote = settings_handler.get_setting('general', {}).get('downloadEngine') == 'worker'
+    info_json = None if remote else prefetch.take(item_id)
+    started_at = time.monotonic()
+    throttled = False
+    pp_plan = None
+    
+    try:
+        if info_json and _resolve_archive_key(item_id, item, archive.read_info_key(info_json)):
+            return
+        # 結合・音声抽出はダウンロード後に別のワーカーで行い、ダウンロード枠をすぐに空ける
+        pp_plan = None if remote else postprocess.plan(item)
+        returncode, stderr_tail = _run_command(item_id, item, ytdlp_handler.build_download_command(item, info_json, pp_plan))
+        if returncode != 0 and info_json and item.get('status') != 'cancelled':
+            # 先読みした情報JSONで失敗した場合は、URLからの通常のダウンロードでやり直す
+            returncode, stderr_tail = _run_command(item_id, item, ytdlp_handler.build_download_command(item, None, pp_plan))
+        throttled = _complete_download(item_id, item, returncode, stderr_tail, pp_plan)
+    except Exception as e:
+        _fail_download(item_id, item, e)
+    finally:
+        _finalize_download(item_id, item, pp_plan, throttled, started_at)
+        socketio.start_background_task(target=start_next_download)
+
+async def run_download_async(item_id):
+    """run_download_process のasyncio版。イベントループ上で動き、ダウンロードごとにスレッドを使わない
+
+    queue_lock を取る処理とファイルの読み書きは、他のダウンロードの出力の読み取りを止めないようスレッドプールで行う
+    """
+    item = await _in_thread(_begin_download, item_id)
+    if not item:
+        return
+    info_json = await _in_thread(prefetch.take, item_id)
+    started_at = time.monotonic()
+    throttled = False
+    pp_plan = None
+
+    try:
+        if info_json and await _in_thread(lambda: _resolve_archive_key(item_id, item, archive.read_info_key(info_json))):
+            return
+        pp_plan = await _in_thread(postprocess.plan, item)
+        command = await _in_thread(ytdlp_handler.build_download_command, item, info_json, pp_plan)
+        returncode, stderr_tail = await _run_command_async(item_id, item, command)
+        if returncode != 0 and info_json and item.get('status') != 'cancelled':
+            command = await _in_thread(ytdlp_handler.build_download_command, item, None, pp_plan)
+            returncode, stderr_tail = await _run_command_async(item_id, item, command)
+        throttled = await _in_thread(_complete_download, item_id, item, returncode, stderr_tail, pp_plan)
+    except Exception as e:
+        await _in_thread(_fail_download, item_id, item, e)
+    finally:
+        await _in_thread(_finalize_download, item_id, item, pp_plan, throttled, started_at)
+        await _in_thread(start_next_download)
+
+def _in_thread(function, *args):
+    """イベントループのスレッドプールで関数を実行する（コルーチンから await する）"""
+    return asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+def _begin_download(item_id):
+    """アイテムをダウンロード中にして返す（削除済みなら None）"""
     with queue_lock:
         item = download_queue.get(item_id)
         if not item: 
-            return
+            return None
         item['status'] = 'downloading'
-        socketio.emit('item_update', {'item': item})
+        changes = [queue_events.record('updated', item)]
+    metrics.mark(item_id, 'extracting')
+    queue_events.publish(changes)
+    return item
 
-    command = ytdlp_handler.build_download_command(item)
-    
-    process = None
+def _complete_download(item_id, item, returncode, stderr_tail, pp_plan):
+    """ダウンロード完了後の状態を反映し、帯域制限による失敗だったかどうかを返す"""
+    with queue_lock:
+        if item_id not in download_queue: 
+            return False
+        if returncode == 0 and pp_plan:
+            item.update({'status': 'processing', 'progress': 100, 'details_key': 'details_processing'})
+        elif returncode == 0:
+            item.update({'status': 'completed', 'progress': 100, 'details_key': 'details_completed'})
+        elif item.get('status') == 'cancelled':
+            item.update({'details_key': 'details_cancelled'})
+        else:
+            return _handle_failure(item_id, item, stderr_tail) == 'throttled'
+    return False
+
+def _fail_download(item_id, item, error):
+    with queue_lock:
+        if item_id in download_queue:
+            item.update({'status': 'error', 'details': str(error)})
+
+def _finalize_download(item_id, item, pp_plan, throttled, started_at):
+    """実行中の登録を外して最終状態を送信し、必要なら後処理を投入する"""
+    with queue_lock:
+        active_processes.pop(item_id, None)
+        if item.get('status') == 'processing' and item_id in download_queue:
+            # 後処理が始まるまでの間も、削除でキャンセルできるようにしておく
+            active_processes[item_id] = postprocess.CancelHandle(pp_plan)
+        scheduler.finish(item_id)
+        changes = [queue_events.record('updated', item)] if item_id in download_queue else []
+    progress.discard(item_id)
+    prefetch.discard(item_id)
+    _resolve_archive_key(item_id, item, archive.take_key(item_id), skip_duplicate=False)
+    _update_archive(item)
+    _index_download(item, library.take_paths(item_id))
+    _record_download_metrics(item_id, item, started_at)
+    queue_events.publish(changes)
+    if throttled:
+        concurrency.report_throttled()
+    if item.get('status') == 'processing':
+        postprocess.submit(pp_plan, lambda process: _register_process(item_id, process),
+                           lambda returncode, stderr_tail: _finish_postprocess(item_id, item, returncode, stderr_tail,
+                                                                               pp_plan.get('output_path')))
+
+def _record_download_metrics(item_id, item, started_at):
+    """ダウンロード1回分の結果と、アイテムの次のフェーズを記録する"""
+    if not metrics.ENABLED:
+        return
+    status = item.get('status')
+    metrics.inc('downloads_finished_total', result=status)
+    metrics.observe('download_duration_seconds', time.monotonic() - started_at, result=status)
+    if status in ('processing', 'completed'):
+        transferred = item.get('downloaded_bytes') or item.get('total_bytes') or 0
+        metrics.observe('download_bytes', transferred)
+        metrics.inc('download_bytes_total', transferred)
+    if status == 'processing':
+        metrics.mark(item_id, 'postprocessing')
+    elif status == 'waiting':
+        metrics.mark(item_id, 'queued')
+    else:
+        metrics.finish_item(item_id, status)
+
+def _finish_postprocess(item_id, item, returncode, stderr_tail, output_path=None):
+    """後処理ワーカーの終了結果をアイテムに反映する"""
+    with queue_lock:
+        active_processes.pop(item_id, None)
+        if item_id not in download_queue:
+            return
+        if returncode == 0:
+            item.update({'status': 'completed', 'details_key': 'details_completed'})
+        elif item.get('status') == 'cancelled':
+            item.update({'details_key': 'details_cancelled'})
+        else:
+            item.update({'status': 'error', 'details': stderr_tail[-1] if stderr_tail else '', 'details_key': None})
+        changes = [queue_events.record('updated', item)]
+    _update_archive(item)
+    _index_download(item, [output_path] if output_path else [])
+    metrics.finish_item(item_id, item['status'])
+    queue_events.publish(changes)
+
+def _resolve_archive_key(item_id, item, key, skip_duplicate=True):
+    """抽出して分かった「抽出器名 動画ID」のキーで重複判定のキーを置き換える
+
+    別のURLで既にダウンロード済み・キューにある動画だった場合は、skip_duplicate ならアイテムを
+    キャンセル済みにして True を返す（呼び出し側はダウンロードを行わない）
+    """
+    if not key or key == item.get('archive_key'):
+        return False
+    with queue_lock:
+        if item_id not in download_queue:
+            return False
+        duplicate = archive.rekey(item.get('archive_key'), key, item_id)
+        if archive.is_url_key(item.get('archive_key')):
+            item['url_key'] = item['archive_key']
+        item['archive_key'] = key
+        if not (duplicate and skip_duplicate):
+            return False
+        item.update({'status': 'cancelled', 'details_key': 'details_duplicate'})
+    return True
+
+def _update_archive(item, removed=False):
+    """アイテムの最終状態をダウンロードアーカイブの索引に反映する"""
+    for key in _archive_keys(item):
+        if item['status'] == 'completed' and not removed:
+            archive.add(key, item['id'])
+        elif item['status'] in ('error', 'cancelled') or removed:
+            archive.unmark_queued(key, item['id'])
+
+def _archive_keys(item):
+    """アイテムの重複判定のキー（抽出器名と動画IDのキーと、正規化したURLのキー）"""
+    return [key for key in dict.fromkeys((item.get('archive_key'), item.get('url_key'))) if key]
+
+def _index_download(item, paths):
+    """完了したアイテムのファイルをライブラリの索引に加える（ダウンロードの後始末を待たせないよう別スレッドで行う）"""
+    if item.get('status') == 'completed' and paths:
+        socketio.start_background_task(target=_index_files, item=dict(item), paths=paths)
+
+def _index_files(item, paths):
+    try:
+        library.index_item(item, paths)
+    except Exception as e:
+        print(f"Error indexing {paths}: {e}")
+
+def _apply_worker_result(item_id, item, result):
+    """ワーカーが返した重複判定のキーと保存したファイルを、このノードのアーカイブとライブラリの索引に反映する
+
+    ワーカーは別のマシンで動くことがあるため、このノードのファイルを読まずに結果の内容だけを使う
+    """
+    _resolve_archive_key(item_id, item, result.get('archive_key'), skip_duplicate=False)
+    if result.get('files'):
+        socketio.start_background_task(target=_index_worker_files, item=dict(item), files=result['files'])
+
+def _index_worker_files(item, files):
     try:
+        library.index_files(item, files)
+    except Exception as e:
+        print(f"Error indexing files of {item['id']}: {e}")
+
+def start_library_scan():
+    """保存先フォルダの索引の更新をバックグラウンドで開始する（起動時に呼ぶ）"""
+    with queue_lock:
+        roots = {item['options'].get('savePath') for item in download_queue.values()
+                 if item['status'] == 'completed' and item.get('options')}
+    roots.add(settings_handler.get_setting('last_options', {}).get('savePath') or ytdlp_handler.DOWNLOADS_DIR)
+    library.start_scan(sorted(root for root in roots if root))
+
+def _handle_failure(item_id, item, stderr_tail):
+    """失敗を分類し、一時的な失敗なら指数バックオフで再試行待ちに戻す（queue_lock 保持中に呼ぶ）"""
+    details = stderr_tail[-1] if stderr_tail else ''
+    kind = ytdlp_handler.classify_error(stderr_tail)
+    attempts = item.get('attempts', 0)
+    if kind == 'permanent' or attempts >= MAX_RETRIES:
+        item.update({'status': 'error', 'details': details})
+        return kind
+    
+    # ジッターを入れて、同じホストの再試行が同時に集中しないようにする
+    delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+    delay = random.uniform(delay / 2, delay)
+    host = scheduler.host_of(item['url'])
+    item.update({'status': 'waiting', 'attempts': attempts + 1, 'details': f"Retry {attempts + 1}/{MAX_RETRIES}: {details}"})
+    scheduler.defer(item_id, delay, item.get('priority', 0), host)
+    if kind == 'throttled':
+        # 帯域制限を受けたホストだけを止め、他のホストのアイテムは流し続ける
+        scheduler.block_host(host, delay)
+    return kind
+
+def _run_command(item_id, item, command):
+    """設定されたエンジンでyt-dlpを実行し、(終了コード, stderrの末尾行) を返す"""
+    engine = settings_handler.get_setting('general', {}).get('downloadEngine', 'subprocess')
+    if engine == 'inprocess':
+        return inprocess_engine.run(
+            command[len(ytdlp_handler.yt_dlp_command()):],
+            on_progress=lambda fields: _apply_progress(item_id, item, ytdlp_handler.make_progress(fields)),
+            register_handle=lambda handle: _register_process(item_id, handle))
+    if engine == 'worker':
+        return remote_engine.run(
+            dict(item),
+            on_progress=lambda progress_data: _apply_progress(item_id, item, progress_data),
+            register_handle=lambda handle: _register_process(item_id, handle),
+            on_result=lambda result: _apply_worker_result(item_id, item, result))
+
+    with metrics.timed('subprocess_spawn_seconds', engine='subprocess'):
         process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
                                  text=True, encoding='utf-8', errors='ignore', 
                                  creationflags=subprocess.CREATE_NO_WINDOW)
-        with queue_lock:
+    _register_process(item_id, process)
+    
+    # 標準出力・標準エラー出力の両方から進捗を読み取り
+    def on_line(line):
+        progress_data = ytdlp_handler.parse_progress(line)
+        if progress_data:
+            _apply_progress(item_id, item, progress_data)
+    
+    stderr_tail = ytdlp_handler.read_process_output(process, on_line)
+    process.wait()
+    return process.returncode, stderr_tail
+
+async def _run_command_async(item_id, item, command):
+    """asyncioエンジンでyt-dlpを実行し、(終了コード, stderrの末尾行) を返す"""
+    def on_line(line):
+        progress_data = ytdlp_handler.parse_progress(line)
+        if progress_data:
+            _apply_progress(item_id, item, progress_data)
+
+    return await async_engine.run(command, on_line, lambda handle: _register_process(item_id, handle))
+
+def _register_process(item_id, process):
+    """キャンセルできるように実行中のプロセス（またはハンドル）を登録する"""
+    with queue_lock:
+        removed = item_id not in download_queue
+        if not removed:
             active_processes[item_id] = process
-        
-        # 標準出力から進捗を読み取り
-        for line in iter(process.stdout.readline, ''):
-            progress_data = ytdlp_handler.parse_progress(line)
-            if progress_data:
-                item.update(progress_data)
-                socketio.emit('download_progress', {'id': item_id, 'progress': item['progress'], 'details': item['details']})
-        
-        process.wait()
-        
-        # ダウンロード完了後の処理
-        with queue_lock:
-            if item_id not in download_queue: 
-                return
-            if process.returncode == 0:
-                item.update({'status': 'completed', 'progress': 100, 'details_key': 'details_completed'})
-            elif item.get('status') == 'cancelled':
-                item.update({'details_key': 'details_cancelled'})
-            else:
-                item.update({'status': 'error', 'details': process.stderr.read().strip().split('\n')[-1]})
+    if removed:
+        # 起動してから登録するまでの間にアイテムが削除された
+        process.terminate()
 
-    except Exception as e:
-        with queue_lock:
-            if item_id in download_queue:
-                item.update({'status': 'error', 'details': str(e)})
-    finally:
-        with queue_lock:
-            active_processes.pop(item_id, None)
-        socketio.emit('item_update', {'item': item})
-        socketio.start_background_task(target=start_next_download)
+def _apply_progress(item_id, item, progress_data):
+    """進捗をアイテムに反映し、送信待ちに積む"""
+    metrics.mark(item_id, 'transferring')
+    item.update(progress_data)
+    progress.push(item_id, progress_data)
 
 def start_next_download():
-    """次のダウンロードを開始する"""
+    """空いているスロットの数だけ次のダウンロードを開始する"""
+    if not _ytdlp_ready.is_set():
+        return
+    general = settings_handler.get_setting('general', {})
     with queue_lock:
-        max_downloads = settings_handler.get_setting('general', {}).get('concurrentDownloads', 1)
-        downloading_count = sum(1 for item in download_queue.values() if item['status'] == 'downloading')
-        if downloading_count >= max_downloads: 
-            return
-        
-        waiting_item = next((item for item in download_queue.values() if item['status'] == 'waiting'), None)
-        if waiting_item:
-            socketio.start_background_task(target=run_download_process, item_id=waiting_item['id'])
+        max_downloads = concurrency.current_limit(general.get('concurrentDownloads', 1))
+        scheduler.configure(general.get('perHostConcurrency', 0), general.get('perHostRequestsPerMinute', 0))
+        free_slots = max(max_downloads - scheduler.running_count(), 0)
+        item_ids = scheduler.take(free_slots)
+        metrics.inc('scheduler_passes_total')
+        metrics.inc('scheduler_started_total', len(item_ids))
+        # 次に開始される待機アイテムの情報抽出を先に済ませておく
+        upcoming = [download_queue[item_id] for item_id in scheduler.peek(prefetch.LOOKAHEAD)]
+        _schedule_wakeup(scheduler.next_wakeup())
+    
+    if general.get('downloadEngine') != 'worker':
+        prefetch.schedule(upcoming)
+    if general.get('downloadEngine') == 'asyncio':
+        # 実行中のダウンロードはすべて1つのイベントループ上で待つ
+        for item_id in item_ids:
+            async_engine.submit(run_download_async(item_id))
+        return
+    for item_id in item_ids:
+        socketio.start_background_task(target=run_download_process, item_id=item_id)
+
+def restore_queue():
+    """ジャーナルからキューを復元し、書き込みを開始する（起動時に呼ぶ）"""
+    archive.load()
+    queue_items, version = journal.load()
+    with queue_lock:
+        queue_events.restore_version(version)
+        for item_id, item in queue_items.items():
+            if item['status'] in ('downloading', 'processing'):
+                # 中断されたダウンロード・後処理は待機に戻し、yt-dlpに途中のファイルから再開させる
+                item.update({'status': 'waiting', 'details': '', 'details_key': None})
+            download_queue[item_id] = item
+            queue_events.track(item)
+            if item['status'] not in ('completed', 'error'):
+                for key in _archive_keys(item):
+                    archive.mark_queued(key, item_id)
+            if item['status'] == 'waiting':
+                scheduler.enqueue(item_id, item.get('priority', 0), scheduler.host_of(item['url']))
+                metrics.mark(item_id, 'queued')
+                if item.get('pinned'):
+                    scheduler.move_to_top(item_id)
+        expanding_ids = [item_id for item_id, item in download_queue.items() if item['status'] == 'expanding']
+    journal.start(_journal_snapshot)
+    for item_id in expanding_ids:
+        socketio.start_background_task(target=expand_playlist, parent_id=item_id)
+    socketio.start_background_task(target=start_next_download)
+
+def _schedule_wakeup(wake_at):
+    """再試行待ちやホストのブロックが解ける時刻に start_next_download を呼ぶ（queue_lock 保持中に呼ぶ）"""
+    global _wakeup_at
+    if wake_at is None or (_wakeup_at is not None and _wakeup_at <= wake_at):
+        return
+    _wakeup_at = wake_at
+    socketio.start_background_task(target=_wakeup_timer, wake_at=wake_at)
+
+def _wakeup_timer(wake_at):
+    global _wakeup_at
+    socketio.sleep(max(wake_at - time.monotonic(), 0))
+    with queue_lock:
+        if _wakeup_at == wake_at:
+            _wakeup_at = None
+    start_next_download()
+
+def start_bootstrap():
+    """yt-dlp.exe の取得とバージョン確認をバックグラウンドで開始する（起動時に呼ぶ）"""
+    socketio.start_background_task(target=_bootstrap)
+
+def _bootstrap():
+    if not os.path.exists(ytdlp_handler.YT_DLP_PATH):
+        _bootstrap_status['message_key'] = 'bootstrap_downloading'
+        socketio.emit('update_status', {'message_key': 'bootstrap_downloading'})
+    if not ytdlp_handler.download_yt_dlp():
+        # 失敗した場合は「Update」ボタンからの再取得を待つ
+        _bootstrap_status['message_key'] = 'bootstrap_failed'
+        socketio.emit('update_status', {'message_key': 'bootstrap_failed'})
+        return
+    version = ytdlp_handler.get_yt_dlp_version()
+    if _bootstrap_status['message_key']:
+        _bootstrap_status['message_key'] = None
+        socketio.emit('update_status', {'message_key': 'update_status_complete', 'version': version})
+    socketio.emit('version_info', {'version': version})
+    _ytdlp_ready.set()
+    start_next_download()
+
+def _emit_version():
+    socketio.emit('version_info', {'version': ytdlp_handler.get_yt_dlp_version()})
+
+def start_concurrency_controller():
+    """同時ダウンロード数の自動調整ループを開始する（起動時に呼ぶ）"""
+    concurrency.start(_measure_throughput, start_next_download)
+
+def _measure_throughput():
+    """実行中アイテムの合計速度（バイト/秒）と実行中数・待機数を返す"""
+    with queue_lock:
+        running_ids = scheduler.running_ids()
+        throughput = sum(download_queue[item_id].get('speed') or 0 for item_id in running_ids if item_id in download_queue)
+        return throughput, len(running_ids), scheduler.waiting_count()
+
+def _journal_snapshot():
+    """ジャーナル圧縮用に現在のキューのコピーを返す"""
+    with queue_lock:
+        return queue_events.queue_version, {item_id: dict(item) for item_id, item in download_queue.items()}
 
 @socketio.on('connect')
 def handle_connect(auth):
-    emit('version_info', {'version': ytdlp_handler.get_yt_dlp_version()})
-    emit('queue_update', {'queue': download_queue})
-    emit('settings_loaded', {'settings': settings_handler.app_settings})
+    version = ytdlp_handler.get_yt_dlp_version(cached_only=True)
+    if version is None:
+        # バージョン確認のサブプロセスで接続処理を待たせない
+        socketio.start_background_task(target=_emit_version)
+    else:
+        emit('version_info', {'version': version})
+    if _bootstrap_status['message_key']:
+        emit('update_status', {'message_key': _bootstrap_status['message_key']})
+    auth = auth if isinstance(auth, dict) else {}
+    # キュー全体ではなく、クライアントが見ているページだけを送る（再接続で履歴が残っていれば差分だけ）
+    message = queue_events.resume_view(request.sid, auth.get('queueView'), auth.get('queueEpoch'),
+                                       auth.get('queueVersion'), auth.get('queueIds'))
+    if message:
+        emit(*message)
+    emit('settings_loaded', {'settings': settings_handler.get_client_settings(auth.get('profile'))})
+    if concurrency.get_last_decision():
+        emit('concurrency_update', concurrency.get_last_decision())
 
 @socketio.on('add_to_queue')
 def handle_add_to_queue(data):
     """ダウンロードキューに追加"""
     urls, options = data.get('urls', []), data.get('options', {})
+    priority = _parse_priority(data.get('priority'))
+    status = 'expanding' if options.get('expandPlaylist') else 'waiting'
+    # プレイリストは新しい動画が増えるため、展開する場合は子アイテムの単位で重複を判定する
+    keys = [None if status == 'expanding' else archive.archive_key(url) for url in urls]
+    changes, skipped = [], []
     with queue_lock:
-        for url in urls:
-            item_id = str(uuid.uuid4())
-            download_queue[item_id] = {
-                'id': item_id, 'url': url, 'status': 'waiting',
-                'progress': 0, 'details': '', 'options': options
-            }
-    emit('queue_update', {'queue': download_queue}, broadcast=True)
+        for url, key in zip(urls, keys):
+            duplicate = key and archive.find_duplicate(key)
+            if duplicate:
+                skipped.append({'url': url, 'reason': duplicate})
+                continue
+            item = _add_item(url, options, priority, status=status, archive_key=key)
+            changes.append(queue_events.record('added', item))
+    queue_events.publish(changes)
+    emit('add_result', {'added': len(changes), 'skipped': skipped})
+    if status == 'expanding':
+        for change in changes:
+            socketio.start_background_task(target=expand_playlist, parent_id=change['id'])
     socketio.start_background_task(target=start_next_download)
 
+def _parse_priority(value):
+    """クライアントから受け取った優先度を範囲内の整数にする（数値でなければ 0）"""
+    try:
+        priority = int(value or 0)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    return min(max(priority, MIN_PRIORITY), MAX_PRIORITY)
+
+def _add_item(url, options, priority=0, status='waiting', **extra):
+    """キューにアイテムを作成する（queue_lock 保持中に呼ぶ）"""
+    item_id = str(uuid.uuid4())
+    item = {
+        'id': item_id, 'url': url, 'status': status,
+        'progress': 0, 'details': '', 'options': options, 'priority': priority, **extra
+    }
+    download_queue[item_id] = item
+    if status == 'waiting':
+        scheduler.enqueue(item_id, priority, scheduler.host_of(url))
+        metrics.mark(item_id, 'queued')
+    for key in _archive_keys(item):
+        archive.mark_queued(key, item_id)
+    return item
+
+def expand_playlist(parent_id):
+    """プレイリスト/チャンネルを展開し、発見したエントリをページ単位で子アイテムとして追加する"""
+    with queue_lock:
+        parent = download_queue.get(parent_id)
+        if not parent:
+            return
+        # 再起動で中断された展開を再開する場合は、追加済みのURLを飛ばす
+        known_urls = {item['url'] for item in download_queue.values() if item.get('parent_id') == parent_id}
+    url, options = parent['url'], parent['options']
+    # 子アイテムは親のオプションを引き継ぐが、それ以上は展開しない
+    child_options = dict(options, expandPlaylist=False)
+    
+    try:
+        entries = ytdlp_handler.extract_playlist_entries(url, options.get('cookieBrowser'))
+        if entries is None:
+            # プレイリストでなければ通常のアイテムとしてダウンロードする
+            key = archive.archive_key(url)
+            with queue_lock:
+                if parent_id not in download_queue:
+                    return
+                parent.update({'status': 'waiting', 'archive_key': key})
+                archive.mark_queued(key, parent_id)
+                scheduler.enqueue(parent_id, parent.get('priority', 0), scheduler.host_of(url))
+                metrics.mark(parent_id, 'queued')
+                changes = [queue_events.record('updated', parent)]
+            queue_events.publish(changes)
+            start_next_download()
+            return
+        
+        while True:
+            page = list(itertools.islice(entries, PLAYLIST_PAGE_SIZE))
+            if not page:
+                break
+            # 抽出器名と動画IDが分かるエントリは、エントリのURLを直接追加したときにも重複と分かるようURLのキーも持たせる
+            keys = [(archive.entry_key(entry['ie_key'], entry['id']), archive.archive_key(entry['url']))
+                    if entry['ie_key'] and entry['id'] else (archive.archive_key(entry['url']), None) for entry in page]
+            changes = []
+            with queue_lock:
+                if parent_id not in download_queue:
+                    # 親アイテムが削除されたら展開を中止する
+                    return
+                for entry, (key, url_key) in zip(page, keys):
+                    if entry['url'] in known_urls:
+                        continue
+                    known_urls.add(entry['url'])
+                    if archive.find_duplicate(key) or (url_key and archive.find_duplicate(url_key)):
+                        parent['skipped'] = parent.get('skipped', 0) + 1
+                        continue
+                    child = _add_item(entry['url'], child_options, parent.get('priority', 0),
+                                      parent_id=parent_id, title=entry['title'], archive_key=key, url_key=url_key)
+                    changes.append(queue_events.record('added', child))
+                parent['count'] = len(known_urls) - parent.get('skipped', 0)
+                changes.append(queue_events.record('updated', parent))
+            queue_events.publish(changes)
+            start_next_download()
+        
+        with queue_lock:
+            if parent_id not in download_queue:
+                return
+            parent.update({'status': 'completed', 'progress': 100, 'details_key': 'details_expanded'})
+            changes = [queue_events.record('updated', parent)]
+    except Exception as e:
+        with queue_lock:
+            if parent_id not in download_queue:
+                return
+            parent.update({'status': 'error', 'details': str(e)})
+            changes = [queue_events.record('updated', parent)]
+    queue_events.publish(changes)
+
 @socketio.on('save_settings')
 def handle_save_settings(data):
     """設定の保存"""
-    settings_handler.save_settings(data.get('settings', {}))
-    emit('settings_saved', {'message_key': 'settings_saved'})
-    start_next_download()
+    errors = settings_handler.save_settings(data.get('settings', {}), data.get('profile'))
+    emit('settings_saved', {'message_key': 'settings_saved', 'errors': errors})
+
+def _on_settings_changed(changed):
+    """設定の変更を他のクライアントに伝え、同時数などの変更はすぐにスケジューラーへ反映する"""
+    if any(key.startswith('general.') for key in changed):
+        socketio.emit('settings_changed', {'general': settings_handler.get_setting('general', {})})
+    if changed & SCHEDULING_SETTINGS:
+        socketio.start_background_task(target=start_next_download)
+
+settings_handler.on_change(_on_settings_changed)
 
 @socketio.on('update_yt_dlp')
 def handle_update_yt_dlp():
@@ -102,32 +603,89 @@ def handle_update_yt_dlp():
     emit('update_status', {'message_key': 'update_status_updating'})
     if ytdlp_handler.download_yt_dlp(force_update=True):
         new_version = ytdlp_handler.get_yt_dlp_version()
+        _bootstrap_status['message_key'] = None
         emit('update_status', {'message_key': 'update_status_complete', 'version': new_version})
         emit('version_info', {'version': new_version})
+        if not _ytdlp_ready.is_set():
+            _ytdlp_ready.set()
+            start_next_download()
     else:
         emit('update_status', {'message_key': 'update_status_failed'})
 
+@socketio.on('move_to_top')
+def handle_move_to_top(data):
+    """待機中アイテムをキューの先頭へ移動"""
+    item_id = data.get('id')
+    with queue_lock:
+        item = download_queue.get(item_id)
+        if not item or not scheduler.move_to_top(item_id):
+            return
+        item['pinned'] = True
+        changes = [queue_events.record('updated', item)]
+    queue_events.publish(changes)
+
+@socketio.on('set_priority')
+def handle_set_priority(data):
+    """待機中アイテムの優先度を変更"""
+    item_id = data.get('id')
+    priority = _parse_priority(data.get('priority'))
+    with queue_lock:
+        item = download_queue.get(item_id)
+        if not item or not scheduler.set_priority(item_id, priority):
+            return
+        item['priority'] = priority
+        changes = [queue_events.record('updated', item)]
+    queue_events.publish(changes)
+
 @socketio.on('remove_item')
 def handle_remove_item(data):
     """ダウンロードアイテムの削除/キャンセル"""
     item_id = data.get('id')
+    changes = []
+    process = None
     with queue_lock:
         if item_id in download_queue:
             item = download_queue[item_id]
-            if item['status'] == 'downloading':
+            if item['status'] in ('downloading', 'processing'):
                 process = active_processes.pop(item_id, None)
                 if process:
-                    process.terminate()
                     item['status'] = 'cancelled'
             download_queue.pop(item_id, None)
-    emit('queue_update', {'queue': download_queue}, broadcast=True)
+            scheduler.discard(item_id)
+            _update_archive(item, removed=True)
+            changes.append(queue_events.record('removed', item_id=item_id))
+    if process:
+        # ワーカーモードのハンドルはジョブのデータベースに書き込むため、ロックを離してから止める
+        process.terminate()
+    prefetch.discard(item_id)
+    metrics.finish_item(item_id, 'removed')
+    queue_events.publish(changes)
     start_next_download()
 
 @socketio.on('clear_queue')
 def handle_clear_queue():
     """完了済み/エラーアイテムをクリア"""
     with queue_lock:
-        ids_to_remove = [item_id for item_id, item in download_queue.items() if item['status'] != 'downloading']
+        ids_to_remove = [item_id for item_id, item in download_queue.items() if item['status'] not in ('downloading', 'processing', 'expanding')]
         for item_id in ids_to_remove:
-            download_queue.pop(item_id, None)
-    emit('queue_update', {'queue': download_queue}, broadcast=True)
+            _update_archive(download_queue.pop(item_id), removed=True)
+            scheduler.discard(item_id)
+        changes = [queue_events.record('removed', item_id=item_id) for item_id in ids_to_remove]
+    for item_id in ids_to_remove:
+        prefetch.discard(item_id)
+        metrics.finish_item(item_id, 'removed')
+    queue_events.publish(changes)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    queue_events.close_view(request.sid)
+
+@socketio.on('queue_view')
+def handle_queue_view(data):
+    """表示するページ（絞り込み・開始位置・件数）を変更し、そのページを送信"""
+    emit('queue_snapshot', queue_events.open_view(request.sid, data))
+
+@socketio.on('queue_sync')
+def handle_queue_sync():
+    """差分を取りこぼしたクライアントに、見ているページを送り直す"""
+    emit('queue_snapshot', queue_events.snapshot(request.sid))
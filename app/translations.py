@@ -4,14 +4,21 @@ translations = {
         "update_button": "Update", "control_panel": "コントロールパネル", "video_url_label": "動画URL (1行に1つ):",
         "main": "メイン", "video": "映像", "audio": "音声", "other": "その他",
         "save_path_label": "保存先フォルダ:", "browse": "参照...", "open": "開く",
-        "concurrent_downloads_label": "同時ダウンロード数:", "video_format_label": "映像フォーマット:",
+        "concurrent_downloads_label": "同時ダウンロード数:", "download_engine_label": "ダウンロードエンジン:",
+        "engine_subprocess": "yt-dlp.exe (外部プロセス)", "engine_inprocess": "yt_dlp (プロセスプール)", "engine_asyncio": "yt-dlp.exe (asyncioで出力を読み取り)", "engine_worker": "ワーカー (python run.py --worker)",
+        "auto_concurrency_label": "回線速度に合わせて同時数を自動調整", "concurrency_bounds_label": "自動調整の範囲 (最小〜最大):",
+        "concurrency_status_label": "自動調整: 同時数", "concurrency_reason_probe": "増やして計測中", "concurrency_reason_steady": "安定", "concurrency_reason_idle": "空きスロットあり",
+        "concurrency_reason_no_gain": "効果がないため減少", "concurrency_reason_throughput_drop": "速度低下のため半減", "concurrency_reason_throttled": "制限を受けたため半減", "video_format_label": "映像フォーマット:",
         "best_quality_mp4": "最高品質 (mp4)", "best_quality_webm": "最高品質 (webm)",
         "audio_only_label": "音声のみダウンロード", "audio_format_label": "音声フォーマット:",
         "best_quality_original": "最高音質 (元の形式)", "cookie_browser_label": "Cookieを使用するブラウザ:",
         "not_used": "使用しない", "chrome_not_recommended": "Chrome (非推奨)",
-        "custom_args_label": "カスタム引数:", "save_settings_button": "現在の設定を保存",
+        "custom_args_label": "カスタム引数:",
+        "per_host_concurrency_label": "サイトごとの同時ダウンロード数 (0 = 無制限):", "per_host_rate_label": "サイトごとの1分あたりの開始数 (0 = 無制限):",
+        "separate_postprocessing_label": "結合・音声変換をダウンロード枠とは別に処理 (ffmpegが必要)", "save_settings_button": "現在の設定を保存",
         "add_to_queue_button": "キューに追加", "download_queue_title": "ダウンロードキュー",
         "clear_completed_button": "完了/エラーをクリア", "no_downloads_yet": "まだダウンロードはありません。",
+        "queue_filter_all": "すべて", "queue_filter_active": "進行中", "queue_filter_completed": "完了", "queue_filter_failed": "エラー/キャンセル",
         "cookie_help_title": "Cookie機能について",
         "cookie_help_p1": "ログインが必要な動画をダウンロードするための機能です。",
         "cookie_help_li1": "✅ <strong>Firefox:</strong> 開発環境で動作確認済みです。最も推奨されます。",
@@ -24,24 +31,35 @@ translations = {
         "welcome_li3": "著作権保護されたコンテンツの無断ダウンロードは違法となる可能性があります。",
         "welcome_li4": "本ツールの使用によって生じたいかなる問題についても、開発者は一切の責任を負いません。",
         "dont_show_again": "再度表示しない", "close": "閉じる",
-        "status_waiting": "待機中", "status_downloading": "ダウンロード中", "status_completed": "完了", "status_error": "エラー", "status_cancelled": "キャンセル済み",
-        "details_completed": "ダウンロードが完了しました。", "details_cancelled": "ダウンロードがキャンセルされました。",
-        "settings_saved": "保存しました！", "alert_enter_url": "URLを入力してください。",
-        "button_title_cancel": "キャンセル", "button_title_delete": "削除", "copy_error": "エラーをコピー", "copied": "✅",
-        "update_status_updating": "アップデート中...", "update_status_complete": "アップデート完了！ (Ver: {version})", "update_status_failed": "アップデートに失敗しました。"
+        "status_waiting": "待機中", "status_downloading": "ダウンロード中", "status_completed": "完了", "status_error": "エラー", "status_cancelled": "キャンセル済み", "status_expanding": "展開中", "status_processing": "後処理中",
+        "details_completed": "ダウンロードが完了しました。", "details_cancelled": "ダウンロードがキャンセルされました。", "details_duplicate": "別のURLで既にダウンロード済みかキューにあるためスキップしました。", "details_expanded": "{count}件のアイテムを追加しました。", "details_processing": "結合/変換中...",
+        "skipped_duplicates": "{count}件はダウンロード済みまたはキューにあるためスキップしました。",
+        "expand_playlist_label": "プレイリスト/チャンネルを個別のアイテムに展開",
+        "priority_label": "優先度（-100〜100、大きいほど先に開始）:",
+        "settings_saved": "保存しました！", "settings_invalid": "不正な値のため保存しなかった項目: {keys}", "alert_enter_url": "URLを入力してください。",
+        "button_title_cancel": "キャンセル", "button_title_delete": "削除", "button_title_move_top": "先頭へ移動", "button_title_priority": "優先度（大きいほど先に開始）", "copy_error": "エラーをコピー", "copied": "✅",
+        "update_status_updating": "アップデート中...", "update_status_complete": "アップデート完了！ (Ver: {version})", "update_status_failed": "アップデートに失敗しました。",
+        "bootstrap_downloading": "yt-dlp.exeをダウンロード中...", "bootstrap_failed": "yt-dlp.exeのダウンロードに失敗しました。Updateで再試行してください。"
     },
     "en": {
         "update_button": "Update", "control_panel": "Control Panel", "video_url_label": "Video URL (one per line):",
         "main": "Main", "video": "Video", "audio": "Audio", "other": "Other",
         "save_path_label": "Save to folder:", "browse": "Browse...", "open": "Open",
-        "concurrent_downloads_label": "Concurrent downloads:", "video_format_label": "Video Format:",
+        "concurrent_downloads_label": "Concurrent downloads:", "download_engine_label": "Download engine:",
+        "engine_subprocess": "yt-dlp.exe (subprocess)", "engine_inprocess": "yt_dlp (process pool)", "engine_asyncio": "yt-dlp.exe (asyncio output reader)", "engine_worker": "Workers (python run.py --worker)",
+        "auto_concurrency_label": "Adjust concurrency automatically to bandwidth", "concurrency_bounds_label": "Auto range (min to max):",
+        "concurrency_status_label": "Auto: slots", "concurrency_reason_probe": "probing", "concurrency_reason_steady": "steady", "concurrency_reason_idle": "slots idle",
+        "concurrency_reason_no_gain": "no gain, reduced", "concurrency_reason_throughput_drop": "throughput dropped, halved", "concurrency_reason_throttled": "throttled, halved", "video_format_label": "Video Format:",
         "best_quality_mp4": "Best Quality (mp4)", "best_quality_webm": "Best Quality (webm)",
         "audio_only_label": "Download audio only", "audio_format_label": "Audio Format:",
         "best_quality_original": "Best Quality (original)", "cookie_browser_label": "Browser for cookies:",
         "not_used": "Do not use", "chrome_not_recommended": "Chrome (not recommended)",
-        "custom_args_label": "Custom Arguments:", "save_settings_button": "Save Current Settings",
+        "custom_args_label": "Custom Arguments:",
+        "per_host_concurrency_label": "Concurrent downloads per site (0 = unlimited):", "per_host_rate_label": "Downloads started per site per minute (0 = unlimited):",
+        "separate_postprocessing_label": "Merge/convert outside download slots (requires ffmpeg)", "save_settings_button": "Save Current Settings",
         "add_to_queue_button": "Add to Queue", "download_queue_title": "Download Queue",
         "clear_completed_button": "Clear Completed/Errors", "no_downloads_yet": "No downloads yet.",
+        "queue_filter_all": "All", "queue_filter_active": "Active", "queue_filter_completed": "Completed", "queue_filter_failed": "Errors/Cancelled",
         "cookie_help_title": "About the Cookie Feature",
         "cookie_help_p1": "This feature is for downloading videos that require a login.",
         "cookie_help_li1": "✅ <strong>Firefox:</strong> Confirmed working in the development environment. Highly recommended.",
@@ -54,10 +72,14 @@ translations = {
         "welcome_li3": "Unauthorized downloading of copyrighted content may be illegal in your country.",
         "welcome_li4": "The developer assumes no responsibility for any legal issues arising from the use of this tool.",
         "dont_show_again": "Do not show again", "close": "Close",
-        "status_waiting": "Waiting", "status_downloading": "Downloading", "status_completed": "Completed", "status_error": "Error", "status_cancelled": "Cancelled",
-        "details_completed": "Download completed.", "details_cancelled": "Download was cancelled.",
-        "settings_saved": "Settings saved!", "alert_enter_url": "Please enter a URL.",
-        "button_title_cancel": "Cancel", "button_title_delete": "Delete", "copy_error": "Copy error", "copied": "✅",
-        "update_status_updating": "Updating...", "update_status_complete": "Update complete! (Ver: {version})", "update_status_failed": "Update failed."
+        "status_waiting": "Waiting", "status_downloading": "Downloading", "status_completed": "Completed", "status_error": "Error", "status_cancelled": "Cancelled", "status_expanding": "Expanding", "status_processing": "Processing",
+        "details_completed": "Download completed.", "details_cancelled": "Download was cancelled.", "details_duplicate": "Skipped: already downloaded or queued under another URL.", "details_expanded": "Added {count} items.", "details_processing": "Merging/converting...",
+        "skipped_duplicates": "Skipped {count} URL(s) already downloaded or in the queue.",
+        "expand_playlist_label": "Expand playlists/channels into individual items",
+        "priority_label": "Priority (-100 to 100, higher starts first):",
+        "settings_saved": "Settings saved!", "settings_invalid": "Not saved (invalid values): {keys}", "alert_enter_url": "Please enter a URL.",
+        "button_title_cancel": "Cancel", "button_title_delete": "Delete", "button_title_move_top": "Move to top", "button_title_priority": "Priority (higher starts first)", "copy_error": "Copy error", "copied": "✅",
+        "update_status_updating": "Updating...", "update_status_complete": "Update complete! (Ver: {version})", "update_status_failed": "Update failed.",
+        "bootstrap_downloading": "Downloading yt-dlp.exe...", "bootstrap_failed": "Failed to download yt-dlp.exe. Press Update to retry."
     }
 }
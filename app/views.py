@@ -1,7 +1,8 @@
-from flask import render_template, request, jsonify, Blueprint
+from flask import render_template, request, jsonify, Blueprint, Response
 import subprocess
+import hmac
 import os
-from . import ytdlp_handler, settings_handler
+from . import ytdlp_handler, settings_handler, format_cache, archive, metrics, library, jobs, remote_engine
 from .translations import translations
 
 main_bp = Blueprint('main', __name__)
@@ -31,6 +32,120 @@ def get_formats_api():
     result = ytdlp_handler.get_available_formats(url, cookie_browser)
     return jsonify(result)
 
+@main_bp.route('/api/formats/stats', methods=['GET'])
+def get_formats_cache_stats():
+    """フォーマット取得キャッシュのヒット/ミス数を返すAPI"""
+    return jsonify(format_cache.get_stats())
+
+@main_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheusのテキスト形式でメトリクスを返す（GUI_YTDLP_METRICS=1 で起動した場合のみ）"""
+    if not metrics.ENABLED:
+        return Response('Metrics are disabled. Set GUI_YTDLP_METRICS=1 to enable.\n', status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@main_bp.route('/metrics/items', methods=['GET'])
+def get_item_timings():
+    """直近のアイテムのフェーズごとの所要時間（待機→抽出→転送→後処理）を返すAPI"""
+    if not metrics.ENABLED:
+        return jsonify({'success': False, 'error': 'Metrics are disabled'}), 404
+    return jsonify({'success': True, 'items': metrics.get_item_timings()})
+
+@main_bp.route('/api/archive/import', methods=['POST'])
+def import_archive():
+    """既存のyt-dlpのダウンロードアーカイブファイルを取り込むAPI"""
+    path = (request.get_json(silent=True) or {}).get('path')
+    if not path or not os.path.isfile(path):
+        return jsonify({'success': False, 'error': 'Archive file not found'}), 400
+    try:
+        return jsonify({'success': True, 'imported': archive.import_file(path)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@main_bp.route('/api/library', methods=['GET'])
+def search_library():
+    """保存先フォルダのファイルの索引を検索するAPI（q: キーワード, ext, root, sort: recent/title/size, limit, offset）"""
+    args = request.args
+    try:
+        total, files = library.search(args.get('q', ''), args.get('ext'), args.get('root'), args.get('sort', 'recent'),
+                                      args.get('limit', 100), args.get('offset', 0))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'total': total, 'files': files, 'scanning': library.is_scanning()})
+
+@main_bp.route('/api/library/scan', methods=['POST'])
+def scan_library():
+    """索引を更新するAPI。path を指定するとそのフォルダも索引の対象に加える"""
+    path = (request.get_json(silent=True) or {}).get('path')
+    if path and not os.path.isdir(path):
+        return jsonify({'success': False, 'error': 'Folder not found'}), 400
+    if path:
+        library.add_root(path)
+    library.start_scan()
+    return jsonify({'success': True, 'roots': library.get_roots()})
+
+@main_bp.route('/api/jobs/lease', methods=['POST'])
+def lease_job():
+    """別のマシンのワーカーにジョブを1件リースするAPI（jobs.HttpJobBackend から使う）"""
+    data, error = _worker_request()
+    if error:
+        return error
+    job = remote_engine.get_backend().lease(data['worker_id'], _lease_seconds(data))
+    return jsonify({'job': {'id': job[0], 'payload': job[1]} if job else None})
+
+@main_bp.route('/api/jobs/<job_id>/heartbeat', methods=['POST'])
+def heartbeat_job(job_id):
+    """リースを延長するAPI。リースを失った・キャンセルされた場合は leased: false"""
+    data, error = _worker_request()
+    if error:
+        return error
+    return jsonify({'leased': remote_engine.get_backend().heartbeat(job_id, data['worker_id'], _lease_seconds(data))})
+
+@main_bp.route('/api/jobs/<job_id>/progress', methods=['POST'])
+def report_job_progress(job_id):
+    """ワーカーから進捗を受け取るAPI"""
+    data, error = _worker_request()
+    if error:
+        return error
+    if isinstance(data.get('data'), dict):
+        remote_engine.get_backend().report_progress(job_id, data['worker_id'], data['data'])
+    return jsonify({'success': True})
+
+@main_bp.route('/api/jobs/<job_id>/finish', methods=['POST'])
+def finish_job(job_id):
+    """ワーカーからジョブの結果を受け取るAPI"""
+    data, error = _worker_request()
+    if error:
+        return error
+    returncode = data.get('returncode')
+    stderr_tail = data.get('stderr_tail')
+    if not isinstance(returncode, int) or not isinstance(stderr_tail, list):
+        return jsonify({'success': False, 'error': 'returncode and stderr_tail are required'}), 400
+    result = data.get('result') if isinstance(data.get('result'), dict) else None
+    remote_engine.get_backend().finish(job_id, data['worker_id'], returncode, stderr_tail, result)
+    return jsonify({'success': True})
+
+def _worker_request():
+    """ジョブAPIのリクエストをトークンで認証し、(本文, エラー時の応答) を返す
+
+    トークン（環境変数 GUI_YTDLP_WORKER_TOKEN）が設定されていなければジョブAPIは使えない
+    """
+    token = os.environ.get(jobs.WORKER_TOKEN_ENV)
+    if not token:
+        return None, (jsonify({'success': False, 'error': 'Worker API is disabled'}), 403)
+    if not hmac.compare_digest(request.headers.get(jobs.WORKER_TOKEN_HEADER, '').encode(), token.encode()):
+        return None, (jsonify({'success': False, 'error': 'Invalid worker token'}), 403)
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('worker_id'), str) or not data['worker_id']:
+        return None, (jsonify({'success': False, 'error': 'worker_id is required'}), 400)
+    return data, None
+
+def _lease_seconds(data):
+    try:
+        return min(max(int(data.get('lease_seconds', jobs.LEASE_SECONDS)), 1), jobs.MAX_LEASE_SECONDS)
+    except (TypeError, ValueError, OverflowError):
+        return jobs.LEASE_SECONDS
+
 @main_bp.route('/select-folder', methods=['POST'])
 def select_folder():
     """フォルダ選択ダイアログを開く"""
@@ -0,0 +1,103 @@
+import os
+import time
+import socket
+import threading
+import subprocess
+from . import jobs, ytdlp_handler, library, archive
+
+# 待機中のジョブが無いときに次のリースを試みるまでの秒数
+POLL_INTERVAL = 1
+# 進捗イベントを送る最短の間隔（秒）
+PROGRESS_INTERVAL = 0.5
+# リースを延長する間隔（秒）。キャンセルもこの間隔で検知する
+HEARTBEAT_INTERVAL = 2
+
+def run(backend_url=None, slots=2, save_path=None, worker_id=None):
+    """ワーカーモードのメインループ。ジョブをリースし、このマシン上でyt-dlpを実行する"""
+    backend = jobs.open_backend(backend_url)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    free_slots = threading.Semaphore(slots)
+    ytdlp_handler.setup_directories()
+    if not ytdlp_handler.download_yt_dlp():
+        raise RuntimeError("yt-dlp is not available on this worker")
+    print(f"Worker {worker_id} started with {slots} slot(s)")
+
+    while True:
+        free_slots.acquire()
+        try:
+            job = backend.lease(worker_id)
+        except Exception as e:
+            print(f"Error leasing job: {e}")
+            job = None
+        if not job:
+            free_slots.release()
+            time.sleep(POLL_INTERVAL)
+            continue
+        job_id, payload = job
+        threading.Thread(target=_run_job, args=(backend, worker_id, job_id, payload, save_path, free_slots),
+                         daemon=True).start()
+
+def _run_job(backend, worker_id, job_id, payload, save_path, free_slots):
+    """1件のジョブを実行し、進捗と結果をバックエンドに送る"""
+    try:
+        item = payload['item']
+        if save_path:
+            # UIノードの保存先はこのマシンに存在しないことがあるため、ワーカー側の保存先で上書きする
+            item['options'] = dict(item.get('options', {}), savePath=save_path)
+        returncode, stderr_tail = _download(backend, worker_id, job_id, item)
+        # 重複判定のキーと保存したファイルは、UIノードがアーカイブ・ライブラリの索引に反映する
+        paths = library.take_paths(item['id'])
+        result = {'archive_key': archive.take_key(item['id']),
+                  'files': library.describe_files(paths) if returncode == 0 else []}
+    except Exception as e:
+        returncode, stderr_tail, result = 1, [str(e)], None
+    finally:
+        free_slots.release()
+    try:
+        backend.finish(job_id, worker_id, returncode, stderr_tail, result)
+    except Exception as e:
+        print(f"Error reporting result of {job_id}: {e}")
+
+def _download(backend, worker_id, job_id, item):
+    command = ytdlp_handler.build_download_command(item)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               text=True, encoding='utf-8', errors='ignore',
+                               creationflags=subprocess.CREATE_NO_WINDOW)
+    finished = threading.Event()
+    latest = {}
+    lock = threading.Lock()
+
+    def on_line(line):
+        progress_data = ytdlp_handler.parse_progress(line)
+        if progress_data:
+            with lock:
+                latest.update(progress_data)
+
+    def keep_alive():
+        # リースの延長と、溜まった進捗の送信を同じスレッドで行う
+        last_heartbeat = time.monotonic()
+        while not finished.wait(PROGRESS_INTERVAL):
+            with lock:
+                progress_data = dict(latest)
+                latest.clear()
+            try:
+                if progress_data:
+                    backend.report_progress(job_id, worker_id, progress_data)
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    if not backend.heartbeat(job_id, worker_id):
+                        # キャンセルされたか、リースを失って他のワーカーに渡った
+                        process.terminate()
+                        return
+            except Exception as e:
+                print(f"Error contacting job backend: {e}")
+
+    keeper = threading.Thread(target=keep_alive, daemon=True)
+    keeper.start()
+    try:
+        stderr_tail = ytdlp_handler.read_process_output(process, on_line)
+        process.wait()
+    finally:
+        finished.set()
+        keeper.join()
+    return process.returncode, stderr_tail
@@ -1,24 +1,89 @@
 import os
+import sys
 import subprocess
 import requests
 import re
 import shlex
-import yt_dlp
+import threading
+import collections
+from . import format_cache, metrics, library, archive
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 TOOLS_DIR = os.path.join(BASE_DIR, 'tools')
 DOWNLOADS_DIR = os.path.join(BASE_DIR, 'downloads')
-YT_DLP_PATH = os.path.join(TOOLS_DIR, 'yt-dlp.exe')
+# ベンチマーク用の偽のyt-dlpなどに差し替えられるよう、環境変数で上書きできる
+YT_DLP_PATH = os.environ.get('YT_DLP_PATH') or os.path.join(TOOLS_DIR, 'yt-dlp.exe')
 YT_DLP_LATEST_RELEASE_URL = 'https://api.github.com/repos/yt-dlp/yt-dlp/releases/latest'
+# エラー表示用に保持する標準エラー出力の末尾行数
+STDERR_TAIL_LINES = 20
+
+# --progress-template で出力させる機械可読な進捗行の形式: [progress]値|値|...
+PROGRESS_PREFIX = '[progress]'
+PROGRESS_FIELDS = ('downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'speed', 'eta',
+                   'fragment_index', 'fragment_count')
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_PREFIX + '|'.join(f'%(progress.{name})s' for name in PROGRESS_FIELDS)
+# ダウンロードアーカイブと同じ「抽出器名 動画ID」形式のキー
+ARCHIVE_KEY_TEMPLATE = '%(extractor_key)s %(id)s'
+# yt-dlpのエラー出力から失敗の種類を判定するためのパターン
+THROTTLED_ERROR_RE = re.compile(r'HTTP Error 429|Too Many Requests|rate[- ]limit', re.IGNORECASE)
+PERMANENT_ERROR_RE = re.compile(r'HTTP Error 4(?!29)\d\d|Unsupported URL|Private video|Video unavailable|'
+                                r'is not available|Requested format is not available', re.IGNORECASE)
+TRANSIENT_ERROR_RE = re.compile(r'HTTP Error 5\d\d|timed out|Connection (reset|refused|aborted)|Remote end closed|'
+                                r'IncompleteRead|Temporary failure|getaddrinfo failed|Unable to download webpage|'
+                                r'Got error:|Read timed out', re.IGNORECASE)
+
+# 先読みの情報JSONに影響するカスタム引数 -> 値の数。先読みのコマンドにもそのまま渡す
+EXTRACTION_ARGS = {
+    '--cookies': 1, '--cookies-from-browser': 1, '--no-cookies': 0, '--no-cookies-from-browser': 0,
+    '-u': 1, '--username': 1, '-p': 1, '--password': 1, '-2': 1, '--twofactor': 1, '-n': 0, '--netrc': 0,
+    '--netrc-location': 1, '--video-password': 1, '--ap-mso': 1, '--ap-username': 1, '--ap-password': 1,
+    '--client-certificate': 1, '--client-certificate-key': 1, '--client-certificate-password': 1,
+    '--proxy': 1, '--socket-timeout': 1, '--source-address': 1, '-4': 0, '--force-ipv4': 0, '-6': 0, '--force-ipv6': 0,
+    '--geo-verification-proxy': 1, '--xff': 1, '--geo-bypass': 0, '--no-geo-bypass': 0, '--geo-bypass-country': 1,
+    '--geo-bypass-ip-block': 1, '--add-header': 1, '--user-agent': 1, '--referer': 1, '--no-check-certificates': 0,
+    '--prefer-insecure': 0, '--legacy-server-connect': 0, '--sleep-requests': 1, '--extractor-retries': 1,
+    '--extractor-args': 1, '--compat-options': 1, '--ignore-config': 0, '--no-config': 0, '--config-locations': 1,
+    '--no-playlist': 0, '--yes-playlist': 0, '--age-limit': 1, '--allow-unplayable-formats': 0,
+    '-f': 1, '--format': 1, '-S': 1, '--format-sort': 1, '--format-sort-force': 0, '--encoding': 1,
+}
+# ダウンロード・保存・後処理にだけ影響するカスタム引数 -> 値の数。先読みのコマンドには渡さない
+# 一覧のどちらにも無い引数がある場合は、抽出結果が変わるかどうか分からないため先読みしない
+DOWNLOAD_ONLY_ARGS = {
+    '-o': 1, '--output': 1, '-P': 1, '--paths': 1, '--windows-filenames': 0, '--restrict-filenames': 0,
+    '--no-part': 0, '--no-mtime': 0, '-c': 0, '--continue': 0, '--no-continue': 0, '-w': 0, '--no-overwrites': 0,
+    '--force-overwrites': 0, '-r': 1, '--limit-rate': 1, '-N': 1, '--concurrent-fragments': 1, '-R': 1, '--retries': 1,
+    '--fragment-retries': 1, '--http-chunk-size': 1, '--downloader': 1, '--external-downloader': 1,
+    '--downloader-args': 1, '--external-downloader-args': 1, '--sleep-interval': 1, '--min-sleep-interval': 1,
+    '--max-sleep-interval': 1, '--download-sections': 1, '-x': 0, '--extract-audio': 0, '--audio-format': 1,
+    '--audio-quality': 1, '--merge-output-format': 1, '--remux-video': 1, '--recode-video': 1, '-k': 0,
+    '--keep-video': 0, '--postprocessor-args': 1, '--ppa': 1, '--exec': 1, '--ffmpeg-location': 1,
+    '--embed-subs': 0, '--embed-thumbnail': 0, '--embed-metadata': 0, '--add-metadata': 0, '--embed-chapters': 0,
+    '--split-chapters': 0, '--write-subs': 0, '--write-auto-subs': 0, '--sub-langs': 1, '--sub-format': 1,
+    '--convert-subs': 1, '--write-thumbnail': 0, '--convert-thumbnails': 1, '--sponsorblock-mark': 1,
+    '--sponsorblock-remove': 1, '--newline': 0, '--progress': 0, '--no-progress': 0,
+}
+
+# 旧形式（人間向けの進捗表示）のフォールバック用
+LEGACY_PROGRESS_RE = re.compile(r'\[download\]\s+([\d\.]+)% of\s+~?(.+?)\s+at\s+(.+?)\s+ETA\s+(.+)')
 
 active_processes = {}
 
+# バージョン文字列のキャッシュ。実行ファイルの (更新時刻, サイズ) が変わったら取り直す
+_version_cache = {'key': None, 'version': None}
+_version_lock = threading.Lock()
+
 def setup_directories():
     """必要なディレクトリを作成する"""
     for dir_path in [TOOLS_DIR, DOWNLOADS_DIR]:
         if not os.path.exists(dir_path): 
             os.makedirs(dir_path)
 
+def yt_dlp_command():
+    """yt-dlpを起動するコマンドの先頭部分を返す（.py の場合は実行中のPythonで起動する）"""
+    if YT_DLP_PATH.endswith('.py'):
+        return [sys.executable, YT_DLP_PATH]
+    return [YT_DLP_PATH]
+
 def download_yt_dlp(force_update=False):
     """yt-dlpの実行ファイルをダウンロードする"""
     if not force_update and os.path.exists(YT_DLP_PATH): 
@@ -41,30 +106,79 @@ def download_yt_dlp(force_update=False):
         if not asset_url: 
             return False
         
-        # yt-dlp.exeをダウンロード
+        # yt-dlp.exeをダウンロード（途中のファイルを実行しないよう、書き終えてから置き換える）
+        temp_path = YT_DLP_PATH + '.part'
         with requests.get(asset_url, stream=True) as r:
             r.raise_for_status()
-            with open(YT_DLP_PATH, 'wb') as f:
+            with open(temp_path, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192): 
                     f.write(chunk)
+        os.replace(temp_path, YT_DLP_PATH)
         return True
     except Exception as e: 
         print(f"Error downloading yt-dlp: {e}")
         return False
 
-def get_yt_dlp_version():
-    """yt-dlpのバージョンを取得する"""
-    if not os.path.exists(YT_DLP_PATH): 
-        return "Not Found"
+def get_yt_dlp_version(cached_only=False):
+    """yt-dlpのバージョンを取得する（実行ファイルが変わっていなければキャッシュを返す）
+
+    cached_only が真の場合、キャッシュが無ければサブプロセスを起動せずに None を返す
+    """
     try:
-        result = subprocess.run([YT_DLP_PATH, '--version'], capture_output=True, text=True, 
-                              check=True, timeout=10, creationflags=subprocess.CREATE_NO_WINDOW)
-        return result.stdout.strip()
-    except Exception: 
-        return "Error"
+        stat = os.stat(YT_DLP_PATH)
+    except OSError:
+        return "Not Found"
+    key = (stat.st_mtime_ns, stat.st_size)
+    if _version_cache['key'] == key:
+        return _version_cache['version']
+    if cached_only:
+        return None
+    with _version_lock:
+        if _version_cache['key'] != key:
+            try:
+                result = subprocess.run([*yt_dlp_command(), '--version'], capture_output=True, text=True, 
+                                      check=True, timeout=10, creationflags=subprocess.CREATE_NO_WINDOW)
+            except Exception: 
+                return "Error"
+            _version_cache.update(key=key, version=result.stdout.strip())
+        return _version_cache['version']
 
 def get_available_formats(url, cookie_browser=None):
-    """指定されたURLから利用可能なフォーマット一覧を取得する"""
+    """指定されたURLから利用可能なフォーマット一覧を取得する（結果はキャッシュされる）"""
+    key = format_cache.make_key(url, cookie_browser)
+    def load():
+        with metrics.timed('format_extraction_seconds'):
+            return extract_formats(url, cookie_browser)
+    return format_cache.get_or_load(key, load, cacheable=lambda result: result.get('success'))
+
+def extract_playlist_entries(url, cookie_browser=None):
+    """フラット抽出でプレイリストを開き、エントリを発見順に返すイテレーターを返す（プレイリストでなければ None）"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True
+    }
+    if cookie_browser and cookie_browser != 'none':
+        ydl_opts['cookiesfrombrowser'] = (cookie_browser,)
+    
+    # yt_dlp の読み込みは重いため、初めて使うときまで遅らせる
+    import yt_dlp
+    ydl = yt_dlp.YoutubeDL(ydl_opts)
+    # process=False ならエントリはページ単位で取得されるジェネレーターのまま返ってくる
+    info = ydl.extract_info(url, download=False, process=False)
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return None
+    
+    def entries():
+        for entry in info.get('entries') or []:
+            entry_url = entry.get('webpage_url') or entry.get('url')
+            if entry_url:
+                yield {'url': entry_url, 'title': entry.get('title'), 'ie_key': entry.get('ie_key'), 'id': entry.get('id')}
+    return entries()
+
+def extract_formats(url, cookie_browser=None):
+    """yt-dlpで情報を抽出し、フォーマット一覧を作成する"""
     ydl_opts = {
         'quiet': True, 
         'skip_download': True, 
@@ -77,6 +191,7 @@ def get_available_formats(url, cookie_browser=None):
         ydl_opts['cookiesfrombrowser'] = (cookie_browser,)
     
     try:
+        import yt_dlp
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
             info = ydl.extract_info(url, download=False)
             formats = []
@@ -142,29 +257,158 @@ def get_available_formats(url, cookie_browser=None):
 
 def parse_progress(line):
     """yt-dlpの進捗出力から進捗情報をパースする"""
-    match = re.search(r'\[download\]\s+([\d\.]+)% of\s+~?(.+?)\s+at\s+(.+?)\s+ETA\s+(.+)', line)
+    if line.startswith(PROGRESS_PREFIX):
+        values = line[len(PROGRESS_PREFIX):].rstrip().split('|')
+        if len(values) == len(PROGRESS_FIELDS):
+            fields = {name: _parse_number(value) for name, value in zip(PROGRESS_FIELDS, values)}
+            estimate = fields.pop('total_bytes_estimate')
+            fields['total_bytes'] = fields['total_bytes'] or estimate
+            return make_progress(fields)
+        return None
+
+    if '[download]' not in line:
+        return None
+    match = LEGACY_PROGRESS_RE.search(line)
     if match:
         return {'progress': float(match.group(1)), 'details': f"of {match.group(2)} at {match.group(3)} ETA {match.group(4)}"}
     return None
 
-def build_download_command(item):
-    """ダウンロードアイテムからyt-dlpコマンドを構築する"""
+def read_process_output(process, on_line):
+    """stdout/stderrを並行して読み取り各行を on_line に渡す。stderrは末尾の数行だけを返す"""
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+
+    def drain_stderr():
+        for line in iter(process.stderr.readline, ''):
+            if line.strip():
+                stderr_tail.append(line.strip())
+            on_line(line)
+
+    # stderrを読まずに放置するとパイプが詰まって子プロセスが止まるため、別スレッドで常に読み出す
+    stderr_reader = threading.Thread(target=drain_stderr, daemon=True)
+    stderr_reader.start()
+    for line in iter(process.stdout.readline, ''):
+        on_line(line)
+    stderr_reader.join()
+    return list(stderr_tail)
+
+def _parse_number(value):
+    """進捗テンプレートの値を数値に変換する（未定義の 'NA' は None）"""
+    if value == 'NA':
+        # 例外を使うと1行あたりの処理が数倍遅くなるため、よく出る未定義値は先に判定する
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() else number
+
+def classify_error(stderr_tail):
+    """stderrの末尾から失敗を 'throttled' / 'transient' / 'permanent' に分類する"""
+    text = '\n'.join(stderr_tail)
+    if THROTTLED_ERROR_RE.search(text):
+        return 'throttled'
+    if PERMANENT_ERROR_RE.search(text):
+        return 'permanent'
+    if TRANSIENT_ERROR_RE.search(text):
+        return 'transient'
+    return 'permanent'
+
+def make_progress(fields):
+    """数値の進捗情報（バイト数・速度・ETA）に表示用の進捗率と詳細文字列を加える"""
+    downloaded, total = fields.get('downloaded_bytes'), fields.get('total_bytes')
+    percent = downloaded / total * 100 if downloaded is not None and total else 0
+    details = f"of {format_bytes(total)} at {format_bytes(fields.get('speed'))}/s ETA {format_eta(fields.get('eta'))}"
+    return dict(fields, progress=round(percent, 1), details=details)
+
+def format_bytes(value):
+    """バイト数をyt-dlpと同じ形式（例: 12.34MiB）の文字列にする"""
+    if value is None:
+        return 'Unknown'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024:
+            return f"{value:.2f}{unit}"
+        value /= 1024
+    return f"{value:.2f}TiB"
+
+def format_eta(seconds):
+    """残り秒数を mm:ss / hh:mm:ss 形式の文字列にする"""
+    if seconds is None:
+        return 'Unknown'
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+def build_download_command(item, info_json=None, pp_plan=None):
+    """ダウンロードアイテムからyt-dlpコマンドを構築する（info_json があれば抽出を省略）
+    
+    pp_plan が指定された場合は後処理を行わずにダウンロードだけを行い、保存したファイルのパスを書き出させる
+    """
     options = item.get('options', {})
     save_path = options.get('savePath', DOWNLOADS_DIR)
-    output_template = os.path.join(save_path, '%(title)s.%(ext)s')
+    file_name = '%(title)s.f%(format_id)s.%(ext)s' if pp_plan and pp_plan['kind'] == 'merge' else '%(title)s.%(ext)s'
+    output_template = os.path.join(save_path, file_name)
     
-    command = [YT_DLP_PATH, item['url'], '--progress', '-o', output_template, '--windows-filenames']
+    source_args = ['--load-info-json', info_json] if info_json else [item['url']]
+    command = [*yt_dlp_command(), *source_args, '--progress', '--newline', '--progress-template', PROGRESS_TEMPLATE,
+               '-o', output_template, '--windows-filenames']
     custom_args_str = options.get('customArgs', '')
     
+    # 重複判定のキーを抽出器名と動画IDで置き換えるため、ダウンロードした動画を書き出させる
+    command.extend(['--print-to-file', f'after_move:{ARCHIVE_KEY_TEMPLATE}', archive.key_file(item['id'])])
+    # 先読みせずに開始したアイテムは抽出前に重複と分からないため、ダウンロード済みの動画は yt-dlp にも飛ばさせる
+    command.extend(['--download-archive', archive.ARCHIVE_FILE])
     selected_format = options.get('selectedFormat')
-    if selected_format and selected_format != 'custom':
-        command.extend(['-f', selected_format])
-    elif options.get('audioOnly'):
-        command.extend(['-x', '--audio-format', options.get('audioFormat', 'best'), '-f', 'bestaudio/best'])
+    if pp_plan:
+        command.extend(['-f', pp_plan['format'], '--print-to-file', 'after_move:filepath', pp_plan['files_path']])
+    else:
+        # 保存したファイルのパスを書き出させ、完了時に走査せずにライブラリの索引へ加える
+        command.extend(['--print-to-file', 'after_move:filepath', library.path_file(item['id'])])
+        if selected_format and selected_format != 'custom':
+            command.extend(['-f', selected_format])
+        elif options.get('audioOnly'):
+            command.extend(['-x', '--audio-format', options.get('audioFormat', 'best'), '-f', 'bestaudio/best'])
     
     custom_args_list = shlex.split(custom_args_str)
-    has_custom_cookie_arg = any(arg.lstrip('-') in ('cookies', 'cookies-from-browser') for arg in custom_args_list)
-    if not has_custom_cookie_arg and options.get('cookieBrowser') != 'none':
-        command.extend(['--cookies-from-browser', options.get('cookieBrowser')])
+    command.extend(_cookie_args(options, custom_args_list))
     command.extend(custom_args_list)
     return command
+
+def build_info_command(url, options):
+    """先読み用に情報JSONだけを出力するyt-dlpコマンドを構築する
+
+    カスタム引数のうち抽出に影響するものは実際のダウンロードと同じく渡す。
+    影響が分からない引数がある場合は、ダウンロードと異なる情報を読み込ませないよう None を返す
+    """
+    custom_args_list = shlex.split(options.get('customArgs', ''))
+    extraction_args = _extraction_args(custom_args_list)
+    if extraction_args is None:
+        return None
+    command = [*yt_dlp_command(), url, '--dump-single-json', '--skip-download', '--no-warnings']
+    command.extend(_cookie_args(options, custom_args_list))
+    command.extend(extraction_args)
+    return command
+
+def _extraction_args(custom_args_list):
+    """カスタム引数から抽出に影響するものを取り出す（分からない引数があれば None）"""
+    extraction_args = []
+    index = 0
+    while index < len(custom_args_list):
+        name, has_value, _ = custom_args_list[index].partition('=')
+        for known_args, forward in ((EXTRACTION_ARGS, True), (DOWNLOAD_ONLY_ARGS, False)):
+            if name in known_args:
+                # 「--opt=値」の形なら値は同じ引数に含まれている
+                count = 1 + (0 if has_value else known_args[name])
+                if forward:
+                    extraction_args.extend(custom_args_list[index:index + count])
+                index += count
+                break
+        else:
+            return None
+    return extraction_args
+
+def _cookie_args(options, custom_args_list):
+    """カスタム引数でCookie指定が無い場合に、ブラウザCookieの引数を返す"""
+    has_custom_cookie_arg = any(arg.lstrip('-') in ('cookies', 'cookies-from-browser') for arg in custom_args_list)
+    if not has_custom_cookie_arg and options.get('cookieBrowser') != 'none':
+        return ['--cookies-from-browser', options.get('cookieBrowser')]
+    return []
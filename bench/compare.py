@@ -0,0 +1,43 @@
+"""2つのベンチマーク結果（JSON）を比較して、数値の変化を表示する
+
+    python bench/compare.py results/before.json results/after.json [--threshold 5]
+"""
+import json
+import argparse
+
+def flatten(value, prefix=''):
+    """入れ子の結果を 'シナリオ.項目.統計値' -> 数値 の辞書にする"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, child in value.items():
+            flat.update(flatten(child, f'{prefix}.{key}' if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=5, help='この割合（%%）以上変化した項目に印を付ける')
+    args = parser.parse_args()
+
+    with open(args.before, 'r', encoding='utf-8') as f:
+        before = flatten(json.load(f).get('results', {}))
+    with open(args.after, 'r', encoding='utf-8') as f:
+        after = flatten(json.load(f).get('results', {}))
+
+    width = max((len(key) for key in before.keys() | after.keys()), default=10)
+    print(f"{'metric':<{width}}  {'before':>14}  {'after':>14}  {'change':>8}")
+    for key in sorted(before.keys() | after.keys()):
+        old, new = before.get(key), after.get(key)
+        if old is None or new is None:
+            print(f"{key:<{width}}  {str(old):>14}  {str(new):>14}  {'':>8}")
+            continue
+        change = (new - old) / old * 100 if old else 0
+        mark = ' *' if abs(change) >= args.threshold else ''
+        print(f"{key:<{width}}  {old:>14}  {new:>14}  {change:>+7.1f}%{mark}")
+
+if __name__ == '__main__':
+    main()
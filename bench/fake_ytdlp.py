@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""ベンチマーク用の偽のyt-dlp
+
+--progress-template 形式の進捗行と、指定した量の標準エラー出力を一定の速度で出力する。
+URLがローカルのメディアサーバー（bench/media_server.py）を指している場合は実際に取得してファイルに保存し、
+それ以外のURLではネットワークにアクセスせず、指定サイズ・速度のダウンロードを模擬する。
+YT_DLP_PATH にこのファイルのパスを指定するとアプリから使われる。
+
+環境変数:
+    FAKE_YTDLP_SIZE           模擬ダウンロードのバイト数（既定 20MB）
+    FAKE_YTDLP_SPEED          模擬ダウンロードの速度（バイト/秒、既定 10MB/s）
+    FAKE_YTDLP_INTERVAL       進捗行の出力間隔（秒、既定 0.1）
+    FAKE_YTDLP_STDERR_RATE    標準エラーに出す警告行の数（行/秒、既定 0）
+    FAKE_YTDLP_STDERR_BYTES   警告行1行のバイト数（既定 120）
+    FAKE_YTDLP_FAIL_RATE      失敗させる確率（0〜1、既定 0）
+    FAKE_YTDLP_ERROR          失敗時のエラーメッセージ（既定 HTTP Error 503）
+    FAKE_YTDLP_WRITE          0 にすると取得したデータをファイルに保存しない（既定 1）
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import urllib.request
+from urllib.parse import urlsplit, urljoin
+
+VERSION = '2099.01.01-fake'
+PROGRESS_PREFIX = '[progress]'
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+CHUNK_SIZE = 64 * 1024
+
+def env_number(name, default):
+    return float(os.environ.get(name, default))
+
+class Output:
+    """進捗行と警告行の出力を指定の速度に揃える"""
+
+    def __init__(self):
+        self.interval = env_number('FAKE_YTDLP_INTERVAL', 0.1)
+        self.stderr_rate = env_number('FAKE_YTDLP_STDERR_RATE', 0)
+        self.stderr_line = 'WARNING: [fake] ' + 'x' * max(int(env_number('FAKE_YTDLP_STDERR_BYTES', 120)) - 16, 0)
+        self.started_at = time.monotonic()
+        self.last_progress = 0
+        self.stderr_lines = 0
+
+    def progress(self, downloaded, total=None, estimate=None, fragment_index=None, fragment_count=None, force=False):
+        now = time.monotonic()
+        self._stderr(now)
+        if not force and now - self.last_progress < self.interval:
+            return
+        self.last_progress = now
+        elapsed = max(now - self.started_at, 1e-6)
+        speed = downloaded / elapsed
+        size = total or estimate
+        eta = int((size - downloaded) / speed) if size and speed else None
+        values = (downloaded, total, estimate, speed, eta, fragment_index, fragment_count)
+        print(PROGRESS_PREFIX + '|'.join('NA' if value is None else str(value) for value in values), flush=True)
+
+    def _stderr(self, now):
+        if not self.stderr_rate:
+            return
+        due = int((now - self.started_at) * self.stderr_rate)
+        while self.stderr_lines < due:
+            print(self.stderr_line, file=sys.stderr, flush=True)
+            self.stderr_lines += 1
+
+def parse_args(args):
+    """アプリが渡す引数のうち、偽のyt-dlpが使うものだけを取り出す"""
+    parsed = {'url': None, 'output': None, 'print_to_file': [], 'info_json': None}
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg in ('-o', '--output'):
+            parsed['output'] = args[index + 1]
+            index += 1
+        elif arg == '--print-to-file':
+            parsed['print_to_file'].append((args[index + 1].partition(':')[2], args[index + 2]))
+            index += 2
+        elif arg == '--load-info-json':
+            parsed['info_json'] = args[index + 1]
+            index += 1
+        elif arg in ('-f', '--progress-template', '--cookies-from-browser', '--audio-format'):
+            index += 1
+        elif not arg.startswith('-') and parsed['url'] is None:
+            parsed['url'] = arg
+        index += 1
+    if parsed['info_json']:
+        with open(parsed['info_json'], 'r', encoding='utf-8') as f:
+            parsed['url'] = json.load(f).get('webpage_url')
+    return parsed
+
+def output_path(template, url, ext):
+    """出力テンプレートのタイトル・拡張子などを埋めてファイルパスを作る"""
+    title = 'fake-' + hashlib.sha1((url or '').encode()).hexdigest()[:12]
+    values = {'title': title, 'ext': ext, 'format_id': '0', 'id': title}
+    path = template or '%(title)s.%(ext)s'
+    for key, value in values.items():
+        path = path.replace(f'%({key})s', value)
+    return path
+
+def simulate(out):
+    """ネットワークにアクセスせずにダウンロードを模擬する"""
+    size = int(env_number('FAKE_YTDLP_SIZE', 20 * 1024 * 1024))
+    speed = env_number('FAKE_YTDLP_SPEED', 10 * 1024 * 1024)
+    downloaded = 0
+    while downloaded < size:
+        time.sleep(min(out.interval, 0.05))
+        downloaded = min(size, int((time.monotonic() - out.started_at) * speed))
+        out.progress(downloaded, size)
+    out.progress(size, size, force=True)
+
+def fetch_progressive(url, out, f):
+    with urllib.request.urlopen(url) as response:
+        total = int(response.headers.get('Content-Length') or 0) or None
+        downloaded = 0
+        while True:
+            chunk = response.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            downloaded += len(chunk)
+            f.write(chunk)
+            out.progress(downloaded, total)
+    out.progress(downloaded, total, force=True)
+
+def fetch_hls(url, out, f):
+    with urllib.request.urlopen(url) as response:
+        playlist = response.read().decode()
+    segments = [urljoin(url, line) for line in playlist.splitlines() if line and not line.startswith('#')]
+    downloaded = 0
+    for index, segment_url in enumerate(segments, 1):
+        with urllib.request.urlopen(segment_url) as response:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                downloaded += len(chunk)
+                f.write(chunk)
+                out.progress(downloaded, estimate=downloaded * len(segments) // index,
+                             fragment_index=index, fragment_count=len(segments))
+    out.progress(downloaded, downloaded, fragment_index=len(segments), fragment_count=len(segments), force=True)
+
+def main(args):
+    if '--version' in args:
+        print(VERSION)
+        return 0
+    parsed = parse_args(args)
+    url = parsed['url'] or ''
+    if '--dump-single-json' in args:
+        # yt_dlp モジュールの --load-info-json でもそのまま取得できる最小限の情報
+        hls = urlsplit(url).path.endswith('.m3u8')
+        print(json.dumps({'id': 'fake', 'title': 'fake', 'webpage_url': url, 'extractor': 'generic',
+                          'extractor_key': 'Generic', 'url': url, 'ext': 'mp4',
+                          'protocol': 'm3u8_native' if hls else 'http'}))
+        return 0
+
+    out = Output()
+    if random.random() < env_number('FAKE_YTDLP_FAIL_RATE', 0):
+        time.sleep(out.interval)
+        print(f"ERROR: {os.environ.get('FAKE_YTDLP_ERROR', 'HTTP Error 503: Service Unavailable')}", file=sys.stderr)
+        return 1
+
+    parts = urlsplit(url)
+    if parts.hostname not in LOCAL_HOSTS:
+        simulate(out)
+        return 0
+
+    hls = parts.path.endswith('.m3u8')
+    path = output_path(parsed['output'], url, 'ts' if hls else 'mp4')
+    write = os.environ.get('FAKE_YTDLP_WRITE', '1') != '0'
+    try:
+        if write:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'wb') if write else open(os.devnull, 'wb') as f:
+            (fetch_hls if hls else fetch_progressive)(url, out, f)
+    except OSError as e:
+        print(f"ERROR: Unable to download video data: {e}", file=sys.stderr)
+        return 1
+    for template, print_path in parsed['print_to_file']:
+        line = os.path.abspath(path) if template == 'filepath' else \
+            template.replace('%(extractor_key)s', 'Generic').replace('%(id)s', os.path.basename(path).split('.')[0])
+        with open(print_path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,250 @@
+"""ベンチマーク共通の部品
+
+アプリを一時ディレクトリにコピーして偽のyt-dlpで起動するサーバー、プロセスのサンプリング、
+計測用のSocket.IOクライアント、統計値の集計と結果の保存を提供する。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+import requests
+import psutil
+import socketio
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(BASE_DIR, 'bench')
+FAKE_YTDLP_PATH = os.path.join(BENCH_DIR, 'fake_ytdlp.py')
+# 一時ディレクトリにコピーするアプリのファイル
+COPY_ITEMS = ('app', 'templates', 'static', 'run.py')
+
+def free_port():
+    """空いているTCPポートを返す"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_first_response(url, started_at, timeout):
+    """最初の 200 応答が返るまでポーリングし、起動からの経過秒数を返す"""
+    while time.perf_counter() - started_at < timeout:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started_at
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError(f"No response from {url} within {timeout}s")
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+def summarize(samples):
+    """秒単位の計測値をミリ秒の統計値にまとめる"""
+    if not samples:
+        return None
+    ms = sorted(sample * 1000 for sample in samples)
+    return {
+        'count': len(ms),
+        'min_ms': round(ms[0], 2),
+        'median_ms': round(percentile(ms, 0.5), 2),
+        'p95_ms': round(percentile(ms, 0.95), 2),
+        'p99_ms': round(percentile(ms, 0.99), 2),
+        'max_ms': round(ms[-1], 2),
+    }
+
+class Server:
+    """アプリのコピーを偽のyt-dlpで起動する。with 文で使う"""
+
+    def __init__(self, general=None, fake_env=None, timeout=60):
+        self.general = dict({'concurrentDownloads': 4, 'separatePostprocessing': False,
+                             'showWelcomeNotice': False}, **(general or {}))
+        self.fake_env = {key: str(value) for key, value in (fake_env or {}).items()}
+        self.timeout = timeout
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.app_dir = None
+        self.process = None
+        self.startup_seconds = None
+
+    def __enter__(self):
+        self.app_dir = tempfile.mkdtemp(prefix='gui-ytdlp-bench-')
+        for name in COPY_ITEMS:
+            source = os.path.join(BASE_DIR, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(self.app_dir, name), ignore=shutil.ignore_patterns('__pycache__'))
+            else:
+                shutil.copy(source, self.app_dir)
+        settings = {'general': self.general, 'last_options': {'savePath': self.downloads_dir}}
+        with open(os.path.join(self.app_dir, 'settings.json'), 'w', encoding='utf-8') as f:
+            json.dump(settings, f)
+
+        env = dict(os.environ, FLASK_DEBUG='False', FLASK_HOST='127.0.0.1', FLASK_PORT=str(self.port),
+                   YT_DLP_PATH=FAKE_YTDLP_PATH, **self.fake_env)
+        started_at = time.perf_counter()
+        self.process = subprocess.Popen([sys.executable, os.path.join(self.app_dir, 'run.py')], cwd=self.app_dir,
+                                        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.startup_seconds = wait_for_first_response(self.url + '/', started_at, self.timeout)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+        if self.app_dir:
+            shutil.rmtree(self.app_dir, ignore_errors=True)
+
+    @property
+    def downloads_dir(self):
+        return os.path.join(self.app_dir, 'downloads')
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+class Sampler:
+    """プロセスのスレッド数・メモリ使用量・CPU時間を定期的に記録する。with 文で使う"""
+
+    def __init__(self, pid, interval=0.5):
+        self._process = psutil.Process(pid)
+        self._interval = interval
+        self._stop = threading.Event()
+        self.threads, self.rss = [], []
+        self.cpu_seconds = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._cpu_start = sum(self._process.cpu_times()[:2])
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        try:
+            self.cpu_seconds = sum(self._process.cpu_times()[:2]) - self._cpu_start
+        except psutil.Error:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            try:
+                with self._process.oneshot():
+                    self.threads.append(self._process.num_threads())
+                    self.rss.append(self._process.memory_info().rss)
+            except psutil.Error:
+                return
+
+    def result(self):
+        return {
+            'threads_peak': max(self.threads, default=None),
+            'rss_peak_mb': round(max(self.rss, default=0) / 1024 / 1024, 1),
+            'rss_mean_mb': round(sum(self.rss) / len(self.rss) / 1024 / 1024, 1) if self.rss else None,
+            'cpu_seconds': round(self.cpu_seconds, 2) if self.cpu_seconds is not None else None,
+        }
+
+class BenchClient:
+    """キューの変更を受け取り、追加したURLが届くまでの時間・完了数・受信イベント数を記録するクライアント
+
+    サーバーからは見ているページ（先頭から page_size 件）の変更だけが届くため、追加の遅延はその範囲で測り、
+    完了数はパッチに含まれる状態ごとの件数から求める。
+    handler_delay を指定すると、イベントごとにその秒数だけ処理を止める遅いクライアントになる
+    """
+
+    def __init__(self, sent_at=None, handler_delay=0, page_size=1000):
+        self.sent_at = sent_at if sent_at is not None else {}
+        self.handler_delay = handler_delay
+        self.page_size = page_size
+        self.latencies = []
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self.events = 0
+        self.all_done = threading.Event()
+        self.expected = None
+        self._seen = set()
+        self._snapshot = threading.Event()
+        self.client = socketio.Client()
+        self.client.on('queue_snapshot', self._handle_snapshot)
+        self.client.on('queue_patch', self._handle_patch)
+        self.client.on('progress_batch', self._handle_progress)
+
+    def connect(self, url):
+        started_at = time.perf_counter()
+        self.client.connect(url, transports=['websocket'], auth={'queueView': {'limit': self.page_size}})
+        self._snapshot.wait(30)
+        return time.perf_counter() - started_at
+
+    def disconnect(self):
+        self.client.disconnect()
+
+    def _handle_progress(self, data):
+        self.events += 1
+        if self.handler_delay:
+            time.sleep(self.handler_delay)
+
+    def _handle_snapshot(self, data):
+        self._update_counts(data)
+        self._snapshot.set()
+
+    def _handle_patch(self, data):
+        now = time.perf_counter()
+        self.events += 1
+        for change in data['changes']:
+            item = change.get('item')
+            if item and change['op'] == 'added':
+                # URLごとに送信時刻を記録しているので、1回目に届いた時点までの時間を測る
+                sent_at = self.sent_at.get(item['url'])
+                if sent_at is not None and item['url'] not in self._seen:
+                    self._seen.add(item['url'])
+                    self.latencies.append(now - sent_at)
+        self._update_counts(data)
+        if self.handler_delay:
+            time.sleep(self.handler_delay)
+
+    def _update_counts(self, data):
+        self.total = data['total']
+        self.completed = data['counts']['completed']
+        self.failed = data['counts']['failed']
+        if self.expected is not None and self.completed + self.failed >= self.expected:
+            self.all_done.set()
+
+    def add(self, urls, options=None):
+        """URLを追加し、送信時刻を記録する"""
+        now = time.perf_counter()
+        for url in urls:
+            self.sent_at[url] = now
+        self.client.emit('add_to_queue', {'urls': urls, 'options': dict({'cookieBrowser': 'none'}, **(options or {}))})
+
+def environment():
+    """結果の比較に必要な実行環境の情報を返す"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                                text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def write_result(result, output=None):
+    """結果をJSONで書き出す（output が無ければ標準出力）"""
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    if output:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
@@ -0,0 +1,53 @@
+"""ダウンロードエンジン（スレッド・asyncio・プロセス内）を比較する負荷試験
+
+ローカルのメディアサーバー（media_server.py）から指定速度で配信する動画を多数ダウンロードしながら
+多数のクライアントを接続し、サーバープロセスのスレッド数・メモリと、キュー変更がクライアントに届くまでの時間を
+エンジンごとに計測する。subprocess / asyncio は偽のyt-dlp（fake_ytdlp.py）、inprocess は yt_dlp モジュールで
+同じURLを取得するため、エンジンの違いだけを比較できる。
+サーバーはどのエンジンでも Flask-SocketIO のスレッドモードで動くため、ASGIサーバーとの比較ではない。
+
+    python bench/load_test.py [--clients 200] [--downloads 300] [--concurrency 50] [--output result.json]
+"""
+import argparse
+import harness
+import media_server
+from suite import run_downloads, connect_clients, disconnect_clients
+
+ENGINES = ('subprocess', 'asyncio', 'inprocess')
+
+def run_engine(engine, base_url, args):
+    """1つのエンジンで負荷試験を行い、計測結果を返す"""
+    with harness.Server({'concurrentDownloads': args.concurrency, 'downloadEngine': engine}) as server:
+        idle_threads = harness.psutil.Process(server.pid).num_threads()
+        clients, _ = connect_clients(server, args.clients - 1)
+        try:
+            urls = [f'{base_url}/progressive/{args.size}.mp4?rate={args.speed}&n={index}'
+                    for index in range(args.downloads)]
+            result = run_downloads(server, urls, clients=clients, batch_size=20, timeout=args.timeout)
+        finally:
+            disconnect_clients(clients)
+    result.update(engine=engine, threads_idle=idle_threads,
+                  fanout_latency=harness.summarize([latency for client in clients for latency in client.latencies]))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200, help='同時に接続するクライアント数')
+    parser.add_argument('--downloads', type=int, default=300, help='ダウンロードの件数')
+    parser.add_argument('--concurrency', type=int, default=50, help='同時ダウンロード数')
+    parser.add_argument('--size', type=int, default=5 * 1024 * 1024, help='1件あたりのバイト数')
+    parser.add_argument('--speed', type=int, default=2 * 1024 * 1024, help='1件あたりの速度（バイト/秒）')
+    parser.add_argument('--timeout', type=float, default=600, help='全件完了を待つ最大秒数')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--output', help='結果を書き出すJSONファイル（省略時は標準出力）')
+    args = parser.parse_args()
+
+    media, base_url = media_server.start()
+    try:
+        results = [run_engine(engine, base_url, args) for engine in args.engines]
+    finally:
+        media.shutdown()
+    harness.write_result({'environment': harness.environment(), 'args': vars(args), 'results': results}, args.output)
+
+if __name__ == '__main__':
+    main()
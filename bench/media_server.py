@@ -0,0 +1,108 @@
+"""ベンチマーク用のローカルのメディアサーバー
+
+実際のファイルを置かずに、指定サイズのプログレッシブ形式の動画とHLSのプレイリスト・セグメントを配信する。
+
+    /progressive/<バイト数>.mp4[?rate=<バイト/秒>]
+    /hls/<セグメント数>x<セグメントのバイト数>/index.m3u8[?rate=<バイト/秒>]
+
+    python bench/media_server.py [--port 8000]
+"""
+import os
+import re
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+CHUNK_SIZE = 64 * 1024
+# 毎回乱数を作らないよう、同じブロックを繰り返して送る
+_BLOCK = os.urandom(CHUNK_SIZE)
+SEGMENT_DURATION = 4
+
+PROGRESSIVE_RE = re.compile(r'^/progressive/(\d+)\.mp4$')
+HLS_PLAYLIST_RE = re.compile(r'^/hls/(\d+)x(\d+)/index\.m3u8$')
+HLS_SEGMENT_RE = re.compile(r'^/hls/(\d+)x(\d+)/seg(\d+)\.ts$')
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        rate = float(parse_qs(parts.query).get('rate', ['0'])[0])
+        match = PROGRESSIVE_RE.match(parts.path)
+        if match:
+            return self._send_body(int(match.group(1)), 'video/mp4', rate)
+        match = HLS_PLAYLIST_RE.match(parts.path)
+        if match:
+            return self._send_playlist(int(match.group(1)), parts.query)
+        match = HLS_SEGMENT_RE.match(parts.path)
+        if match and int(match.group(3)) < int(match.group(1)):
+            return self._send_body(int(match.group(2)), 'video/mp2t', rate)
+        self.send_error(404)
+
+    def _send_playlist(self, segments, query):
+        suffix = f'?{query}' if query else ''
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{SEGMENT_DURATION}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(segments):
+            lines.extend([f'#EXTINF:{SEGMENT_DURATION}.0,', f'seg{index}.ts{suffix}'])
+        lines.append('#EXT-X-ENDLIST')
+        body = ('\n'.join(lines) + '\n').encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/vnd.apple.mpegurl')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_body(self, size, content_type, rate):
+        start, end = 0, size - 1
+        range_match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if range_match:
+            start = int(range_match.group(1))
+            end = min(int(range_match.group(2) or end), end)
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+        started_at = time.monotonic()
+        sent = 0
+        remaining = end - start + 1
+        try:
+            while remaining > 0:
+                chunk = _BLOCK[:min(CHUNK_SIZE, remaining)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                remaining -= len(chunk)
+                if rate:
+                    # 指定速度を超えないように待つ
+                    delay = sent / rate - (time.monotonic() - started_at)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+def start(port=0):
+    """別スレッドでサーバーを起動し、(サーバー, ベースURL) を返す"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MediaHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), MediaHandler)
+    print(f"Serving synthetic media on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
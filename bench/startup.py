@@ -0,0 +1,36 @@
+"""起動時間のベンチマーク
+
+サーバーを起動してから最初のHTTP応答が返るまでの時間と、
+WebSocket接続からキューのスナップショットを受け取るまでの時間を計測し、JSONで出力する。
+
+    python bench/startup.py [--runs 3] [--connects 20] [--output result.json]
+"""
+import argparse
+import harness
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='サーバーを起動し直して計測する回数')
+    parser.add_argument('--connects', type=int, default=20, help='1回の起動あたりの接続レイテンシの計測回数')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル（省略時は標準出力）')
+    args = parser.parse_args()
+
+    first_responses, first_connects, connects = [], [], []
+    for _ in range(args.runs):
+        with harness.Server() as server:
+            first_responses.append(server.startup_seconds)
+            for index in range(args.connects):
+                client = harness.BenchClient()
+                elapsed = client.connect(server.url)
+                client.disconnect()
+                (first_connects if index == 0 else connects).append(elapsed)
+
+    harness.write_result({
+        'environment': harness.environment(),
+        'time_to_first_response': harness.summarize(first_responses),
+        'first_connect': harness.summarize(first_connects),
+        'connect': harness.summarize(connects),
+    }, args.output)
+
+if __name__ == '__main__':
+    main()
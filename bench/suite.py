@@ -0,0 +1,425 @@
+"""オフラインのベンチマークスイート
+
+偽のyt-dlp（fake_ytdlp.py）とローカルのメディアサーバー（media_server.py）を使い、
+ネットワークに出ずにダウンロードの流れ全体とソケット層の性能を計測して、結果をJSONで保存する。
+
+    python bench/suite.py [シナリオ名 ...] [--engine subprocess|asyncio|inprocess] [--quick] [--output results/run.json]
+    python bench/compare.py results/before.json results/after.json
+
+シナリオ:
+    parse_progress    進捗行のパース速度（分割方式と変更前の正規表現の比較、プロセス内）
+    progress_emits    進捗を1行ごとに送る方式とまとめて送る方式の送信数・CPU時間の比較（プロセス内）
+    scheduler         大量の待機アイテムからの取り出し速度（プロセス内）
+    scheduling_latency  1万件の待機アイテムがある状態での1回のスロット補充の遅延（旧方式の線形走査と比較、プロセス内）
+    large_queue*      数千件のキューへの追加と、接続時のスナップショット送信
+    high_concurrency  多数の同時ダウンロード（プログレッシブ形式）
+    hls               HLSのセグメント単位のダウンロード
+    many_clients*     多数のクライアントへの変更の配信
+    slow_consumers*   処理の遅いクライアントが混ざった場合の配信
+    stderr_flood*     標準エラー出力が大量に出る場合のダウンロード
+    pipe_reader       数MBの標準エラー出力を出す偽のyt-dlpの出力読み取り（旧方式の詰まりと比較、プロセス内）
+
+inprocess エンジンは偽のyt-dlpではなく yt_dlp モジュールでダウンロードするため、
+偽のyt-dlpの模擬ダウンロードを使うシナリオ（*印）は実行できない。
+"""
+import os
+import sys
+import time
+import argparse
+import harness
+import media_server
+
+sys.path.insert(0, harness.BASE_DIR)
+
+SCENARIOS = {}
+# 偽のyt-dlpの模擬ダウンロード（ネットワークに出ないURL）を使うシナリオ
+SIMULATED_SCENARIOS = set()
+# 偽のyt-dlpを使わず、yt_dlp モジュールでダウンロードするエンジン
+MODULE_ENGINES = {'inprocess'}
+
+def scenario(name, simulated=False):
+    def register(fn):
+        SCENARIOS[name] = fn
+        if simulated:
+            SIMULATED_SCENARIOS.add(name)
+        return fn
+    return register
+
+def run_downloads(server, urls, clients=(), batch_size=100, timeout=600):
+    """URLを追加して全件が完了（またはエラー）するまで待ち、スループットと配信の遅延を返す"""
+    control = harness.BenchClient()
+    control.connect(server.url)
+    control.expected = len(urls)
+    for client in clients:
+        client.sent_at = control.sent_at
+    with harness.Sampler(server.pid) as sampler:
+        started_at = time.perf_counter()
+        for index in range(0, len(urls), batch_size):
+            control.add(urls[index:index + batch_size])
+        finished = control.all_done.wait(timeout)
+        elapsed = time.perf_counter() - started_at
+    control.disconnect()
+    return {
+        'finished': finished,
+        'completed': control.completed,
+        'failed': control.failed,
+        'elapsed_s': round(elapsed, 2),
+        'downloads_per_s': round(control.completed / elapsed, 2),
+        'add_latency': harness.summarize(control.latencies),
+        'events_received': control.events,
+        **sampler.result(),
+    }
+
+def connect_clients(server, count, handler_delay=0):
+    clients = []
+    connect_times = []
+    for _ in range(count):
+        client = harness.BenchClient(handler_delay=handler_delay)
+        connect_times.append(client.connect(server.url))
+        clients.append(client)
+    return clients, connect_times
+
+def disconnect_clients(clients):
+    for client in clients:
+        client.disconnect()
+
+def folder_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+@scenario('parse_progress')
+def bench_parse_progress(args):
+    import re
+    from app import ytdlp_handler
+    template_line = f"{ytdlp_handler.PROGRESS_PREFIX}1048576|20971520|NA|10485760.5|2|NA|NA\n"
+    legacy_line = "[download]  42.0% of ~ 20.00MiB at  10.00MiB/s ETA 00:02\n"
+    noise_line = "[youtube] abc: Downloading webpage\n"
+    count = 20000 if args.quick else 200000
+
+    def baseline_parse(line):
+        # 変更前の実装: すべての行に正規表現を当て、表示用の文字列を作る
+        match = re.search(r'\[download\]\s+([\d\.]+)% of\s+~?(.+?)\s+at\s+(.+?)\s+ETA\s+(.+)', line)
+        if match:
+            return {'progress': float(match.group(1)), 'details': f"of {match.group(2)} at {match.group(3)} ETA {match.group(4)}"}
+        return None
+
+    def measure(parse, lines):
+        started_at = time.perf_counter()
+        for index in range(count):
+            parse(lines[index % len(lines)])
+        elapsed = time.perf_counter() - started_at
+        return {'lines_per_s': round(count / elapsed), 'us_per_line': round(elapsed / count * 1e6, 3)}
+
+    # 実際の出力に近い混在（進捗行が大半で、たまに他の行が混ざる）
+    mixed = [template_line] * 8 + [legacy_line, noise_line]
+    legacy_mixed = [legacy_line] * 8 + [legacy_line, noise_line]
+    return {
+        'lines': count,
+        'split_template': measure(ytdlp_handler.parse_progress, [template_line]),
+        'fallback_legacy': measure(ytdlp_handler.parse_progress, [legacy_line]),
+        'baseline_regex_legacy': measure(baseline_parse, [legacy_line]),
+        'noise': measure(ytdlp_handler.parse_progress, [noise_line]),
+        'baseline_regex_noise': measure(baseline_parse, [noise_line]),
+        'mixed': measure(ytdlp_handler.parse_progress, mixed),
+        'baseline_regex_mixed': measure(baseline_parse, legacy_mixed),
+    }
+
+@scenario('progress_emits')
+def bench_progress_emits(args):
+    import json
+    from app import ytdlp_handler, progress
+    downloads, clients = 20, 10
+    duration = 10 if args.quick else 60
+    # 偽のyt-dlpと同じく各ダウンロードが0.1秒ごとに進捗行を出し、既定の間隔でまとめて送る
+    line_interval, tick = 0.1, progress.DEFAULT_INTERVAL_MS / 1000
+    steps = int(duration / line_interval)
+    lines = [[f"{ytdlp_handler.PROGRESS_PREFIX}{step * 65536}|{steps * 65536}|NA|655360|{steps - step}|NA|NA\n"
+              for step in range(steps)] for _ in range(downloads)]
+
+    def per_line():
+        emits = sent_bytes = 0
+        for step in range(steps):
+            for index in range(downloads):
+                progress_data = ytdlp_handler.parse_progress(lines[index][step])
+                payload = json.dumps({'id': f'item{index}', 'progress': progress_data['progress'],
+                                      'details': progress_data['details']})
+                emits += clients
+                sent_bytes += len(payload) * clients
+        return emits, sent_bytes
+
+    def batched():
+        emits = sent_bytes = 0
+        pending, next_flush = {}, tick
+        for step in range(steps):
+            for index in range(downloads):
+                progress_data = ytdlp_handler.parse_progress(lines[index][step])
+                pending[f'item{index}'] = dict(progress_data, id=f'item{index}')
+            if (step + 1) * line_interval >= next_flush:
+                next_flush += tick
+                payload = json.dumps({'items': list(pending.values())})
+                pending.clear()
+                emits += clients
+                sent_bytes += len(payload) * clients
+        return emits, sent_bytes
+
+    result = {'downloads': downloads, 'clients': clients, 'simulated_seconds': duration, 'interval_ms': tick * 1000}
+    for name, mode in (('per_line', per_line), ('batched', batched)):
+        started_at = time.process_time()
+        emits, sent_bytes = mode()
+        result[name] = {'emits': emits, 'emits_per_s': round(emits / duration, 1), 'bytes': sent_bytes,
+                        'cpu_ms': round((time.process_time() - started_at) * 1000, 1)}
+    return result
+
+@scenario('scheduler')
+def bench_scheduler(args):
+    from app import scheduler
+    count = 10000 if args.quick else 100000
+    hosts = [f'host{index}.example' for index in range(50)]
+    started_at = time.perf_counter()
+    for index in range(count):
+        scheduler.enqueue(f'item{index}', index % 5, hosts[index % len(hosts)])
+    enqueued_at = time.perf_counter()
+    taken = 0
+    while True:
+        item_ids = scheduler.take(10)
+        if not item_ids:
+            break
+        taken += len(item_ids)
+        for item_id in item_ids:
+            scheduler.finish(item_id)
+    finished_at = time.perf_counter()
+    return {
+        'items': count,
+        'taken': taken,
+        'enqueue_per_s': round(count / (enqueued_at - started_at)),
+        'take_per_s': round(taken / (finished_at - enqueued_at)),
+    }
+
+@scenario('scheduling_latency')
+def bench_scheduling_latency(args):
+    from app import scheduler, prefetch
+    count, concurrency = 10000, 10
+    passes = 1000 if args.quick else 5000
+
+    def measure(host_count):
+        hosts = [f'host{index}.example' for index in range(host_count)]
+        for index in range(count):
+            scheduler.enqueue(f'latency{index}', index % 5, hosts[index % len(hosts)])
+        running = scheduler.take(concurrency)
+        # 1件終わるごとに空いた1枠を埋める（start_next_download が queue_lock 内で行う処理と同じ）
+        latencies = []
+        for _ in range(passes):
+            scheduler.finish(running.pop(0))
+            started_at = time.perf_counter()
+            running.extend(scheduler.take(concurrency - len(running)))
+            scheduler.peek(prefetch.LOOKAHEAD)
+            scheduler.next_wakeup()
+            latencies.append(time.perf_counter() - started_at)
+        for index in range(count):
+            scheduler.discard(f'latency{index}')
+        return harness.summarize(latencies)
+
+    # ホスト数が多くても（プレイリストではなく個別のURLを大量に追加した場合など）遅延が増えないこと
+    results = {f'scheduler_{host_count}_hosts': measure(host_count) for host_count in (50, 5000)}
+    queue = {f'latency{index}': {'id': f'latency{index}', 'status': 'waiting'} for index in range(count)}
+
+    # 旧方式: 実行中の数を数え、先頭から最初の待機アイテムを探す
+    running = list(queue)[:concurrency]
+    for item_id in running:
+        queue[item_id]['status'] = 'downloading'
+    legacy_latencies = []
+    for _ in range(passes):
+        queue[running.pop(0)]['status'] = 'completed'
+        started_at = time.perf_counter()
+        downloading = sum(1 for item in queue.values() if item['status'] == 'downloading')
+        if downloading < concurrency:
+            item = next((item for item in queue.values() if item['status'] == 'waiting'), None)
+            if item:
+                item['status'] = 'downloading'
+                running.append(item['id'])
+        legacy_latencies.append(time.perf_counter() - started_at)
+    return {
+        'items': count,
+        'passes': passes,
+        **results,
+        'legacy_scan': harness.summarize(legacy_latencies),
+    }
+
+@scenario('pipe_reader')
+def bench_pipe_reader(args):
+    import subprocess
+    import threading
+    from app import ytdlp_handler
+    runs = 3 if args.quick else 10
+    # 2秒の模擬ダウンロードの間に、標準エラーへ 200バイト x 25000行/秒（約10MB）を書かせる
+    env = dict(os.environ, FAKE_YTDLP_SIZE='2097152', FAKE_YTDLP_SPEED='1048576',
+               FAKE_YTDLP_STDERR_RATE='25000', FAKE_YTDLP_STDERR_BYTES='200')
+    command = [sys.executable, harness.FAKE_YTDLP_PATH, 'http://bench.invalid/pipe']
+
+    def run(reader, timeout):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                   encoding='utf-8', errors='ignore', env=env)
+        # 読み取りが詰まった場合は子プロセスを止めて、詰まったことを記録する
+        deadlocked = threading.Event()
+
+        def kill():
+            deadlocked.set()
+            process.kill()
+        watchdog = threading.Timer(timeout, kill)
+        watchdog.start()
+        started_at = time.perf_counter()
+        progress_lines, stderr_lines = reader(process)
+        elapsed = time.perf_counter() - started_at
+        watchdog.cancel()
+        return {'deadlocked': deadlocked.is_set(), 'elapsed_s': round(elapsed, 2),
+                'progress_lines': progress_lines, 'stderr_lines_kept': stderr_lines}
+
+    def bounded(process):
+        progress_lines = []
+        stderr_tail = ytdlp_handler.read_process_output(
+            process, lambda line: ytdlp_handler.parse_progress(line) and progress_lines.append(line))
+        process.wait()
+        return len(progress_lines), len(stderr_tail)
+
+    def legacy(process):
+        # 旧方式: stdout だけを読み、終了後に stderr をまとめて読む
+        progress_lines = sum(1 for line in iter(process.stdout.readline, '') if ytdlp_handler.parse_progress(line))
+        process.wait()
+        return progress_lines, len(process.stderr.read().splitlines())
+
+    results = [run(bounded, 60) for _ in range(runs)]
+    return {
+        'runs': runs,
+        'stderr_mb_per_run': round(25000 * 200 * 2 / 1024 / 1024, 1),
+        'bounded_reader': {
+            'deadlocks': sum(result['deadlocked'] for result in results),
+            'elapsed_max_s': max(result['elapsed_s'] for result in results),
+            'progress_lines_min': min(result['progress_lines'] for result in results),
+            'stderr_lines_kept': max(result['stderr_lines_kept'] for result in results),
+        },
+        'legacy_reader': run(legacy, 10),
+    }
+
+@scenario('large_queue', simulated=True)
+def bench_large_queue(args):
+    count = 500 if args.quick else 5000
+    # 追加したアイテムが完了しないよう、遅いダウンロードを少数だけ流す
+    fake_env = {'FAKE_YTDLP_SIZE': 10 ** 12, 'FAKE_YTDLP_SPEED': 1024 * 1024}
+    with harness.Server({'concurrentDownloads': 2, 'downloadEngine': args.engine}, fake_env) as server:
+        control = harness.BenchClient()
+        control.connect(server.url)
+        with harness.Sampler(server.pid) as sampler:
+            urls = [f'http://bench.invalid/large/{index}' for index in range(count)]
+            for index in range(0, count, 500):
+                control.add(urls[index:index + 500])
+            deadline = time.perf_counter() + 120
+            while control.total < count and time.perf_counter() < deadline:
+                time.sleep(0.05)
+            _, connect_times = connect_clients(server, 10)
+        control.disconnect()
+        return {
+            'items': count,
+            'startup_ms': round(server.startup_seconds * 1000, 1),
+            'add_latency': harness.summarize(control.latencies),
+            'snapshot_connect': harness.summarize(connect_times),
+            **sampler.result(),
+        }
+
+@scenario('high_concurrency')
+def bench_high_concurrency(args):
+    count, size = (40, 5 * 1024 * 1024) if args.quick else (200, 20 * 1024 * 1024)
+    media, base_url = media_server.start()
+    try:
+        with harness.Server({'concurrentDownloads': 50, 'downloadEngine': args.engine}) as server:
+            urls = [f'{base_url}/progressive/{size}.mp4?n={index}' for index in range(count)]
+            result = run_downloads(server, urls)
+            result['bytes_written'] = folder_bytes(server.downloads_dir)
+            result['throughput_mib_s'] = round(result['bytes_written'] / result['elapsed_s'] / 1024 / 1024, 1)
+            return result
+    finally:
+        media.shutdown()
+
+@scenario('hls')
+def bench_hls(args):
+    count, segments = (10, 10) if args.quick else (100, 50)
+    media, base_url = media_server.start()
+    try:
+        with harness.Server({'concurrentDownloads': 20, 'downloadEngine': args.engine}) as server:
+            urls = [f'{base_url}/hls/{segments}x{512 * 1024}/index.m3u8?n={index}' for index in range(count)]
+            result = run_downloads(server, urls)
+            result['bytes_written'] = folder_bytes(server.downloads_dir)
+            return result
+    finally:
+        media.shutdown()
+
+@scenario('many_clients', simulated=True)
+def bench_many_clients(args):
+    client_count, count = (50, 40) if args.quick else (300, 200)
+    fake_env = {'FAKE_YTDLP_SIZE': 5 * 1024 * 1024, 'FAKE_YTDLP_SPEED': 5 * 1024 * 1024}
+    with harness.Server({'concurrentDownloads': 20, 'downloadEngine': args.engine}, fake_env) as server:
+        clients, connect_times = connect_clients(server, client_count)
+        try:
+            result = run_downloads(server, [f'http://bench.invalid/clients/{index}' for index in range(count)],
+                                   clients=clients, batch_size=20)
+        finally:
+            disconnect_clients(clients)
+        result['clients'] = client_count
+        result['connect'] = harness.summarize(connect_times)
+        result['fanout_latency'] = harness.summarize([latency for client in clients for latency in client.latencies])
+        return result
+
+@scenario('slow_consumers', simulated=True)
+def bench_slow_consumers(args):
+    normal_count, slow_count, count = (20, 5, 40) if args.quick else (50, 10, 200)
+    fake_env = {'FAKE_YTDLP_SIZE': 5 * 1024 * 1024, 'FAKE_YTDLP_SPEED': 5 * 1024 * 1024}
+    with harness.Server({'concurrentDownloads': 20, 'downloadEngine': args.engine}, fake_env) as server:
+        normal, _ = connect_clients(server, normal_count)
+        slow, _ = connect_clients(server, slow_count, handler_delay=0.05)
+        try:
+            result = run_downloads(server, [f'http://bench.invalid/slow/{index}' for index in range(count)],
+                                   clients=normal + slow, batch_size=20)
+        finally:
+            disconnect_clients(normal + slow)
+        result['normal_latency'] = harness.summarize([latency for client in normal for latency in client.latencies])
+        result['slow_latency'] = harness.summarize([latency for client in slow for latency in client.latencies])
+        result['slow_events_received'] = sum(client.events for client in slow)
+        return result
+
+@scenario('stderr_flood', simulated=True)
+def bench_stderr_flood(args):
+    count = 20 if args.quick else 100
+    fake_env = {'FAKE_YTDLP_SIZE': 5 * 1024 * 1024, 'FAKE_YTDLP_SPEED': 5 * 1024 * 1024,
+                'FAKE_YTDLP_STDERR_RATE': 2000, 'FAKE_YTDLP_STDERR_BYTES': 200}
+    with harness.Server({'concurrentDownloads': 20, 'downloadEngine': args.engine}, fake_env) as server:
+        return run_downloads(server, [f'http://bench.invalid/stderr/{index}' for index in range(count)])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', help='実行するシナリオ（省略時はすべて）')
+    parser.add_argument('--engine', default='subprocess', choices=('subprocess', 'asyncio', 'inprocess'),
+                        help='ダウンロードエンジン')
+    parser.add_argument('--quick', action='store_true', help='件数を減らして短時間で実行する')
+    parser.add_argument('--output', help='結果を書き出すJSONファイル（省略時は標準出力）')
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))} (choose from {', '.join(SCENARIOS)})")
+    names = args.scenarios or list(SCENARIOS)
+    if args.engine in MODULE_ENGINES:
+        if args.scenarios and set(args.scenarios) & SIMULATED_SCENARIOS:
+            parser.error(f"{args.engine} cannot run: {', '.join(sorted(set(args.scenarios) & SIMULATED_SCENARIOS))}")
+        names = [name for name in names if name not in SIMULATED_SCENARIOS]
+
+    results = {}
+    for name in names:
+        print(f"Running {name}...", file=sys.stderr)
+        started_at = time.perf_counter()
+        results[name] = SCENARIOS[name](args)
+        results[name]['scenario_seconds'] = round(time.perf_counter() - started_at, 2)
+    harness.write_result({'environment': harness.environment(), 'engine': args.engine, 'quick': args.quick,
+                          'results': results}, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,36 @@
 import os
 import sys
 import logging
-from app import create_app
+import argparse
+from app import create_app, start_background_tasks
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='GUI-ytdlp')
+    parser.add_argument('--worker', action='store_true', help='サーバーを起動せず、ワーカーとしてジョブを実行する')
+    parser.add_argument('--backend', help='ジョブバックエンド（例: sqlite:jobs.db、http://UIノード:5000。省略時は GUI_YTDLP_JOB_BACKEND）')
+    parser.add_argument('--slots', type=int, default=2, help='このワーカーで同時に実行するジョブ数')
+    parser.add_argument('--save-path', help='ワーカー側の保存先（省略時はUIで指定した保存先）')
+    parser.add_argument('--worker-id', help='ワーカーの識別名（省略時はホスト名とプロセスID）')
+    return parser.parse_args()
+
+def run_worker(args):
+    """ワーカーモードの実行関数"""
+    from app import worker
+    logging.basicConfig(level=logging.INFO)
+    try:
+        worker.run(backend_url=args.backend, slots=args.slots, save_path=args.save_path, worker_id=args.worker_id)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Worker stopped: {e}", file=sys.stderr)
+        sys.exit(1)
 
 def main():
     """アプリケーションのメイン実行関数"""
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
     try:
         # 環境変数から設定を読み込み（デフォルト値付き）
         debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
@@ -17,6 +43,10 @@ def main():
         
         # アプリケーションを作成
         app, socketio = create_app()
+        # デバッグ時はリローダーの監視用の親プロセスも run.py を実行するため、
+        # 実際にサーバーとして動く子プロセス（WERKZEUG_RUN_MAIN=true）でだけ常駐処理を開始する
+        if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_tasks()
         
         # サーバーを起動
         print(f"Starting server on {host}:{port} (debug={debug})")
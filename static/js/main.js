@@ -2,9 +2,11 @@ import { initializeTranslations, state } from './state.js';
 import * as socket from './socket.js';
 import * as ui from './ui.js';
 import * as api from './api.js';
+import * as queueList from './queue_list.js';
 
 document.addEventListener('DOMContentLoaded', () => {
     initializeTranslations(window.LANG, window.T);
+    queueList.init((offset) => socket.changeQueueView({ offset }));
     socket.connect();
 
     // DOM Element Selections
@@ -16,10 +18,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const saveSettingsBtn = document.getElementById('save-settings-btn');
     const downloadListUl = document.getElementById('download-list');
     const clearQueueBtn = document.getElementById('clear-queue-btn');
+    const queueFilter = document.getElementById('queue-filter');
     const updateBtn = document.getElementById('update-btn');
     const browseBtn = document.getElementById('browse-btn');
     const openFolderBtn = document.getElementById('open-folder-btn');
     const audioOnlyCheckbox = document.getElementById('audio-only');
+    const autoConcurrencyCheckbox = document.getElementById('auto-concurrency');
     const tabButtonsContainer = document.querySelector('.tab-buttons');
     const welcomeModal = document.getElementById('welcome-modal');
     const dontShowAgainBtn = document.getElementById('dont-show-again-btn');
@@ -54,7 +58,8 @@ document.addEventListener('DOMContentLoaded', () => {
         const urls = videoUrlsTextarea.value.split('\n').map(url => url.trim()).filter(url => url);
         if (urls.length > 0) {
             const options = ui.getCurrentOptions();
-            socket.addToQueue(urls, options);
+            const priority = parseInt(document.getElementById('queue-priority').value, 10) || 0;
+            socket.addToQueue(urls, options, priority);
             videoUrlsTextarea.value = '';
             getFormatsBtn.disabled = true;
         } else {
@@ -65,6 +70,13 @@ document.addEventListener('DOMContentLoaded', () => {
     saveSettingsBtn.addEventListener('click', () => {
         const currentSettings = state.settings;
         currentSettings.general.concurrentDownloads = parseInt(document.getElementById('concurrent-downloads').value, 10);
+        currentSettings.general.downloadEngine = document.getElementById('download-engine').value;
+        currentSettings.general.autoConcurrency = autoConcurrencyCheckbox.checked;
+        currentSettings.general.minConcurrentDownloads = parseInt(document.getElementById('min-concurrent-downloads').value, 10);
+        currentSettings.general.maxConcurrentDownloads = parseInt(document.getElementById('max-concurrent-downloads').value, 10);
+        currentSettings.general.perHostConcurrency = parseInt(document.getElementById('per-host-concurrency').value, 10) || 0;
+        currentSettings.general.perHostRequestsPerMinute = parseInt(document.getElementById('per-host-rate').value, 10) || 0;
+        currentSettings.general.separatePostprocessing = document.getElementById('separate-postprocessing').checked;
         currentSettings.last_options = ui.getCurrentOptions();
         socket.saveSettings(currentSettings);
     });
@@ -72,6 +84,7 @@ document.addEventListener('DOMContentLoaded', () => {
     downloadListUl.addEventListener('click', (e) => {
         const copyBtn = e.target.closest('.copy-btn');
         const deleteBtn = e.target.closest('.item-delete-btn');
+        const moveTopBtn = e.target.closest('.item-move-top-btn');
         if (copyBtn) {
             const errorText = copyBtn.closest('.download-item').querySelector('.item-progress-details').textContent;
             navigator.clipboard.writeText(errorText).then(() => {
@@ -81,10 +94,24 @@ document.addEventListener('DOMContentLoaded', () => {
         } else if (deleteBtn) {
             const itemId = deleteBtn.closest('.download-item').dataset.id;
             socket.removeItem(itemId);
+        } else if (moveTopBtn) {
+            const itemId = moveTopBtn.closest('.download-item').dataset.id;
+            socket.moveToTop(itemId);
         }
     });
 
+    // 待機中アイテムの優先度の変更
+    downloadListUl.addEventListener('change', (e) => {
+        if (!e.target.classList.contains('item-priority')) return;
+        const itemId = e.target.closest('.download-item').dataset.id;
+        socket.setPriority(itemId, parseInt(e.target.value, 10) || 0);
+    });
+
     clearQueueBtn.addEventListener('click', () => socket.clearQueue());
+    queueFilter.addEventListener('change', () => {
+        queueList.resetScroll();
+        socket.changeQueueView({ filter: queueFilter.value, offset: 0 });
+    });
     updateBtn.addEventListener('click', () => socket.updateYtDlp());
     
     browseBtn.addEventListener('click', async () => {
@@ -97,6 +124,10 @@ document.addEventListener('DOMContentLoaded', () => {
         document.getElementById('audio-format-group').style.display = audioOnlyCheckbox.checked ? 'block' : 'none';
     });
 
+    autoConcurrencyCheckbox.addEventListener('change', () => {
+        document.getElementById('auto-concurrency-group').style.display = autoConcurrencyCheckbox.checked ? 'block' : 'none';
+    });
+
     tabButtonsContainer.addEventListener('click', (e) => {
         if (e.target.classList.contains('tab-button')) {
             document.querySelectorAll('.tab-button').forEach(btn => btn.classList.remove('active'));
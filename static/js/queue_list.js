@@ -0,0 +1,253 @@
+// ダウンロードキュー一覧の表示を管理するモジュール
+// サーバーからはクライアントが見ているページのアイテムだけが届き、その中で画面に見えている行だけを作る
+import { state } from './state.js';
+
+// 1行の高さ（px）。style.css の .download-item の高さと間隔の合計に合わせること
+const ROW_HEIGHT = 90;
+// 見えている範囲の前後に作っておく行数
+const OVERSCAN = 5;
+// 見えている範囲がページの端からこの行数以内に近づいたら、その位置のページを要求する
+const PAGE_MARGIN = 20;
+
+const downloadListUl = document.getElementById('download-list');
+const queueFilter = document.getElementById('queue-filter');
+// 一覧全体の高さを作る行。実際の行は絶対位置でこの上に並べる
+const sizer = document.createElement('li');
+sizer.className = 'list-sizer';
+
+// ページ内のアイテム（item_id -> アイテム）と、その表示順
+const items = new Map();
+let pageIds = [];
+// item_id -> ページ内の位置。進捗の反映で一覧を走査しないために使う
+const rowIndex = new Map();
+// 作成済みの行（item_id -> <li>）
+const rows = new Map();
+// 次のフレームで作り直す行と、反映する進捗
+const dirtyIds = new Set();
+const pendingProgress = new Map();
+let page = { filter: null, offset: 0, total: 0 };
+let layoutNeeded = false;
+let frameRequested = false;
+let requestedOffset = null;
+let onPageRequest = () => {};
+
+export function init(pageRequestCallback) {
+    onPageRequest = pageRequestCallback;
+    downloadListUl.innerHTML = '';
+    downloadListUl.appendChild(sizer);
+    downloadListUl.addEventListener('scroll', () => scheduleRender(true));
+}
+
+export function resetScroll() {
+    downloadListUl.scrollTop = 0;
+}
+
+export function renderPage(data) {
+    page = { filter: data.filter, offset: data.offset, total: data.total };
+    requestedOffset = null;
+    items.clear();
+    data.items.forEach(item => items.set(item.id, item));
+    setPageIds(data.items.map(item => item.id));
+    rows.forEach(li => li.remove());
+    rows.clear();
+    dirtyIds.clear();
+    pendingProgress.clear();
+    updateCounts(data.counts);
+    scheduleRender(true);
+}
+
+// 表示中のページの item_id の並びを返す（view と別のページを表示している場合は null）
+export function getPageIds(view) {
+    return page.filter === view.filter && page.offset === view.offset ? pageIds : null;
+}
+
+export function applyPatch(data) {
+    const layoutChanged = data.ids !== undefined || data.total !== page.total;
+    page.total = data.total;
+    if (data.ids) {
+        setPageIds(data.ids);
+        for (const itemId of items.keys()) {
+            if (!rowIndex.has(itemId)) items.delete(itemId);
+        }
+    }
+    data.changes.forEach(change => {
+        if (!rowIndex.has(change.id)) return;
+        items.set(change.id, change.item);
+        pendingProgress.delete(change.id);
+        dirtyIds.add(change.id);
+    });
+    updateCounts(data.counts);
+    scheduleRender(layoutChanged);
+}
+
+export function updateItemProgress(data) {
+    const item = items.get(data.id);
+    if (!item) return;
+    Object.assign(item, data);
+    pendingProgress.set(data.id, data);
+    scheduleRender(false);
+}
+
+function setPageIds(ids) {
+    pageIds = ids;
+    rowIndex.clear();
+    ids.forEach((itemId, index) => rowIndex.set(itemId, index));
+}
+
+function updateCounts(counts) {
+    Array.from(queueFilter.options).forEach(option => {
+        option.textContent = `${option.dataset.label} (${counts?.[option.value] ?? 0})`;
+    });
+}
+
+function scheduleRender(layout) {
+    layoutNeeded = layoutNeeded || layout;
+    if (frameRequested) return;
+    frameRequested = true;
+    // 同じフレーム内の変更・進捗・スクロールはまとめて1回だけDOMに反映する
+    requestAnimationFrame(render);
+}
+
+function render() {
+    frameRequested = false;
+    if (layoutNeeded) {
+        layoutNeeded = false;
+        layoutRows();
+    } else {
+        dirtyIds.forEach(itemId => {
+            const li = rows.get(itemId);
+            if (li) replaceRow(itemId, li);
+        });
+    }
+    dirtyIds.clear();
+    pendingProgress.forEach((data, itemId) => {
+        const li = rows.get(itemId);
+        if (!li) return;
+        li.querySelector('.progress-bar').style.width = `${data.progress}%`;
+        li.querySelector('.item-progress-details').textContent = data.details;
+    });
+    pendingProgress.clear();
+}
+
+function layoutRows() {
+    sizer.style.height = `${page.total * ROW_HEIGHT}px`;
+    updatePlaceholder();
+    const first = Math.max(Math.floor(downloadListUl.scrollTop / ROW_HEIGHT) - OVERSCAN, 0);
+    const last = Math.min(Math.ceil((downloadListUl.scrollTop + downloadListUl.clientHeight) / ROW_HEIGHT) + OVERSCAN, page.total);
+
+    // 見えている範囲にあるページ内の行だけを残す
+    const visible = new Map();
+    for (let index = Math.max(first, page.offset); index < Math.min(last, page.offset + pageIds.length); index++) {
+        visible.set(pageIds[index - page.offset], index);
+    }
+    rows.forEach((li, itemId) => {
+        if (!visible.has(itemId)) {
+            li.remove();
+            rows.delete(itemId);
+        }
+    });
+    const fragment = document.createDocumentFragment();
+    visible.forEach((index, itemId) => {
+        let li = rows.get(itemId);
+        if (!li) {
+            li = createQueueItemElement(items.get(itemId));
+            rows.set(itemId, li);
+            fragment.appendChild(li);
+        } else if (dirtyIds.has(itemId)) {
+            li = replaceRow(itemId, li);
+        }
+        li.style.transform = `translateY(${index * ROW_HEIGHT}px)`;
+    });
+    downloadListUl.appendChild(fragment);
+    requestPageIfNeeded(first, last);
+}
+
+function replaceRow(itemId, li) {
+    const newLi = createQueueItemElement(items.get(itemId));
+    newLi.style.transform = li.style.transform;
+    li.replaceWith(newLi);
+    rows.set(itemId, newLi);
+    return newLi;
+}
+
+function requestPageIfNeeded(first, last) {
+    const pageEnd = page.offset + pageIds.length;
+    const needsEarlier = page.offset > 0 && first < page.offset + PAGE_MARGIN;
+    const needsLater = pageEnd < page.total && last > pageEnd - PAGE_MARGIN;
+    if (!needsEarlier && !needsLater) return;
+    // 見えている範囲がページの中央に来るように要求する
+    const limit = state.queueView.limit;
+    const offset = Math.max(Math.floor((first + last) / 2 - limit / 2), 0);
+    if (offset === page.offset || offset === requestedOffset) return;
+    requestedOffset = offset;
+    onPageRequest(offset);
+}
+
+function updatePlaceholder() {
+    const placeholder = downloadListUl.querySelector('.list-placeholder');
+    if (page.total === 0 && !placeholder) {
+        const li = document.createElement('li');
+        li.className = 'list-placeholder';
+        li.textContent = state.translations?.no_downloads_yet || 'No downloads yet.';
+        downloadListUl.appendChild(li);
+    } else if (page.total > 0 && placeholder) {
+        placeholder.remove();
+    }
+}
+
+function createQueueItemElement(item) {
+    const li = document.createElement('li');
+    li.className = 'download-item';
+    li.dataset.id = item.id;
+
+    const statusKey = item.status;
+    const statusText = state.translations?.[`status_${statusKey}`] || statusKey;
+    const statusClass = statusKey;
+
+    const isError = statusClass === 'error';
+    const isRunning = item.status === 'downloading' || item.status === 'processing';
+    const buttonTitle = isRunning ? state.translations?.button_title_cancel : state.translations?.button_title_delete;
+
+    let detailsText = item.details;
+    if (item.details_key) {
+        detailsText = (state.translations?.[item.details_key] || item.details).replace('{count}', item.count ?? 0);
+    } else if (item.status === 'expanding' && item.count) {
+        detailsText = `${item.count}`;
+    }
+    const label = item.title || item.url;
+
+    // タイトルやURL・エラー内容はサイトや yt-dlp から来る文字列のため、HTML として解釈させない
+    li.append(createElement('button', 'item-delete-btn', '\u00d7', buttonTitle));
+    if (item.status === 'waiting' && !item.pinned) {
+        li.append(createElement('button', 'item-move-top-btn', '\u21e7', state.translations?.button_title_move_top));
+    }
+
+    const info = createElement('div', 'item-info');
+    info.append(createElement('span', 'item-url', label, item.url));
+    if (item.status === 'waiting') {
+        const priorityInput = createElement('input', 'item-priority', null, state.translations?.button_title_priority);
+        Object.assign(priorityInput, { type: 'number', min: -100, max: 100, value: item.priority ?? 0 });
+        info.append(priorityInput);
+    }
+    info.append(createElement('span', `item-status ${statusClass}`, statusText));
+    const detailsWrapper = createElement('div', 'details-wrapper');
+    detailsWrapper.append(createElement('div', 'item-progress-details', detailsText));
+    if (isError) {
+        detailsWrapper.append(createElement('button', 'copy-btn', 'Copy', state.translations?.copy_error));
+    }
+    const progressContainer = createElement('div', 'progress-bar-container');
+    const progressBar = createElement('div', 'progress-bar');
+    progressBar.style.width = `${Number(item.progress) || 0}%`;
+    progressContainer.append(progressBar);
+
+    li.append(info, detailsWrapper, progressContainer);
+    return li;
+}
+
+function createElement(tag, className, text, title) {
+    const element = document.createElement(tag);
+    element.className = className;
+    if (text !== undefined && text !== null) element.textContent = text;
+    if (title !== undefined && title !== null) element.title = title;
+    return element;
+}
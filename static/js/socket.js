@@ -1,34 +1,86 @@
 
 // WebSocket通信を管理するモジュール
-import { renderQueue, updateQueueItem, updateItemProgress, applySettings, showUpdateStatus, showSaveStatus, updateVersion } from './ui.js';
-import { setSettings } from './state.js';
+import { applySettings, applyGeneralSettings, showUpdateStatus, showSaveStatus, updateVersion, showConcurrencyStatus, showAddResult } from './ui.js';
+import { renderPage, applyPatch, updateItemProgress, getPageIds } from './queue_list.js';
+import { state, setSettings, setQueueVersion, setQueueView } from './state.js';
 
 let socket;
 
 export function connect() {
-    socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port);
+    // 接続時には見ているページを伝え、その範囲のアイテムだけを受け取る
+    // 再接続では受け取り済みのバージョンとページの並びも伝え、間の変更だけを差分で受け取る
+    socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port, {
+        auth: (cb) => cb({
+            queueView: state.queueView,
+            queueEpoch: state.queueEpoch,
+            queueVersion: state.queueVersion,
+            queueIds: getPageIds(state.queueView),
+            profile: state.profile
+        })
+    });
 
     socket.on('connect', () => console.log('Successfully connected.'));
     socket.on('version_info', (data) => updateVersion(data.version));
-    socket.on('queue_update', (data) => renderQueue(data.queue));
-    socket.on('item_update', (data) => updateQueueItem(data.item));
-    socket.on('download_progress', (data) => updateItemProgress(data));
+    socket.on('queue_snapshot', (data) => handleQueueSnapshot(data));
+    socket.on('queue_patch', (data) => handleQueuePatch(data));
+    socket.on('progress_batch', (data) => data.items.forEach(updateItemProgress));
     
     socket.on('settings_loaded', (data) => {
         setSettings(data.settings);
         applySettings(data.settings);
     });
 
-    socket.on('settings_saved', (data) => showSaveStatus());
+    // 他のクライアントで保存された全体設定を反映する（入力中のオプションはそのまま）
+    socket.on('settings_changed', (data) => {
+        state.settings.general = data.general;
+        applyGeneralSettings(data.general);
+    });
+
+    socket.on('settings_saved', (data) => showSaveStatus(data));
+    socket.on('add_result', (data) => showAddResult(data));
+    socket.on('concurrency_update', (data) => showConcurrencyStatus(data));
     socket.on('update_status', (data) => showUpdateStatus(data));
 }
 
-export function addToQueue(urls, options) {
-    socket.emit('add_to_queue', { urls, options });
+function handleQueueSnapshot(data) {
+    // ページを切り替えた後に届いた、切り替え前のページは捨てる
+    const view = state.queueView;
+    if (data.filter !== view.filter || data.offset !== view.offset) return;
+    if (data.epoch === state.queueEpoch && data.version < state.queueVersion) return;
+    setQueueVersion(data.epoch, data.version);
+    renderPage(data);
+}
+
+function handleQueuePatch(data) {
+    if (data.epoch !== state.queueEpoch) {
+        requestQueueSync();
+        return;
+    }
+    // 適用済みのパッチは読み飛ばし、間のパッチが欠けていればページを再要求する
+    if (data.version <= state.queueVersion) return;
+    if (data.base !== state.queueVersion) {
+        requestQueueSync();
+        return;
+    }
+    applyPatch(data);
+    setQueueVersion(data.epoch, data.version);
+}
+
+function requestQueueSync() {
+    socket.emit('queue_sync');
+}
+
+export function changeQueueView(view) {
+    setQueueView(view);
+    socket.emit('queue_view', state.queueView);
+}
+
+export function addToQueue(urls, options, priority) {
+    socket.emit('add_to_queue', { urls, options, priority });
 }
 
 export function saveSettings(settings) {
-    socket.emit('save_settings', { settings });
+    socket.emit('save_settings', { settings, profile: state.profile });
 }
 
 export function updateYtDlp() {
@@ -39,6 +91,14 @@ export function removeItem(itemId) {
     socket.emit('remove_item', { id: itemId });
 }
 
+export function moveToTop(itemId) {
+    socket.emit('move_to_top', { id: itemId });
+}
+
+export function setPriority(itemId, priority) {
+    socket.emit('set_priority', { id: itemId, priority });
+}
+
 export function clearQueue() {
     socket.emit('clear_queue');
 }
\ No newline at end of file
@@ -1,10 +1,35 @@
 // アプリケーションの共有状態を管理するモジュール
+
+// ブラウザごとの設定プロファイルのID。前回のオプションはこのIDごとにサーバーへ保存される
+function loadProfileId() {
+    let profile = localStorage.getItem('settingsProfile');
+    if (!profile) {
+        profile = Math.random().toString(36).slice(2, 12);
+        localStorage.setItem('settingsProfile', profile);
+    }
+    return profile;
+}
+
 export const state = {
+    profile: loadProfileId(),
     settings: {},
     lang: 'ja',
-    translations: {}
+    translations: {},
+    queueEpoch: null,
+    queueVersion: 0,
+    // サーバーから受け取るキューのページ（絞り込み・開始位置・件数）
+    queueView: { filter: 'all', offset: 0, limit: 200 }
 };
 
+export function setQueueVersion(epoch, version) {
+    state.queueEpoch = epoch;
+    state.queueVersion = version;
+}
+
+export function setQueueView(view) {
+    Object.assign(state.queueView, view);
+}
+
 export function setSettings(newSettings) {
     state.settings = newSettings;
 }
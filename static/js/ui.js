@@ -3,15 +3,23 @@ import { state } from './state.js';
 const controls = {
     savePath: document.getElementById('save-path'),
     concurrentDownloads: document.getElementById('concurrent-downloads'),
+    downloadEngine: document.getElementById('download-engine'),
+    autoConcurrency: document.getElementById('auto-concurrency'),
+    minConcurrentDownloads: document.getElementById('min-concurrent-downloads'),
+    maxConcurrentDownloads: document.getElementById('max-concurrent-downloads'),
+    perHostConcurrency: document.getElementById('per-host-concurrency'),
+    perHostRate: document.getElementById('per-host-rate'),
+    separatePostprocessing: document.getElementById('separate-postprocessing'),
     videoFormatPreset: document.getElementById('video-format-preset'),
     customVideoFormat: document.getElementById('custom-video-format'),
     audioOnly: document.getElementById('audio-only'),
+    expandPlaylist: document.getElementById('expand-playlist'),
     audioFormat: document.getElementById('audio-format'),
     cookieBrowser: document.getElementById('cookie-browser'),
     customArgs: document.getElementById('custom-args')
 };
 const audioFormatGroup = document.getElementById('audio-format-group');
-const downloadListUl = document.getElementById('download-list');
+const autoConcurrencyGroup = document.getElementById('auto-concurrency-group');
 
 export function getCurrentOptions() {
     const presetValue = controls.videoFormatPreset.value;
@@ -22,6 +30,7 @@ export function getCurrentOptions() {
         savePath: controls.savePath.value,
         selectedFormat: selectedFormat,
         audioOnly: controls.audioOnly.checked,
+        expandPlaylist: controls.expandPlaylist.checked,
         audioFormat: controls.audioFormat.value,
         cookieBrowser: controls.cookieBrowser.value,
         customArgs: controls.customArgs.value
@@ -30,70 +39,34 @@ export function getCurrentOptions() {
 
 
 export function applySettings(settings) {
-    const general = settings.general || {};
     const options = settings.last_options || {};
-    controls.concurrentDownloads.value = general.concurrentDownloads || 1;
+    applyGeneralSettings(settings.general || {});
     controls.savePath.value = options.savePath || '';
     controls.audioOnly.checked = options.audioOnly || false;
+    controls.expandPlaylist.checked = options.expandPlaylist || false;
     controls.audioFormat.value = options.audioFormat || 'best';
     controls.cookieBrowser.value = options.cookieBrowser || 'none';
     controls.customArgs.value = options.customArgs || '';
     audioFormatGroup.style.display = controls.audioOnly.checked ? 'block' : 'none';
 }
 
-export function renderQueue(queue) {
-    downloadListUl.innerHTML = '';
-    const queueIds = Object.keys(queue);
-    const placeholderText = state.translations?.no_downloads_yet || 'No downloads yet.';
-    if (queueIds.length === 0) {
-        downloadListUl.innerHTML = `<li class="list-placeholder">${placeholderText}</li>`;
-    } else {
-        queueIds.forEach(id => downloadListUl.appendChild(createQueueItemElement(queue[id])));
-    }
-}
-
-function createQueueItemElement(item) {
-    const li = document.createElement('li');
-    li.className = 'download-item';
-    li.dataset.id = item.id;
-    
-    const statusKey = item.status;
-    const statusText = state.translations?.[`status_${statusKey}`] || statusKey;
-    const statusClass = statusKey;
-    
-    const isError = statusClass === 'error';
-    const buttonTitle = item.status === 'downloading' ? state.translations?.button_title_cancel : state.translations?.button_title_delete;
-    
-    let detailsText = item.details;
-    if (item.details_key) {
-        detailsText = state.translations?.[item.details_key] || item.details;
-    }
-
-    li.innerHTML = `
-        <button class="item-delete-btn" title="${buttonTitle}">&times;</button>
-        <div class="item-info">
-            <span class="item-url" title="${item.url}">${item.url}</span>
-            <span class="item-status ${statusClass}">${statusText}</span>
-        </div>
-        <div class="details-wrapper">
-            <div class="item-progress-details">${detailsText}</div>
-            ${isError ? `<button class="copy-btn" title="${state.translations?.copy_error}">Copy</button>` : ''}
-        </div>
-        <div class="progress-bar-container"><div class="progress-bar" style="width: ${item.progress}%;"></div></div>`;
-    return li;
-}
-
-export function updateQueueItem(item) {
-    const li = downloadListUl.querySelector(`[data-id="${item.id}"]`);
-    if (li) li.replaceWith(createQueueItemElement(item));
+export function applyGeneralSettings(general) {
+    controls.concurrentDownloads.value = general.concurrentDownloads || 1;
+    controls.downloadEngine.value = general.downloadEngine || 'subprocess';
+    controls.autoConcurrency.checked = general.autoConcurrency || false;
+    controls.minConcurrentDownloads.value = general.minConcurrentDownloads || 1;
+    controls.maxConcurrentDownloads.value = general.maxConcurrentDownloads || 10;
+    controls.perHostConcurrency.value = general.perHostConcurrency || 0;
+    controls.perHostRate.value = general.perHostRequestsPerMinute || 0;
+    controls.separatePostprocessing.checked = general.separatePostprocessing ?? true;
+    autoConcurrencyGroup.style.display = controls.autoConcurrency.checked ? 'block' : 'none';
 }
 
-export function updateItemProgress(data) {
-    const li = downloadListUl.querySelector(`[data-id="${data.id}"]`);
-    if (li) {
-        li.querySelector('.progress-bar').style.width = `${data.progress}%`;
-        li.querySelector('.item-progress-details').textContent = data.details;
-    }
+export function showConcurrencyStatus(data) {
+    const statusSpan = document.getElementById('concurrency-status');
+    const throughput = data.throughput != null ? ` (${(data.throughput / 1024 / 1024).toFixed(2)} MiB/s)` : '';
+    const reason = state.translations?.[`concurrency_reason_${data.reason}`] || data.reason;
+    statusSpan.textContent = `${state.translations?.concurrency_status_label} ${data.limit}${throughput} - ${reason}`;
 }
 
 export function populateFormatSelector(formats) {
@@ -125,12 +98,22 @@ export function updateVersion(version) {
     document.getElementById('yt-dlp-version').textContent = version || 'Error';
 }
 
-export function showSaveStatus() {
+export function showSaveStatus(data) {
     const statusSpan = document.getElementById('save-status');
-    statusSpan.textContent = state.translations?.settings_saved;
+    const errors = data?.errors || [];
+    statusSpan.textContent = errors.length > 0
+        ? (state.translations?.settings_invalid || '').replace('{keys}', errors.join(', '))
+        : state.translations?.settings_saved;
     setTimeout(() => statusSpan.textContent = '', 2000);
 }
 
+export function showAddResult(data) {
+    if (data.skipped.length === 0) return;
+    const statusSpan = document.getElementById('add-status');
+    statusSpan.textContent = (state.translations?.skipped_duplicates || '').replace('{count}', data.skipped.length);
+    setTimeout(() => statusSpan.textContent = '', 5000);
+}
+
 export function showUpdateStatus(data) {
     const statusSpan = document.getElementById('update-status');
     let message = state.translations?.[data.message_key] || '';
@@ -138,8 +121,10 @@ export function showUpdateStatus(data) {
         message = message.replace('{version}', data.version);
     }
     statusSpan.textContent = message;
-    document.getElementById('update-btn').disabled = data.message_key === 'update_status_updating';
-    if (data.message_key !== 'update_status_updating') {
+    const busy = ['update_status_updating', 'bootstrap_downloading'].includes(data.message_key);
+    document.getElementById('update-btn').disabled = busy;
+    // 起動時の取得の状況は、完了するまで表示したままにする
+    if (!busy && data.message_key !== 'bootstrap_failed') {
         setTimeout(() => statusSpan.textContent = '', 3000);
     }
 }
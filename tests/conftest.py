@@ -0,0 +1,25 @@
+"""テスト共通のフィクスチャ"""
+import types
+import pytest
+
+class Clock:
+    """モジュールから見える time.time / time.monotonic を手で進める時計"""
+
+    def __init__(self, monkeypatch):
+        self.now = 1_700_000_000.0
+        self._monkeypatch = monkeypatch
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def install(self, module):
+        """module が import している time をこの時計に置き換える（テストの終了時に戻る）"""
+        self._monkeypatch.setattr(module, 'time', types.SimpleNamespace(time=self.time, monotonic=self.monotonic))
+        return self
+
+@pytest.fixture
+def clock(monkeypatch):
+    return Clock(monkeypatch)
@@ -0,0 +1,86 @@
+"""archive の重複判定キーのテスト"""
+import os
+import sys
+import json
+import subprocess
+import pytest
+from app import archive
+
+@pytest.fixture(autouse=True)
+def clean_archive(monkeypatch, tmp_path):
+    monkeypatch.setattr(archive, '_archived', set())
+    monkeypatch.setattr(archive, '_queued', {})
+    monkeypatch.setattr(archive, 'ARCHIVE_FILE', str(tmp_path / 'download_archive.txt'))
+    monkeypatch.setattr(archive, 'SPOOL_DIR', str(tmp_path / 'spool'))
+
+@pytest.mark.parametrize('url', [
+    'https://www.youtube.com/watch?v=abc123DEF45',
+    'http://youtube.com/watch?v=abc123DEF45#t=10',
+    'https://m.youtube.com/watch?feature=share&v=abc123DEF45&utm_source=x',
+    'https://WWW.YouTube.com/watch/?v=abc123DEF45',
+])
+def test_enqueue_key_ignores_cosmetic_url_differences(url):
+    assert archive.archive_key(url) == 'url https://youtube.com/watch?v=abc123DEF45'
+
+def test_enqueue_key_keeps_meaningful_query():
+    assert archive.archive_key('https://example.com/watch?v=1') != archive.archive_key('https://example.com/watch?v=2')
+    assert archive.archive_key('https://example.com/a?x=1&y=2') == archive.archive_key('https://example.com/a?y=2&x=1')
+
+def test_enqueue_does_not_load_extractors():
+    # 抽出器の読み込みだけで数百ミリ秒かかるため、追加時には読み込まない
+    code = ("import sys; from app import archive; archive.archive_key('https://www.youtube.com/watch?v=abc123DEF45'); "
+            "print('yt_dlp.extractor' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.strip() == 'False', result.stderr
+
+def test_read_info_key(tmp_path):
+    path = tmp_path / 'item.info.json'
+    path.write_text(json.dumps({'id': 'abc123DEF45', 'extractor_key': 'Youtube'}), encoding='utf-8')
+    assert archive.read_info_key(str(path)) == 'youtube abc123DEF45'
+    path.write_text(json.dumps({'_type': 'playlist', 'id': 'PL1', 'extractor_key': 'YoutubeTab'}), encoding='utf-8')
+    assert archive.read_info_key(str(path)) is None
+    assert archive.read_info_key(str(tmp_path / 'missing.json')) is None
+
+def test_take_key_reads_single_video_and_removes_file():
+    with open(archive.key_file('item1'), 'w', encoding='utf-8') as f:
+        f.write('Youtube abc123DEF45\nYoutube abc123DEF45\n')
+    assert archive.take_key('item1') == 'youtube abc123DEF45'
+    assert archive.take_key('item1') is None
+
+@pytest.mark.parametrize('content', ['Youtube a\nYoutube b\n', 'NA NA\n', ''])
+def test_take_key_without_single_video(content):
+    with open(archive.key_file('item1'), 'w', encoding='utf-8') as f:
+        f.write(content)
+    assert archive.take_key('item1') is None
+
+def test_rekey_keeps_url_key_queued():
+    archive.mark_queued('url https://youtube.com/watch?v=abc', 'item1')
+    assert archive.rekey('url https://youtube.com/watch?v=abc', 'youtube abc', 'item1') is None
+    assert archive.find_duplicate('url https://youtube.com/watch?v=abc') == 'queued'
+    assert archive.find_duplicate('youtube abc') == 'queued'
+
+def test_completed_url_is_skipped_when_added_again():
+    url = 'https://www.youtube.com/watch?v=abc123DEF45'
+    url_key = archive.archive_key(url)
+    archive.mark_queued(url_key, 'item1')
+    archive.rekey(url_key, 'youtube abc123DEF45', 'item1')
+    for key in (url_key, 'youtube abc123DEF45'):
+        archive.add(key, 'item1')
+    assert archive.find_duplicate(archive.archive_key('https://youtube.com/watch?v=abc123DEF45&si=x')) == 'archived'
+    # 再起動後も両方のキーを読み込む
+    archive.load()
+    assert archive.find_duplicate(url_key) == 'archived'
+    assert archive.find_duplicate('youtube abc123DEF45') == 'archived'
+
+def test_rekey_reports_duplicates_under_other_urls():
+    archive.add('youtube abc')
+    archive.mark_queued('youtube def', 'item2')
+    archive.mark_queued('url https://youtu.be/abc', 'item1')
+    assert archive.rekey('url https://youtu.be/abc', 'youtube abc', 'item1') == 'archived'
+    archive.mark_queued('url https://youtu.be/def', 'item3')
+    assert archive.rekey('url https://youtu.be/def', 'youtube def', 'item3') == 'queued'
+    # 元のアイテムのキーは残す
+    assert archive.find_duplicate('youtube def') == 'queued'
+    archive.unmark_queued('youtube def', 'item3')
+    assert archive.find_duplicate('youtube def') == 'queued'
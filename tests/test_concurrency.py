@@ -0,0 +1,91 @@
+"""concurrency.decide の同時数の調整（AIMD）のテスト
+
+実際には計測せず、同時数 -> スループットの曲線を与えて判断を繰り返す。
+"""
+import pytest
+from app import concurrency
+
+def link(capacity, per_download=1.0):
+    """1本あたり per_download の速度で、合計が capacity で頭打ちになる回線"""
+    return lambda limit: min(limit * per_download, capacity)
+
+def initial_state(limit=1):
+    return {'limit': limit, 'baseline': None, 'last_action': None, 'hold': 0}
+
+def run(curve, state, decisions, waiting=100, min_limit=1, max_limit=16):
+    """スロットが埋まっている状態で decisions 回判断し、(最後の状態, [(同時数, 理由), ...]) を返す"""
+    history = []
+    for _ in range(decisions):
+        state, reason = concurrency.decide(state, curve(state['limit']), state['limit'], waiting, min_limit, max_limit)
+        history.append((state['limit'], reason))
+    return state, history
+
+def test_probes_up_to_link_capacity_and_stays_near_it():
+    state, history = run(link(4), initial_state(), 40)
+    assert [limit for limit, _ in history[:4]] == [2, 3, 4, 5]
+    assert all(reason == 'probe' for _, reason in history[:4])
+    # 頭打ちを超えた分は効果が無いので戻し、以後は上限付近で様子を見ながら再計測する
+    assert history[4] == (4, 'no_gain')
+    assert {limit for limit, _ in history[4:]} <= {4, 5}
+    assert {'steady', 'probe', 'no_gain'} >= {reason for _, reason in history[4:]}
+
+def test_holds_after_decrease_before_probing_again():
+    state, history = run(link(4), initial_state(4), 5)
+    reasons = [reason for _, reason in history]
+    decrease = reasons.index('no_gain')
+    # 減らした直後の判断では増やさない
+    assert reasons[decrease + 1:decrease + concurrency.HOLD_DECISIONS] == ['steady'] * (concurrency.HOLD_DECISIONS - 1)
+
+def test_never_exceeds_max_limit():
+    state, history = run(link(100), initial_state(), 20, max_limit=6)
+    assert max(limit for limit, _ in history) == 6
+    assert history[-1] == (6, 'steady')
+
+def test_no_probe_without_waiting_items():
+    state, history = run(link(100), initial_state(3), 5, waiting=0)
+    assert history == [(3, 'steady')] * 5
+
+def test_halves_on_throughput_drop():
+    state, _ = run(link(8), initial_state(), 20)
+    limit = state['limit']
+    # 回線が細くなった（他の通信・サーバー側の制限など）
+    state, reason = concurrency.decide(state, 1.0, limit, 100, 1, 16)
+    assert reason == 'throughput_drop'
+    assert state['limit'] == limit // 2
+    assert state['hold'] == concurrency.HOLD_DECISIONS
+
+def test_halving_respects_min_limit():
+    state = dict(initial_state(3), baseline=10.0, last_action='hold')
+    state, reason = concurrency.decide(state, 1.0, 3, 100, 2, 16)
+    assert (state['limit'], reason) == (2, 'throughput_drop')
+
+def test_idle_slots_reset_baseline_without_changing_limit():
+    state = dict(initial_state(4), baseline=4.0, last_action='increase')
+    new_state, reason = concurrency.decide(state, 1.0, 2, 100, 1, 16)
+    assert reason == 'idle'
+    assert new_state['limit'] == 4
+    assert new_state['baseline'] is None
+    # 渡した状態は変更しない
+    assert state['baseline'] == 4.0
+
+def test_report_throttled_halves_and_holds(monkeypatch):
+    published = []
+    monkeypatch.setattr(concurrency, 'is_enabled', lambda: True)
+    monkeypatch.setattr(concurrency, 'get_bounds', lambda: (1, 16))
+    monkeypatch.setattr(concurrency, '_publish', published.append)
+    monkeypatch.setattr(concurrency, '_state', dict(initial_state(8), baseline=8.0, last_action='increase'))
+
+    concurrency.report_throttled()
+    assert concurrency._state['limit'] == 4
+    assert concurrency._state['baseline'] is None
+    assert published == [{'limit': 4, 'throughput': None, 'reason': 'throttled'}]
+
+    # 制限を受けた直後は、スループットが伸びても増やさない
+    _, history = run(link(100), dict(concurrency._state), concurrency.HOLD_DECISIONS)
+    assert [reason for _, reason in history[:-1]] == ['steady'] * (concurrency.HOLD_DECISIONS - 1)
+    assert history[-1] == (5, 'probe')
+
+@pytest.mark.parametrize('limit', [0, 50])
+def test_clamps_limit_into_bounds(limit):
+    state, _ = concurrency.decide(initial_state(limit), 1.0, 0, 0, 2, 10)
+    assert 2 <= state['limit'] <= 10
@@ -0,0 +1,132 @@
+"""format_cache の TTL・LRU・同時リクエストの共有（singleflight）のテスト
+
+抽出処理の代わりに呼び出し回数を数えるローダーを渡して検証する。
+"""
+import time
+import threading
+import pytest
+from app import format_cache
+
+class CountingLoader:
+    def __init__(self, value='formats'):
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.value
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+@pytest.fixture(autouse=True)
+def clean_cache(monkeypatch):
+    monkeypatch.setattr(format_cache, '_stats', {'hits': 0, 'misses': 0, 'shared': 0, 'evictions': 0})
+    format_cache.clear()
+    yield
+    format_cache.clear()
+
+@pytest.fixture
+def clock(clock):
+    return clock.install(format_cache)
+
+def test_hit_within_ttl(clock):
+    loader = CountingLoader()
+    assert format_cache.get_or_load('a', loader) == 'formats'
+    clock.now += format_cache.TTL_SECONDS - 1
+    assert format_cache.get_or_load('a', loader) == 'formats'
+    assert loader.calls == 1
+    assert format_cache.get_stats()['hits'] == 1
+
+def test_expired_entry_is_reloaded(clock):
+    loader = CountingLoader()
+    format_cache.get_or_load('a', loader)
+    clock.now += format_cache.TTL_SECONDS + 1
+    format_cache.get_or_load('a', loader)
+    assert loader.calls == 2
+    assert format_cache.get_stats()['misses'] == 2
+
+def test_least_recently_used_entry_is_evicted(monkeypatch, clock):
+    monkeypatch.setattr(format_cache, 'MAX_ENTRIES', 2)
+    loaders = {key: CountingLoader(key) for key in 'abc'}
+    format_cache.get_or_load('a', loaders['a'])
+    format_cache.get_or_load('b', loaders['b'])
+    # a を使ったので、c を入れたときに追い出されるのは b
+    format_cache.get_or_load('a', loaders['a'])
+    format_cache.get_or_load('c', loaders['c'])
+    format_cache.get_or_load('a', loaders['a'])
+    format_cache.get_or_load('b', loaders['b'])
+    assert (loaders['a'].calls, loaders['b'].calls, loaders['c'].calls) == (1, 2, 1)
+    assert format_cache.get_stats()['size'] == 2
+    assert format_cache.get_stats()['evictions'] == 2
+
+def test_concurrent_requests_share_one_load():
+    release = threading.Event()
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        release.wait(5)
+        return 'formats'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(format_cache.get_or_load('a', slow_loader)))
+               for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    # 全員が読み込みの完了待ちに入ってから読み込みを終わらせる
+    wait_until(lambda: format_cache.get_stats()['shared'] == 9)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert results == ['formats'] * 10
+    assert format_cache.get_stats()['in_flight'] == 0
+
+def test_failed_load_is_not_cached():
+    def failing_loader():
+        raise RuntimeError('extraction failed')
+
+    with pytest.raises(RuntimeError):
+        format_cache.get_or_load('a', failing_loader)
+    loader = CountingLoader()
+    assert format_cache.get_or_load('a', loader) == 'formats'
+    assert loader.calls == 1
+
+def test_uncacheable_result_is_not_cached():
+    loader = CountingLoader({'success': False, 'error': 'HTTP Error 503'})
+    cacheable = lambda result: result.get('success')
+    format_cache.get_or_load('a', loader, cacheable)
+    format_cache.get_or_load('a', loader, cacheable)
+    assert loader.calls == 2
+
+def test_waiters_receive_the_leader_error():
+    release = threading.Event()
+
+    def failing_loader():
+        release.wait(5)
+        raise RuntimeError('extraction failed')
+
+    errors = []
+
+    def request():
+        try:
+            format_cache.get_or_load('a', failing_loader)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: format_cache.get_stats()['shared'] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert errors == ['extraction failed'] * 3
+    assert format_cache.get_stats()['size'] == 0
+
+def test_make_key_normalizes_url():
+    assert format_cache.make_key('HTTPS://Example.COM/watch?v=1#t=10') == \
+        format_cache.make_key('https://example.com/watch?v=1', None)
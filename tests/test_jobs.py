@@ -0,0 +1,176 @@
+"""jobs の SQLite バックエンドを2つのワーカーから使うテスト（リース・ハートビートの期限切れ・再リース）
+
+ワーカーは別プロセスで動くため、ワーカーごとに同じファイルを開いた別のバックエンドを使う。
+"""
+import os
+import types
+import flask
+import pytest
+import requests
+from urllib.parse import urlsplit
+from app import jobs, views, remote_engine
+
+@pytest.fixture
+def clock(clock):
+    return clock.install(jobs)
+
+@pytest.fixture
+def backends(tmp_path, clock):
+    """(UIノード, ワーカー1, ワーカー2) のバックエンド"""
+    path = str(tmp_path / 'jobs.db')
+    return jobs.SqliteJobBackend(path), jobs.SqliteJobBackend(path), jobs.SqliteJobBackend(path)
+
+def events(backend, kind=None):
+    return [(job_id, event_kind, data) for _, job_id, event_kind, data in backend.events_since(0)
+            if kind is None or event_kind == kind]
+
+def test_two_workers_lease_different_jobs(backends, clock):
+    ui, worker1, worker2 = backends
+    for index in range(2):
+        ui.submit(f'job{index}', {'item': {'id': f'item{index}'}})
+        clock.now += 1
+    leased = [worker1.lease('w1'), worker2.lease('w2')]
+    assert sorted(job_id for job_id, _ in leased) == ['job0', 'job1']
+    assert leased[0][1] == {'item': {'id': 'item0'}}
+    assert worker1.lease('w1') is None
+
+def test_heartbeat_keeps_lease(backends, clock):
+    ui, worker1, worker2 = backends
+    ui.submit('job0', {})
+    worker1.lease('w1', lease_seconds=10)
+    for _ in range(5):
+        clock.now += 8
+        assert worker1.heartbeat('job0', 'w1', lease_seconds=10)
+        assert ui.requeue_expired() == 0
+    assert worker2.lease('w2') is None
+
+def test_expired_lease_is_reclaimed_by_other_worker(backends, clock):
+    ui, worker1, worker2 = backends
+    ui.submit('job0', {'item': {'id': 'item0'}})
+    assert worker1.lease('w1', lease_seconds=10)[0] == 'job0'
+    worker1.report_progress('job0', 'w1', {'progress': 10})
+
+    # ワーカー1が止まり、ハートビートが届かないまま期限が切れる
+    clock.now += 11
+    assert ui.requeue_expired() == 1
+    assert events(ui, 'requeued') == [('job0', 'requeued', None)]
+    assert worker2.lease('w2', lease_seconds=10) == ('job0', {'item': {'id': 'item0'}})
+
+    # 戻ってきたワーカー1はリースを失っていることに気付き、結果は無視される
+    assert not worker1.heartbeat('job0', 'w1')
+    worker1.finish('job0', 'w1', 0, [])
+    assert events(ui, 'finished') == []
+
+    assert worker2.heartbeat('job0', 'w2')
+    worker2.finish('job0', 'w2', 0, [])
+    assert events(ui, 'finished') == [('job0', 'finished', {'returncode': 0, 'stderr_tail': []})]
+
+def test_finish_carries_result_for_ui_node(backends, clock):
+    ui, worker1, _ = backends
+    ui.submit('job0', {})
+    worker1.lease('w1')
+    result = {'archive_key': 'youtube abc', 'files': [{'path': 'D:/Videos/a.mp4', 'size': 1, 'mtime_ns': 2}]}
+    worker1.finish('job0', 'w1', 0, [], result)
+    assert events(ui, 'finished') == [('job0', 'finished', {'returncode': 0, 'stderr_tail': [], 'result': result})]
+
+def test_job_fails_after_repeated_expiries(backends, clock):
+    ui, worker1, worker2 = backends
+    ui.submit('job0', {})
+    for attempt, worker in enumerate([worker1, worker2, worker1]):
+        assert worker.lease(f'w{attempt}', lease_seconds=10)[0] == 'job0'
+        clock.now += 11
+        ui.requeue_expired(max_expiries=3)
+    assert worker2.lease('w2') is None
+    assert events(ui, 'finished') == [('job0', 'finished', {'returncode': 1,
+                                                            'stderr_tail': ['Worker lost (lease expired)']})]
+
+def test_cancel_stops_leased_job_at_next_heartbeat(backends, clock):
+    ui, worker1, _ = backends
+    ui.submit('job0', {})
+    ui.submit('job1', {})
+    worker1.lease('w1')
+    ui.cancel('job0')
+    ui.cancel('job1')
+    assert not worker1.heartbeat('job0', 'w1')
+    # 待機中だったジョブはその場で終了する
+    assert events(ui, 'finished') == [('job1', 'finished', {'returncode': 1, 'stderr_tail': ['cancelled']})]
+    worker1.finish('job0', 'w1', 1, ['cancelled'])
+    assert [job_id for job_id, _, _ in events(ui, 'finished')] == ['job1', 'job0']
+
+def test_prune_removes_delivered_events_and_finished_jobs(backends, clock):
+    ui, worker1, _ = backends
+    ui.submit('job0', {})
+    worker1.lease('w1')
+    worker1.finish('job0', 'w1', 0, [])
+    last_seq = ui.events_since(0)[-1][0]
+    ui.prune(last_seq)
+    assert ui.events_since(0) == []
+    assert ui._connection().execute('SELECT COUNT(*) FROM jobs').fetchone()[0] == 0
+
+@pytest.mark.parametrize('path', [
+    '//fileserver/share/jobs.db',
+    pytest.param('\\\\fileserver\\share\\jobs.db', marks=pytest.mark.skipif(os.name != 'nt', reason='Windows only')),
+])
+def test_network_paths_are_rejected(path):
+    with pytest.raises(ValueError):
+        jobs.open_backend(f'sqlite:{path}')
+
+def test_backend_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        jobs.JobBackend()
+    # ワーカー用のバックエンドはUIノードのキューとしては使えない
+    assert not issubclass(jobs.HttpJobBackend, jobs.JobBackend)
+
+class FlaskSession:
+    """HttpJobBackend のリクエストを Flask のテストクライアントに渡す（requests.Session の代わり）"""
+
+    def __init__(self, client):
+        self.client = client
+        self.headers = {}
+
+    def post(self, url, json, timeout):
+        response = self.client.post(urlsplit(url).path, json=json, headers=self.headers)
+        return types.SimpleNamespace(json=lambda: response.get_json(), raise_for_status=lambda: _raise_for(response))
+
+def _raise_for(response):
+    if response.status_code >= 400:
+        raise requests.HTTPError(response.status_code)
+
+@pytest.fixture
+def http_worker(monkeypatch, backends):
+    """UIノードのジョブAPIを経由してSQLiteバックエンドを使うワーカー"""
+    monkeypatch.setenv(jobs.WORKER_TOKEN_ENV, 'secret')
+    monkeypatch.setattr(remote_engine, '_backend', backends[0])
+    app = flask.Flask(__name__)
+    app.register_blueprint(views.main_bp)
+    worker = jobs.open_backend('http://ui-node:5000')
+    worker._session = FlaskSession(app.test_client())
+    worker._session.headers[jobs.WORKER_TOKEN_HEADER] = 'secret'
+    return worker
+
+def test_http_worker_leases_through_ui_node(backends, clock, http_worker):
+    ui = backends[0]
+    ui.submit('job0', {'item': {'id': 'item0'}})
+    assert http_worker.lease('remote', lease_seconds=10) == ('job0', {'item': {'id': 'item0'}})
+    assert http_worker.lease('remote') is None
+    clock.now += 8
+    assert http_worker.heartbeat('job0', 'remote', lease_seconds=10)
+    clock.now += 8
+    assert ui.requeue_expired() == 0
+    http_worker.report_progress('job0', 'remote', {'progress': 50})
+    http_worker.finish('job0', 'remote', 0, [], {'archive_key': 'youtube abc', 'files': []})
+    assert events(ui) == [('job0', 'progress', {'progress': 50}),
+                          ('job0', 'finished', {'returncode': 0, 'stderr_tail': [],
+                                                'result': {'archive_key': 'youtube abc', 'files': []}})]
+
+def test_http_worker_needs_token(backends, http_worker, monkeypatch):
+    backends[0].submit('job0', {})
+    http_worker._session.headers[jobs.WORKER_TOKEN_HEADER] = 'wrong'
+    with pytest.raises(requests.HTTPError):
+        http_worker.lease('remote')
+    # トークンを設定していないUIノードはジョブAPIを受け付けない
+    monkeypatch.delenv(jobs.WORKER_TOKEN_ENV)
+    http_worker._session.headers[jobs.WORKER_TOKEN_HEADER] = ''
+    with pytest.raises(requests.HTTPError):
+        http_worker.lease('remote')
+    assert backends[1].lease('local')[0] == 'job0'
@@ -0,0 +1,55 @@
+"""postprocess の、プールの空きを待っている間のキャンセルのテスト"""
+import queue
+import threading
+import pytest
+from app import postprocess
+
+def submit_and_wait(pp_plan):
+    results = queue.Queue()
+    postprocess.submit(pp_plan, lambda process: None, lambda *result: results.put(result))
+    return results.get(timeout=5)
+
+def test_cancelled_plan_is_not_run(monkeypatch, tmp_path):
+    runs = []
+    monkeypatch.setattr(postprocess, '_run', lambda pp_plan, register_process: runs.append(pp_plan) or (0, []))
+    files_path = tmp_path / 'item.files'
+    files_path.write_text('a.mp4\n', encoding='utf-8')
+    pp_plan = {'kind': 'merge', 'files_path': str(files_path)}
+
+    postprocess.CancelHandle(pp_plan).terminate()
+    assert submit_and_wait(pp_plan) == (1, [])
+    assert runs == []
+    assert not files_path.exists()
+
+def test_plan_cancelled_while_waiting_for_a_worker(monkeypatch, tmp_path):
+    release = threading.Event()
+    monkeypatch.setattr(postprocess, '_executor', None)
+    monkeypatch.setitem(postprocess.settings_handler.app_settings, 'general', {'postprocessWorkers': 1})
+    monkeypatch.setattr(postprocess, '_run', lambda pp_plan, register_process: release.wait(5) and (0, []))
+    busy = {'kind': 'merge', 'files_path': str(tmp_path / 'busy.files')}
+    waiting = {'kind': 'merge', 'files_path': str(tmp_path / 'waiting.files')}
+
+    results = queue.Queue()
+    postprocess.submit(busy, lambda process: None, lambda *result: results.put(('busy', result)))
+    postprocess.submit(waiting, lambda process: None, lambda *result: results.put(('waiting', result)))
+    # 1つしかないワーカーが埋まっている間に削除する
+    postprocess.CancelHandle(waiting).terminate()
+    release.set()
+    assert sorted(results.get(timeout=5) for _ in range(2)) == [('busy', (0, [])), ('waiting', (1, []))]
+    postprocess._get_executor().shutdown()
+
+@pytest.mark.parametrize('custom_args, separate', [
+    ('', True),
+    ('--embed-thumbnail', True),
+    ('-f 137+140', False),
+    ('-fbestvideo+bestaudio', False),
+    ('--format=best', False),
+    ('-S res:720', False),
+    ('--format-sort vcodec:h264', False),
+])
+def test_custom_format_args_keep_postprocessing_in_yt_dlp(monkeypatch, custom_args, separate):
+    monkeypatch.setattr(postprocess, 'find_ffmpeg', lambda: 'ffmpeg')
+    monkeypatch.setitem(postprocess.settings_handler.app_settings, 'general', {'separatePostprocessing': True})
+    monkeypatch.setattr(postprocess, '_prepare', lambda pp_plan: pp_plan)
+    item = {'id': 'item1', 'options': {'selectedFormat': '137+140', 'customArgs': custom_args}}
+    assert (postprocess.plan(item) is not None) == separate
@@ -0,0 +1,126 @@
+"""queue_events の絞り込みごとの一覧・再接続時の差分・表示範囲の検証のテスト"""
+import threading
+import collections
+import pytest
+from app import queue_events
+
+@pytest.fixture(autouse=True)
+def queue(monkeypatch):
+    """空のキューを登録し、モジュールの状態をテストごとに作り直す"""
+    download_queue = {}
+    monkeypatch.setattr(queue_events, '_queue', download_queue)
+    monkeypatch.setattr(queue_events, '_queue_lock', threading.Lock())
+    monkeypatch.setattr(queue_events, 'queue_version', 0)
+    monkeypatch.setattr(queue_events, '_history', collections.deque(maxlen=queue_events.HISTORY_LIMIT))
+    monkeypatch.setattr(queue_events, '_filtered', {name: [] for name in queue_events.STATUS_FILTERS})
+    monkeypatch.setattr(queue_events, '_tracked', {})
+    monkeypatch.setattr(queue_events, '_views', {})
+    monkeypatch.setattr(queue_events.journal, 'record', lambda change: None)
+    return download_queue
+
+def add(queue, item_id, status='waiting'):
+    queue[item_id] = {'id': item_id, 'status': status}
+    return queue_events.record('added', queue[item_id])
+
+def update(queue, item_id, status):
+    queue[item_id]['status'] = status
+    return queue_events.record('updated', queue[item_id])
+
+def remove(queue, item_id):
+    queue.pop(item_id)
+    return queue_events.record('removed', item_id=item_id)
+
+def test_counts_and_filters_follow_recorded_changes(queue):
+    for index in range(4):
+        add(queue, f'item{index}')
+    update(queue, 'item1', 'completed')
+    update(queue, 'item2', 'error')
+    remove(queue, 'item3')
+    snapshot = queue_events.open_view('sid', {'filter': 'active'})
+    assert snapshot['counts'] == {'all': 3, 'active': 1, 'completed': 1, 'failed': 1}
+    assert [item['id'] for item in snapshot['items']] == ['item0']
+    assert snapshot['total'] == 1
+
+def test_items_keep_queue_order_when_status_changes(queue):
+    for index in range(3):
+        add(queue, f'item{index}')
+    for item_id in ['item2', 'item0', 'item1']:
+        update(queue, item_id, 'downloading')
+        update(queue, item_id, 'completed')
+    snapshot = queue_events.open_view('sid', {'filter': 'completed'})
+    assert [item['id'] for item in snapshot['items']] == ['item0', 'item1', 'item2']
+
+def test_tracked_items_are_listed_without_a_change(queue):
+    queue['item0'] = {'id': 'item0', 'status': 'completed'}
+    queue_events.track(queue['item0'])
+    assert queue_events.queue_version == 0
+    assert queue_events.open_view('sid', {'filter': 'completed'})['total'] == 1
+
+def test_changes_since_is_limited_to_history_and_epoch(queue, monkeypatch):
+    monkeypatch.setattr(queue_events, '_history', collections.deque(maxlen=3))
+    for index in range(5):
+        add(queue, f'item{index}')
+    epoch = queue_events.epoch
+    assert [change['version'] for change in queue_events.changes_since(3, epoch)] == [4, 5]
+    assert [change['version'] for change in queue_events.changes_since(2, epoch)] == [3, 4, 5]
+    assert queue_events.changes_since(5, epoch) == []
+    # 履歴より前・未来のバージョンや、別の起動のバージョンからは追いつけない
+    assert queue_events.changes_since(1, epoch) is None
+    assert queue_events.changes_since(6, epoch) is None
+    assert queue_events.changes_since(3, 'other') is None
+    assert queue_events.changes_since('3', epoch) is None
+
+def test_reconnect_inside_history_receives_only_page_changes(queue):
+    for index in range(5):
+        add(queue, f'item{index}')
+    view = {'filter': 'all', 'offset': 0, 'limit': 3}
+    snapshot = queue_events.open_view('old', view)
+    ids = [item['id'] for item in snapshot['items']]
+
+    # 切断中に、ページ外のアイテムの更新と、ページ内のアイテムの更新・削除があった
+    update(queue, 'item4', 'downloading')
+    update(queue, 'item1', 'downloading')
+    remove(queue, 'item0')
+
+    event, patch = queue_events.resume_view('new', view, snapshot['epoch'], snapshot['version'], ids)
+    assert event == 'queue_patch'
+    assert patch['base'] == snapshot['version'] and patch['version'] == queue_events.queue_version
+    assert patch['ids'] == ['item1', 'item2', 'item3']
+    # 変更されたアイテムと、ページに入ってきたアイテムの内容だけが届く
+    assert [change['id'] for change in patch['changes']] == ['item1', 'item3']
+    assert patch['counts']['all'] == 4
+
+def test_reconnect_without_changes_sends_nothing(queue):
+    add(queue, 'item0')
+    snapshot = queue_events.open_view('old', {})
+    assert queue_events.resume_view('new', {}, snapshot['epoch'], snapshot['version'], ['item0']) is None
+    # 以後の変更は通常どおりパッチで届く
+    change = update(queue, 'item0', 'downloading')
+    assert queue_events._page_patch(queue_events._views['new'], [change])[1]['base'] == snapshot['version']
+
+@pytest.mark.parametrize('epoch, version, ids', [
+    ('other', 1, ['item0']),
+    (None, 1, ['item0']),
+    ('current', 1, None),
+    ('current', 0, ['item0']),
+])
+def test_reconnect_outside_history_receives_snapshot(queue, monkeypatch, epoch, version, ids):
+    monkeypatch.setattr(queue_events, '_history', collections.deque(maxlen=1))
+    add(queue, 'item0')
+    add(queue, 'item1')
+    epoch = queue_events.epoch if epoch == 'current' else epoch
+    event, snapshot = queue_events.resume_view('sid', {}, epoch, version, ids)
+    assert event == 'queue_snapshot'
+    assert [item['id'] for item in snapshot['items']] == ['item0', 'item1']
+
+@pytest.mark.parametrize('view, offset, limit', [
+    ({'offset': 'abc', 'limit': []}, 0, queue_events.PAGE_SIZE),
+    ({'offset': -5, 'limit': 0}, 0, 1),
+    ({'offset': '10', 'limit': '50'}, 10, 50),
+    ({'offset': float('inf'), 'limit': 10 ** 9}, 0, queue_events.MAX_PAGE_SIZE),
+    ({'offset': None, 'limit': None}, 0, queue_events.PAGE_SIZE),
+    ('not a view', 0, queue_events.PAGE_SIZE),
+])
+def test_open_view_validates_bounds(view, offset, limit):
+    snapshot = queue_events.open_view('sid', view)
+    assert (snapshot['filter'], snapshot['offset'], snapshot['limit']) == ('all', offset, limit)
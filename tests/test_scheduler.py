@@ -0,0 +1,133 @@
+"""scheduler の優先順位・ホストごとの制限・空いたホストの削除のテスト"""
+import time
+import pytest
+from app import scheduler
+
+@pytest.fixture(autouse=True)
+def clean_scheduler(monkeypatch, clock):
+    for name in ('_hosts', '_waiting_entries', '_running', '_delayed_entries'):
+        monkeypatch.setattr(scheduler, name, {})
+    for name in ('_all_heap', '_ready_heap', '_timers', '_idle_timers', '_delayed_heap'):
+        monkeypatch.setattr(scheduler, name, [])
+    monkeypatch.setattr(scheduler, '_per_host_limit', 0)
+    monkeypatch.setattr(scheduler, '_per_host_rate', 0)
+    clock.install(scheduler)
+
+def test_takes_by_priority_then_order_across_hosts():
+    scheduler.enqueue('a1', 0, 'a.example')
+    scheduler.enqueue('b1', 5, 'b.example')
+    scheduler.enqueue('a2', 5, 'a.example')
+    scheduler.enqueue('c1', 0, 'c.example')
+    assert scheduler.peek(10) == ['b1', 'a2', 'a1', 'c1']
+    assert scheduler.take(10) == ['b1', 'a2', 'a1', 'c1']
+    assert scheduler.waiting_count() == 0
+
+def test_move_to_top_and_set_priority():
+    for index in range(3):
+        scheduler.enqueue(f'i{index}', 0, f'h{index}.example')
+    assert scheduler.move_to_top('i2')
+    assert scheduler.set_priority('i1', 1)
+    assert scheduler.take(3) == ['i2', 'i1', 'i0']
+    assert not scheduler.set_priority('i1', 2)
+
+def test_per_host_limit_parks_host_until_finish():
+    scheduler.configure(per_host_limit=1)
+    scheduler.enqueue('a1', 0, 'a.example')
+    scheduler.enqueue('a2', 0, 'a.example')
+    scheduler.enqueue('b1', 0, 'b.example')
+    assert scheduler.take(10) == ['a1', 'b1']
+    assert scheduler.take(10) == []
+    # 待っているのは実行中のアイテムの終了なので、時刻での再開は無い
+    assert scheduler.next_wakeup() is None
+    scheduler.finish('a1')
+    assert scheduler.take(10) == ['a2']
+
+def test_raising_per_host_limit_resumes_parked_hosts():
+    scheduler.configure(per_host_limit=1)
+    scheduler.enqueue('a1', 0, 'a.example')
+    scheduler.enqueue('a2', 0, 'a.example')
+    assert scheduler.take(10) == ['a1']
+    scheduler.configure(per_host_limit=2)
+    assert scheduler.take(10) == ['a2']
+
+def test_blocked_host_is_skipped_until_block_expires(clock):
+    scheduler.enqueue('a1', 5, 'a.example')
+    scheduler.enqueue('b1', 0, 'b.example')
+    scheduler.block_host('a.example', 30)
+    assert scheduler.take(10) == ['b1']
+    assert scheduler.next_wakeup() == clock.now + 30
+    clock.now += 30
+    assert scheduler.take(10) == ['a1']
+
+def test_rate_limit_spaces_out_starts(clock):
+    # 1分に6件 = 10秒に1件。溜められるのは1件分
+    scheduler.configure(per_host_rate=6)
+    for index in range(3):
+        scheduler.enqueue(f'a{index}', 0, 'a.example')
+    assert scheduler.take(10) == ['a0']
+    assert scheduler.next_wakeup() == pytest.approx(clock.now + 10)
+    clock.now += 5
+    assert scheduler.take(10) == []
+    clock.now += 5
+    assert scheduler.take(10) == ['a1']
+
+def test_deferred_item_returns_after_delay(clock):
+    scheduler.enqueue('a1', 0, 'a.example')
+    assert scheduler.take(1) == ['a1']
+    scheduler.finish('a1')
+    scheduler.defer('a1', 10, 0, 'a.example')
+    assert scheduler.take(1) == []
+    assert scheduler.next_wakeup() == clock.now + 10
+    clock.now += 10
+    assert scheduler.take(1) == ['a1']
+
+def test_empty_hosts_are_pruned():
+    for index in range(100):
+        scheduler.enqueue(f'i{index}', 0, f'h{index}.example')
+    started = scheduler.take(100)
+    assert len(scheduler._hosts) == 100
+    for item_id in started:
+        scheduler.finish(item_id)
+    assert scheduler._hosts == {}
+
+def test_discarded_items_free_their_host():
+    scheduler.enqueue('a1', 0, 'a.example')
+    scheduler.discard('a1')
+    assert scheduler._hosts == {}
+    assert scheduler.take(1) == []
+
+def test_blocked_and_rate_limited_hosts_are_kept_until_state_resets(clock):
+    scheduler.configure(per_host_rate=6)
+    scheduler.enqueue('a1', 0, 'a.example')
+    scheduler.block_host('b.example', 30)
+    assert scheduler.take(1) == ['a1']
+    scheduler.finish('a1')
+    # 使ったトークンが戻るまで、ブロックが解けるまでは状態を残す
+    assert set(scheduler._hosts) == {'a.example', 'b.example'}
+    clock.now += 10
+    scheduler.take(1)
+    assert set(scheduler._hosts) == {'b.example'}
+    clock.now += 20
+    scheduler.take(1)
+    assert scheduler._hosts == {}
+    # 削除後に戻ってきたホストは新しい状態から始まる
+    scheduler.enqueue('a2', 0, 'a.example')
+    assert scheduler.take(1) == ['a2']
+
+@pytest.mark.parametrize('host_count', [50, 5000])
+def test_scheduling_latency_with_10k_waiting_items(host_count):
+    # start_next_download が1件終わるごとに行う処理（空いた枠を埋め、先読み対象と次の起床時刻を調べる）の時間
+    for index in range(10_000):
+        scheduler.enqueue(f'i{index}', index % 5, f'host{index % host_count}.example')
+    running = scheduler.take(10)
+    latencies = []
+    for _ in range(500):
+        scheduler.finish(running.pop(0))
+        started_at = time.perf_counter()
+        running.extend(scheduler.take(10 - len(running)))
+        scheduler.peek(5)
+        scheduler.next_wakeup()
+        latencies.append(time.perf_counter() - started_at)
+    assert len(running) == 10 and scheduler.waiting_count() == 10_000 - 510
+    # 待機キューを走査していれば1回あたり数ミリ秒かかる。遅いCIでも余裕のある上限にしている
+    assert sorted(latencies)[len(latencies) // 2] < 0.001
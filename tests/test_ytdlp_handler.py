@@ -0,0 +1,32 @@
+"""ytdlp_handler のコマンド組み立てと進捗パースのテスト"""
+from app import ytdlp_handler
+
+def info_args(custom_args, cookie_browser='none'):
+    command = ytdlp_handler.build_info_command('https://example.com/watch?v=1',
+                                               {'customArgs': custom_args, 'cookieBrowser': cookie_browser})
+    return None if command is None else command[len(ytdlp_handler.yt_dlp_command()) + 4:]
+
+def test_info_command_forwards_extraction_args():
+    assert info_args('--cookies cookies.txt --proxy socks5://127.0.0.1:1080 --extractor-args youtube:player_client=web') == \
+        ['--cookies', 'cookies.txt', '--proxy', 'socks5://127.0.0.1:1080', '--extractor-args', 'youtube:player_client=web']
+
+def test_info_command_forwards_credentials_and_headers():
+    assert info_args('-u user -p "pass word" --add-header Referer:https://example.com --geo-bypass-country=JP') == \
+        ['-u', 'user', '-p', 'pass word', '--add-header', 'Referer:https://example.com', '--geo-bypass-country=JP']
+
+def test_info_command_drops_download_only_args():
+    assert info_args('-o "%(id)s.%(ext)s" --limit-rate 1M --embed-thumbnail --exec "echo {}"') == []
+
+def test_info_command_skipped_for_unknown_args():
+    assert info_args('--some-new-option value') is None
+    assert info_args('--proxy http://proxy --write-info-json') is None
+
+def test_info_command_keeps_cookie_browser():
+    assert info_args('', cookie_browser='firefox') == ['--cookies-from-browser', 'firefox']
+    assert info_args('--cookies c.txt', cookie_browser='firefox') == ['--cookies', 'c.txt']
+
+def test_download_command_skips_archived_videos(monkeypatch, tmp_path):
+    monkeypatch.setattr(ytdlp_handler.archive, 'SPOOL_DIR', str(tmp_path))
+    command = ytdlp_handler.build_download_command({'id': 'item1', 'url': 'https://example.com/watch?v=1',
+                                                    'options': {'cookieBrowser': 'none'}})
+    assert command[command.index('--download-archive') + 1] == ytdlp_handler.archive.ARCHIVE_FILE